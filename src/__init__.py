@@ -5,22 +5,94 @@
 #    :copyright: (c) 2015 by Fanout, Inc.
 #    :license: MIT, see LICENSE for more details.
 
-from .gripcontrol import (
-    create_hold,
-    parse_grip_uri,
-    validate_sig,
-    create_grip_channel_header,
-    create_hold_response,
-    create_hold_stream,
-    decode_websocket_events,
-    encode_websocket_events,
-    websocket_control_message,
+# The public names of the package are imported lazily on first access so
+# that importing the package does not pull in jwt, pubcontrol and their
+# dependencies until something that needs them (such as validate_sig or
+# GripPubControl) is used. Python versions without module __getattr__
+# support import everything eagerly.
+
+import sys
+from importlib import import_module
+
+# Map of each public name to the submodule that defines it.
+_exports = {
+    "create_hold": "gripcontrol",
+    "parse_grip_uri": "gripcontrol",
+    "validate_sig": "gripcontrol",
+    "create_grip_channel_header": "gripcontrol",
+    "create_grip_keep_alive_header": "gripcontrol",
+    "create_hold_response": "gripcontrol",
+    "create_hold_stream": "gripcontrol",
+    "create_hold_http_response": "gripcontrol",
+    "decode_websocket_events": "gripcontrol",
+    "decode_websocket_events_many": "gripcontrol",
+    "encode_websocket_events": "gripcontrol",
+    "websocket_control_message": "gripcontrol",
+    "set_json_backend": "jsonbackend",
+    "get_json_backend": "jsonbackend",
+    "Response": "response",
+    "ResponseTemplate": "responsetemplate",
+    "HeaderSet": "headerset",
+    "Channel": "channel",
+    "filter_meta": "gripfilters",
+    "SKIP_SELF": "gripfilters",
+    "SKIP_USERS": "gripfilters",
+    "REQUIRE_SUB": "gripfilters",
+    "BUILD_ID": "gripfilters",
+    "VAR_SUBST": "gripfilters",
+    "GripSigVerifier": "gripsigverifier",
+    "WebSocketEvent": "websocketevent",
+    "WebSocketEventBatch": "websocketeventbatch",
+    "WebSocketContext": "websocketcontext",
+    "WebSocketContextPool": "websocketcontextpool",
+    "WebSocketMessageFormat": "websocketmessageformat",
+    "HttpResponseFormat": "httpresponseformat",
+    "HttpStreamFormat": "httpstreamformat",
+    "GripPubControl": "grippubcontrol",
+    "GripPubControlClient": "grippubcontrolclient",
+    "RetryPolicy": "retrypolicy",
+    "CircuitBreaker": "circuitbreaker",
+    "JwtCache": "jwtcache",
+    "PublishMetrics": "publishmetrics",
+    "LatencyHistogram": "publishmetrics",
+    "ChannelSequencer": "channelsequencer",
+    "StreamCoalescer": "streamcoalescer",
+    "PublishLane": "publishlane",
+    "PublishSidecar": "publishsidecar",
+    "SidecarPubControl": "publishsidecar",
+    "GripContext": "gripmiddleware",
+    "GripMiddleware": "gripmiddleware",
+    "AsgiGripMiddleware": "asgigripmiddleware",
+    "GripProxyStub": "gripproxystub",
+    "create_websocket_request_body": "gripproxystub",
+}
+
+# Names whose modules use Python 3 only syntax.
+_python3_only = (
+    "AsgiGripMiddleware",
+    "GripProxyStub",
+    "create_websocket_request_body",
 )
-from .response import Response
-from .channel import Channel
-from .websocketevent import WebSocketEvent
-from .websocketcontext import WebSocketContext
-from .websocketmessageformat import WebSocketMessageFormat
-from .httpresponseformat import HttpResponseFormat
-from .httpstreamformat import HttpStreamFormat
-from .grippubcontrol import GripPubControl
+
+__all__ = sorted(_exports)
+
+
+# Import the submodule defining the specified public name on first access
+# and cache the value in the package namespace.
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(import_module("." + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
+
+
+if sys.version_info < (3, 7):
+    for _name in _exports:
+        if sys.version_info >= (3,) or _name not in _python3_only:
+            __getattr__(_name)
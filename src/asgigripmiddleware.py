@@ -0,0 +1,124 @@
+#    asgigripmiddleware.py
+#    ~~~~~~~~~
+#    This module implements the AsgiGripMiddleware class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+from .gripmiddleware import GripContext, GRIP_CONTEXT_KEY, _is_websocket_request
+
+
+# The AsgiGripMiddleware class is the ASGI counterpart of GripMiddleware.
+# It creates a GripContext for every HTTP request and stores it in the
+# scope under GRIP_CONTEXT_KEY. For WebSocket-over-HTTP requests the body
+# is read before the application is called (and replayed to it) so that
+# the events can be decoded synchronously when the handler first accesses
+# the websocket context. Responses are handled like in GripMiddleware.
+class AsgiGripMiddleware(object):
+
+    # Initialize with the ASGI application to wrap and the optional key and
+    # issuer used to validate the Grip-Sig header. Set buffered to True to
+    # have websocket contexts write outgoing events straight into a buffer.
+    def __init__(self, app, key=None, iss=None, grip_prefix="", buffered=False):
+        self.app = app
+        self.key = key
+        self.iss = iss
+        self.grip_prefix = grip_prefix
+        self.buffered = buffered
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict()
+        for name, value in scope.get("headers", []):
+            headers[name.decode("latin-1").lower()] = value.decode("latin-1")
+        body = None
+        if _is_websocket_request(headers):
+            messages = list()
+            chunks = list()
+            while True:
+                message = await receive()
+                messages.append(message)
+                if message["type"] != "http.request":
+                    break
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    break
+            body = b"".join(chunks)
+            receive = _replay(messages, receive)
+
+        grip = GripContext(
+            headers, body, self.key, self.iss, self.grip_prefix, self.buffered
+        )
+        scope = dict(scope)
+        scope[GRIP_CONTEXT_KEY] = grip
+
+        state = {"start": None, "body": list()}
+
+        async def grip_send(message):
+            if message["type"] == "http.response.start":
+                if grip.websocket_used:
+                    # decided once the body is known
+                    state["start"] = message
+                    return
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + _encode(
+                    grip.get_response_headers()
+                )
+                await send(message)
+                return
+            if message["type"] == "http.response.body" and state["start"]:
+                state["body"].append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                await _send_buffered(grip, state, send)
+                return
+            await send(message)
+
+        await self.app(scope, receive, grip_send)
+
+
+# An internal coroutine for sending a buffered response, replacing it with
+# the WebSocket events if the handler used the websocket context.
+async def _send_buffered(grip, state, send):
+    start = state["start"]
+    body = b"".join(state["body"])
+    headers = list(start.get("headers", []))
+    if grip.should_encode_websocket(start["status"], not body):
+        ws_headers, body = grip.get_websocket_response()
+        headers = [
+            (name, value)
+            for name, value in headers
+            if name.lower() not in (b"content-type", b"content-length")
+        ]
+        headers.extend(_encode(ws_headers))
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    else:
+        headers.extend(_encode(grip.get_response_headers()))
+    await send(
+        {"type": "http.response.start", "status": start["status"], "headers": headers}
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+# An internal method for returning a receive callable that first replays
+# the specified messages.
+def _replay(messages, receive):
+    messages = list(messages)
+
+    async def replay_receive():
+        if messages:
+            return messages.pop(0)
+        return await receive()
+
+    return replay_receive
+
+
+# An internal method for encoding (name, value) header pairs for ASGI.
+def _encode(headers):
+    return [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in headers
+    ]
@@ -7,11 +7,14 @@
 
 
 # The Channel class is used to represent a channel in a GRIP proxy and
-# tracks the previous ID of the last message.
+# tracks the previous ID of the last message and the subscription filters
+# the proxy applies before delivering messages on the channel, such as
+# 'skip-self' (see the gripfilters module).
 class Channel(object):
 
-    # Initialize with the channel name and an optional previous ID.
-    def __init__(self, name, prev_id=None):
+    # Initialize with the channel name, an optional previous ID and an
+    # optional list of filter names.
+    def __init__(self, name, prev_id=None, filters=None):
         self.name = name
         self.prev_id = prev_id
-        self.filters = []
+        self.filters = list(filters) if filters else []
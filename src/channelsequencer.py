@@ -0,0 +1,101 @@
+#    channelsequencer.py
+#    ~~~~~~~~~
+#    This module implements the ChannelSequencer class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import itertools
+import os
+import random
+import threading
+from collections import OrderedDict
+
+
+# The ChannelSequencer class assigns message IDs for published items and
+# remembers the last ID published to each channel so that the previous ID
+# can be filled in automatically, allowing a GRIP proxy to detect gaps. IDs
+# are taken from a single counter shared by all channels and therefore
+# increase monotonically. Channels are spread over a number of stripes,
+# each with its own lock, so threads publishing to different channels
+# rarely contend. Each stripe evicts its least recently used channels once
+# the configured maximum is reached; the next message to an evicted
+# channel is published without a previous ID. IDs are qualified with a
+# namespace made of the process ID and a random value, so that processes
+# publishing to the same channel, whether forked from a common parent or
+# started separately, never publish the same IDs. In a forked child
+# process the sequencer starts over with no channels and a new namespace.
+class ChannelSequencer(object):
+
+    # Initialize with the maximum number of channels to track, the number of
+    # lock stripes and an optional prefix prepended to every ID.
+    def __init__(self, max_channels=10000, stripes=16, prefix=""):
+        if stripes < 1:
+            raise ValueError("stripes must be at least 1")
+        self.prefix = prefix
+        self._namespace = _make_namespace()
+        self._counter = itertools.count(1)
+        self._stripes = [(threading.Lock(), OrderedDict()) for n in range(stripes)]
+        self._max_per_stripe = max(1, max_channels // stripes)
+
+    # Assign the next ID for the specified channel. Returns a tuple of the
+    # new ID and the previous ID for the channel (None if unknown).
+    def sequence(self, channel):
+        lock, last_ids = self._stripe(channel)
+        lock.acquire()
+        try:
+            id = "%s%s%d" % (self.prefix, self._namespace, next(self._counter))
+            prev_id = last_ids.pop(channel, None)
+            last_ids[channel] = id
+            if len(last_ids) > self._max_per_stripe:
+                last_ids.popitem(last=False)
+        finally:
+            lock.release()
+        return (id, prev_id)
+
+    # Return the last ID assigned for the specified channel or None.
+    def last_id(self, channel):
+        lock, last_ids = self._stripe(channel)
+        lock.acquire()
+        id = last_ids.get(channel)
+        lock.release()
+        return id
+
+    # Forget the last ID of the specified channel, or of all channels if
+    # no channel is specified.
+    def reset(self, channel=None):
+        if channel is not None:
+            lock, last_ids = self._stripe(channel)
+            lock.acquire()
+            last_ids.pop(channel, None)
+            lock.release()
+            return
+        for lock, last_ids in self._stripes:
+            lock.acquire()
+            last_ids.clear()
+            lock.release()
+
+    # The number of channels currently tracked.
+    def __len__(self):
+        return sum(len(last_ids) for lock, last_ids in self._stripes)
+
+    # An internal method for reinitializing the sequencer in a forked child
+    # process. The last IDs of the parent are dropped and IDs get a new
+    # namespace.
+    def _after_fork(self):
+        self._namespace = _make_namespace()
+        self._counter = itertools.count(1)
+        self._stripes = [
+            (threading.Lock(), OrderedDict()) for lock, last_ids in self._stripes
+        ]
+
+    # An internal method for getting the (lock, last IDs) stripe of the
+    # specified channel.
+    def _stripe(self, channel):
+        return self._stripes[hash(channel) % len(self._stripes)]
+
+
+# An internal method for creating an ID namespace for the current process,
+# made of the process ID and a random value.
+def _make_namespace():
+    return "%d-%06x-" % (os.getpid(), random.SystemRandom().getrandbits(24))
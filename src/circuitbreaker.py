@@ -0,0 +1,106 @@
+#    circuitbreaker.py
+#    ~~~~~~~~~
+#    This module implements the CircuitBreaker class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+# The CircuitBreaker class tracks the health of a single GRIP control
+# endpoint. The breaker starts closed and opens after failure_threshold
+# consecutive failures. While open, requests are rejected without being
+# attempted. Once reset_timeout seconds have passed the breaker becomes
+# half-open and lets a single probe request through: a success closes the
+# breaker again and a failure re-opens it for another reset_timeout. All
+# methods are thread-safe.
+class CircuitBreaker(object):
+
+    # Initialize with the number of consecutive failures that opens the
+    # breaker and the number of seconds to wait before probing again.
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    # The current state of the breaker: 'closed', 'open' or 'half-open'.
+    @property
+    def state(self):
+        self._lock.acquire()
+        try:
+            self._update_state()
+            return self._state
+        finally:
+            self._lock.release()
+
+    # Return True if requests are currently being rejected. This check does
+    # not consume the half-open probe and is cheap enough to call on every
+    # publish.
+    def is_open(self):
+        return self.state == OPEN
+
+    # Return True if a request may be attempted now. When the breaker is
+    # half-open only the first caller is allowed through until the result
+    # of that probe is recorded.
+    def allow_request(self):
+        self._lock.acquire()
+        try:
+            self._update_state()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    # Record a successful request, closing the breaker.
+    def record_success(self):
+        self._lock.acquire()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock.release()
+
+    # Record a failed request. A failed half-open probe or reaching the
+    # failure threshold opens the breaker.
+    def record_failure(self):
+        self._lock.acquire()
+        self._failures += 1
+        if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+            self._state = OPEN
+            self._opened_at = time.time()
+        self._probe_in_flight = False
+        self._lock.release()
+
+    # Return the breaker to its initial closed state.
+    def reset(self):
+        self.record_success()
+
+    # An internal method for reinitializing the breaker in a forked child
+    # process. A probe in flight in the parent never completes in the child,
+    # so the child may send its own.
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._probe_in_flight = False
+
+    # An internal method that moves an open breaker to half-open once the
+    # reset timeout has elapsed. Must be called with the lock held.
+    def _update_state(self):
+        if self._state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
@@ -14,16 +14,32 @@
 # control messages.
 
 import sys
-from datetime import datetime
-import calendar
+import time
 from base64 import b64encode, b64decode
-from copy import deepcopy
-import json
-import jwt
+from .jsonbackend import json_dumps, json_dumps_bytes
 from .channel import Channel
 from .response import Response
-from .websocketevent import WebSocketEvent
-from six.moves.urllib_parse import urlparse, parse_qs, urlencode
+from .websocketevent import (
+    WebSocketEvent,
+    decode_event_type,
+    _TYPES_BY_NAME,
+    _check_event_payload,
+    _parse_event_length,
+)
+from .websocketeventbatch import (
+    WebSocketEventBatch,
+    _scan_body,
+    _initial_type_codes,
+)
+
+try:
+    from urllib.parse import urlparse, parse_qs, urlencode
+except ImportError:
+    from urlparse import urlparse, parse_qs
+    from urllib import urlencode
+
+# NOTE: jwt is imported on first use in validate_sig to keep the package
+# cheap to import for processes that never validate signatures.
 
 
 is_python3 = sys.version_info >= (3,)
@@ -80,8 +96,14 @@ def parse_grip_uri(uri):
 
 # Validate the specified JWT token and key. This method is used to validate
 # the GRIP-SIG header coming from GRIP proxies such as Pushpin or Fanout.io.
-# Note that the token expiration is also verified.
+# Note that the token expiration is also verified. The key can also be a
+# GripSigVerifier to validate against a keyset.
 def validate_sig(token, key, iss=None):
+    if hasattr(key, "validate"):
+        return key.validate(token, iss)
+
+    import jwt
+
     # jwt expects the token in utf-8
     if _is_unicode_instance(token):
         token = token.encode("utf-8")
@@ -127,48 +149,226 @@ def create_grip_channel_header(channels):
 # either a string representing the channel name, a Channel instance or an
 # array of Channel instances. The response parameter can be specified as
 # either a string representing the response body or a Response instance.
-def create_hold(mode, channels, response, timeout=None):
+# The optional timeout_jitter parameter is a fraction between 0 and 1 by
+# which the timeout is randomly shortened or lengthened, so that clients
+# held at the same moment don't all time out and reconnect together. If
+# keep_alive is specified, the GRIP proxy sends that content whenever the
+# held connection has been idle for keep_alive_interval seconds (or the
+# proxy's default). The keep_alive_format parameter can be set to 'raw',
+# 'cstring' or 'base64' to choose how the content is encoded in the
+# instructions; by default text is sent as-is and binary content as base64.
+# Text is sent as-is for both 'raw' and 'cstring', since JSON escapes it.
+# The instructions are returned as a JSON string, or as UTF-8 encoded bytes
+# if as_bytes is set to True.
+def create_hold(
+    mode,
+    channels,
+    response,
+    timeout=None,
+    as_bytes=False,
+    timeout_jitter=None,
+    keep_alive=None,
+    keep_alive_format=None,
+    keep_alive_interval=None,
+):
     hold = dict()
     hold["mode"] = mode
     channels = _parse_channels(channels)
     ichannels = _get_hold_channels(channels)
     hold["channels"] = ichannels
     if timeout:
-        hold["timeout"] = timeout
+        hold["timeout"] = _jitter_timeout(timeout, timeout_jitter)
+    if keep_alive is not None:
+        hold["keep-alive"] = _get_hold_keep_alive(
+            keep_alive, keep_alive_format, keep_alive_interval
+        )
+    if hasattr(response, "_to_json"):
+        # responses created from a ResponseTemplate carry most of their
+        # JSON already
+        out = json_dumps({"hold": hold})
+        response_json = response._to_json()
+        if response_json != "{}":
+            out = out[:-1] + ', "response": ' + response_json + "}"
+        if as_bytes:
+            return out.encode("utf-8")
+        return out
     iresponse = _get_hold_response(response)
     instruct = dict()
     instruct["hold"] = hold
     if iresponse:
         instruct["response"] = iresponse
 
-    return json.dumps(instruct)
+    if as_bytes:
+        return json_dumps_bytes(instruct)
+    return json_dumps(instruct)
 
 
 # A convenience method for creating GRIP hold response instructions for HTTP
 # long-polling. This method simply passes the specified parameters to the
 # create_hold method with 'response' as the hold mode.
-def create_hold_response(channels, response=None, timeout=None):
-    return create_hold("response", channels, response, timeout)
+def create_hold_response(
+    channels,
+    response=None,
+    timeout=None,
+    as_bytes=False,
+    timeout_jitter=None,
+    keep_alive=None,
+    keep_alive_format=None,
+    keep_alive_interval=None,
+):
+    return create_hold(
+        "response",
+        channels,
+        response,
+        timeout,
+        as_bytes,
+        timeout_jitter,
+        keep_alive,
+        keep_alive_format,
+        keep_alive_interval,
+    )
 
 
 # A convenience method for creating GRIP hold stream instructions for HTTP
 # streaming. This method simply passes the specified parameters to the
-# create_hold method with 'stream' as the hold mode.
-def create_hold_stream(channels, response=None):
-    return create_hold("stream", channels, response)
+# create_hold method with 'stream' as the hold mode. Stream holds don't
+# time out, but a keep-alive stops intermediaries from closing them while
+# they are idle.
+def create_hold_stream(
+    channels,
+    response=None,
+    as_bytes=False,
+    keep_alive=None,
+    keep_alive_format=None,
+    keep_alive_interval=None,
+):
+    return create_hold(
+        "stream",
+        channels,
+        response,
+        as_bytes=as_bytes,
+        keep_alive=keep_alive,
+        keep_alive_format=keep_alive_format,
+        keep_alive_interval=keep_alive_interval,
+    )
+
+
+# Create the complete HTTP response that instructs a GRIP proxy to hold the
+# request, choosing the cheapest encoding for the specified response. If
+# the response body is binary the instructions are sent as Grip-Hold,
+# Grip-Channel, Grip-Timeout and Grip-Keep-Alive headers and the body is
+# sent as raw bytes, avoiding the base64 encoding that 'body-bin' in JSON
+# instructions requires. Otherwise JSON instructions with the
+# 'application/grip-instruct' content type are created. The timeout jitter
+# and keep-alive parameters are as for create_hold. Returns a tuple of the
+# status code, reason (None for the default), list of (name, value)
+# headers and body bytes.
+def create_hold_http_response(
+    mode,
+    channels,
+    response=None,
+    timeout=None,
+    timeout_jitter=None,
+    keep_alive=None,
+    keep_alive_format=None,
+    keep_alive_interval=None,
+):
+    if response is not None and (
+        _is_basestring_instance(response) or isinstance(response, bytes)
+    ):
+        response = Response(body=response)
+    if response is not None and response.body:
+        is_text, val = _bin_or_text(response.body)
+        if not is_text:
+            headers = [("Grip-Hold", mode)]
+            headers.append(("Grip-Channel", create_grip_channel_header(channels)))
+            if timeout:
+                headers.append(
+                    ("Grip-Timeout", str(_jitter_timeout(timeout, timeout_jitter)))
+                )
+            if keep_alive is not None:
+                headers.append(
+                    (
+                        "Grip-Keep-Alive",
+                        create_grip_keep_alive_header(
+                            keep_alive, keep_alive_format, keep_alive_interval
+                        ),
+                    )
+                )
+            if response.headers:
+                headers.extend(response.headers.items())
+            return (response.code or 200, response.reason, headers, val)
+    body = create_hold(
+        mode,
+        channels,
+        response,
+        timeout,
+        True,
+        timeout_jitter,
+        keep_alive,
+        keep_alive_format,
+        keep_alive_interval,
+    )
+    return (200, None, [("Content-Type", "application/grip-instruct")], body)
+
+
+# Create a Grip-Keep-Alive header value for the specified keep-alive
+# content and optional format and interval in seconds. The format can be
+# 'raw', 'cstring' or 'base64'. By default, binary content is encoded as
+# base64, text containing only CR, LF, tab or backslash characters that
+# can't be sent as-is is escaped as a C string, and any other text that
+# can't be sent as-is is encoded as base64.
+def create_grip_keep_alive_header(content, format=None, interval=None):
+    is_text, val = _bin_or_text(content)
+    if format is None:
+        if not is_text:
+            format = "base64"
+        elif _is_raw_keep_alive(val):
+            format = "raw"
+        elif _is_raw_keep_alive(_escape_cstring(val)):
+            format = "cstring"
+        else:
+            format = "base64"
+    if format == "base64":
+        if is_text:
+            val = val.encode("utf-8")
+        s = b64encode(val).decode("utf-8")
+    elif not is_text:
+        raise ValueError("binary keep-alive content must use base64 format")
+    elif format == "cstring":
+        s = _escape_cstring(val)
+    elif format == "raw":
+        s = val
+    else:
+        raise ValueError("unknown keep-alive format: %s" % format)
+    if format != "raw":
+        s += "; format=%s" % format
+    if interval:
+        s += "; timeout=%d" % interval
+    return s
 
 
 # Decode the specified HTTP request body into an array of WebSocketEvent
-# instances when using the WebSocket-over-HTTP protocol. A RuntimeError
-# is raised if the format is invalid.
-def decode_websocket_events(body):
+# instances when using the WebSocket-over-HTTP protocol. A ValueError is
+# raised if the format is invalid. The optional max_total, max_events and
+# max_payload parameters limit the body size, the number of events and the
+# content size of a single event, and in strict mode every payload must be
+# fully present and followed by CRLF. Limits are checked before anything
+# is allocated for the offending part of the body.
+def decode_websocket_events(
+    body, strict=False, max_events=None, max_payload=None, max_total=None
+):
     if is_python3:
         if not isinstance(body, bytes):
             raise ValueError("body must be bytes")
+    if max_total is not None and len(body) > max_total:
+        raise ValueError("body too large")
 
     out = list()
     start = 0
     while start < len(body):
+        if max_events is not None and len(out) >= max_events:
+            raise ValueError("too many events")
         if is_python3:
             at = body.find(b"\r\n", start)
             if at == -1:
@@ -178,14 +378,14 @@ def decode_websocket_events(body):
 
             at = typeline.find(b" ")
             if at != -1:
-                etype = typeline[:at].decode("utf-8")
-                clen = int(b"0x" + typeline[at + 1 :], 16)
+                etype = decode_event_type(typeline[:at])
+                clen = _parse_event_length(typeline[at + 1 :])
+                _check_event_payload(body, start, clen, max_payload, strict)
                 content = body[start : start + clen]
                 start += clen + 2
                 e = WebSocketEvent(etype, content)
             else:
-                etype = typeline.decode("utf-8")
-                e = WebSocketEvent(etype)
+                e = WebSocketEvent(decode_event_type(typeline))
         else:
             at = body.find("\r\n", start)
             if at == -1:
@@ -195,23 +395,89 @@ def decode_websocket_events(body):
 
             at = typeline.find(" ")
             if at != -1:
-                etype = typeline[:at]
-                clen = int("0x" + typeline[at + 1 :], 16)
+                etype = _TYPES_BY_NAME.get(typeline[:at], typeline[:at])
+                clen = _parse_event_length(typeline[at + 1 :])
+                _check_event_payload(body, start, clen, max_payload, strict)
                 content = body[start : start + clen]
                 start += clen + 2
                 e = WebSocketEvent(etype, content)
             else:
-                e = WebSocketEvent(typeline)
+                e = WebSocketEvent(_TYPES_BY_NAME.get(typeline, typeline))
 
         out.append(e)
 
     return out
 
 
-# Encode the specified array of WebSocketEvent instances. The returned string
-# value should then be passed to a GRIP proxy in the body of an HTTP response
-# when using the WebSocket-over-HTTP protocol.
+# Decode many WebSocket-over-HTTP request bodies at once into a single
+# WebSocketEventBatch holding the events in columnar form (type codes,
+# offsets and lengths, and one payload buffer made of the joined bodies)
+# rather than as WebSocketEvent instances. When workers is greater than 1
+# the bodies are split into chunks of chunk_size bodies that are scanned in
+# a process pool, either created for the call or taken from the executor
+# parameter. A ValueError is raised if any body has an invalid format. The
+# strict and limit parameters are applied to each body as described for
+# decode_websocket_events.
+def decode_websocket_events_many(
+    bodies,
+    workers=None,
+    chunk_size=None,
+    executor=None,
+    strict=False,
+    max_events=None,
+    max_payload=None,
+    max_total=None,
+):
+    bodies = list(bodies)
+    for body in bodies:
+        if not isinstance(body, bytes):
+            raise ValueError("body must be bytes")
+        if max_total is not None and len(body) > max_total:
+            raise ValueError("body too large")
+    limits = (strict, max_events, max_payload)
+
+    batch = WebSocketEventBatch()
+    if executor is None and (workers is None or workers <= 1):
+        type_codes = _initial_type_codes()
+        base = 0
+        for body in bodies:
+            _scan_body(batch, body, base, type_codes, *limits)
+            base += len(body)
+        batch.payload = b"".join(bodies)
+        return batch
+
+    if chunk_size is None:
+        chunk_size = max(1, len(bodies) // (4 * (workers or 4)) + 1)
+    chunks = [bodies[n : n + chunk_size] for n in range(0, len(bodies), chunk_size)]
+    own_executor = executor is None
+    if own_executor:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        base = 0
+        for chunk, result in zip(
+            chunks,
+            executor.map(
+                _decode_websocket_events_chunk, chunks, [limits] * len(chunks)
+            ),
+        ):
+            batch._extend(result, base)
+            base += sum(len(body) for body in chunk)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    batch.payload = b"".join(bodies)
+    return batch
+
+
+# Encode the specified array of WebSocketEvent instances or the specified
+# WebSocketEventBatch. The returned string value should then be passed to a
+# GRIP proxy in the body of an HTTP response when using the
+# WebSocket-over-HTTP protocol.
 def encode_websocket_events(events):
+    if isinstance(events, WebSocketEventBatch):
+        return events.encode()
     if is_python3:
         out = b""
         for e in events:
@@ -247,14 +513,73 @@ def encode_websocket_events(events):
 # Generate a WebSocket control message with the specified type and optional
 # arguments. WebSocket control messages are passed to GRIP proxies and
 # example usage includes subscribing/unsubscribing a WebSocket connection
-# to/from a channel.
-def websocket_control_message(type, args=None):
+# to/from a channel. The message is returned as a JSON string, or as UTF-8
+# encoded bytes if as_bytes is set to True.
+def websocket_control_message(type, args=None, as_bytes=False):
     if args:
-        out = deepcopy(args)
+        out = dict(args)
     else:
         out = dict()
     out["type"] = type
-    return json.dumps(out)
+    if as_bytes:
+        return json_dumps_bytes(out)
+    return json_dumps(out)
+
+
+# An internal method for applying the specified jitter, a fraction of the
+# timeout, to the specified timeout. The result is picked uniformly from
+# the jittered range and is a whole number of seconds of at least 1.
+def _jitter_timeout(timeout, jitter):
+    if not jitter:
+        return timeout
+    if jitter < 0 or jitter >= 1:
+        raise ValueError("timeout_jitter must be between 0 and 1")
+    import random
+
+    spread = timeout * jitter
+    return max(1, int(round(timeout + random.uniform(-spread, spread))))
+
+
+# Get a hash representing the specified keep-alive parameters. The
+# resulting hash is used for creating GRIP proxy hold instructions. Since
+# JSON escapes control characters itself, text in the 'raw' and 'cstring'
+# formats is sent unescaped as 'content'. As in the Grip-Keep-Alive
+# header, binary content can only use the 'base64' format.
+def _get_hold_keep_alive(content, format=None, interval=None):
+    ikeep_alive = dict()
+    is_text, val = _bin_or_text(content)
+    if format not in (None, "raw", "cstring", "base64"):
+        raise ValueError("unknown keep-alive format: %s" % format)
+    if format in ("raw", "cstring") and not is_text:
+        raise ValueError("binary keep-alive content must use base64 format")
+    if is_text and format != "base64":
+        ikeep_alive["content"] = val
+    else:
+        if is_text:
+            val = val.encode("utf-8")
+        ikeep_alive["content-bin"] = b64encode(val).decode("utf-8")
+    if interval:
+        ikeep_alive["timeout"] = interval
+    return ikeep_alive
+
+
+# An internal method used for determining whether the specified keep-alive
+# content can be sent as-is in a Grip-Keep-Alive header.
+def _is_raw_keep_alive(s):
+    for c in s:
+        if c == ";" or c == "," or ord(c) < 0x20 or ord(c) > 0x7E:
+            return False
+    return True
+
+
+# An internal method for escaping the specified text as a C string.
+def _escape_cstring(s):
+    return (
+        s.replace("\\", "\\\\")
+        .replace("\r", "\\r")
+        .replace("\n", "\\n")
+        .replace("\t", "\\t")
+    )
 
 
 # Parse the specified parameter into an array of Channel instances. The
@@ -281,6 +606,8 @@ def _get_hold_channels(channels):
         ichannel["name"] = c.name
         if c.prev_id:
             ichannel["prev-id"] = c.prev_id
+        if c.filters:
+            ichannel["filters"] = list(c.filters)
         ichannels.append(ichannel)
     return ichannels
 
@@ -345,4 +672,17 @@ def _bin_or_text(s):
 
 # An internal method used for getting the current UNIX UTC timestamp.
 def _timestamp_utcnow():
-    return calendar.timegm(datetime.utcnow().utctimetuple())
+    return int(time.time())
+
+
+# An internal method used by decode_websocket_events_many for scanning a
+# chunk of bodies in a worker process. The returned batch has no payload
+# since the caller already holds the bodies.
+def _decode_websocket_events_chunk(bodies, limits):
+    batch = WebSocketEventBatch()
+    type_codes = _initial_type_codes()
+    base = 0
+    for body in bodies:
+        _scan_body(batch, body, base, type_codes, *limits)
+        base += len(body)
+    return batch
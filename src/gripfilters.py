@@ -0,0 +1,62 @@
+#    gripfilters.py
+#    ~~~~~~~~~
+#    This module implements the GRIP filter names and the filter_meta method.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+# Subscription filters, set on a Channel with the filters parameter. The GRIP
+# proxy evaluates them for each subscriber before delivering a message, using
+# the message's meta values (see filter_meta) and the subscriber's meta
+# values (set with the Grip-Set-Meta header).
+
+# Don't deliver a message to the subscriber whose 'user' meta value matches
+# the message's 'sender' meta value.
+SKIP_SELF = "skip-self"
+
+# Don't deliver a message to subscribers whose 'user' meta value is in the
+# message's comma-separated 'skip_users' meta value.
+SKIP_USERS = "skip-users"
+
+# Only deliver a message to subscribers that are also subscribed to the
+# channel in the message's 'require_sub' meta value.
+REQUIRE_SUB = "require-sub"
+
+# Content filters, set on an HttpResponseFormat or HttpStreamFormat with the
+# content_filters parameter or the add_content_filters method. The GRIP
+# proxy applies them to the content of a message for each subscriber.
+
+# Replace '%(build-id)s' in the content with the proxy's build ID.
+BUILD_ID = "build-id"
+
+# Replace '%(name)s' in the content with the subscriber's meta values.
+VAR_SUBST = "var-subst"
+
+
+# Create the meta values of a published Item for the subscription filters:
+# the sender compared by SKIP_SELF, the list of users skipped by SKIP_USERS
+# and the channel required by REQUIRE_SUB. Only the specified values are
+# included. The returned dict can be passed as the meta parameter of the
+# publish methods or of an Item.
+def filter_meta(sender=None, skip_users=None, require_sub=None):
+    meta = dict()
+    if sender is not None:
+        meta["sender"] = sender
+    if skip_users:
+        if not isinstance(skip_users, (list, tuple, set, frozenset)):
+            skip_users = [skip_users]
+        meta["skip_users"] = ",".join(skip_users)
+    if require_sub is not None:
+        meta["require_sub"] = require_sub
+    return meta
+
+
+# An internal method for adding the specified content filters to those of
+# the specified HttpResponseFormat or HttpStreamFormat, skipping filters
+# that are already present.
+def _add_content_filters(format, filters):
+    content_filters = list(format.content_filters or [])
+    for f in filters:
+        if f not in content_filters:
+            content_filters.append(f)
+    format.content_filters = content_filters
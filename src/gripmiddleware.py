@@ -0,0 +1,312 @@
+#    gripmiddleware.py
+#    ~~~~~~~~~
+#    This module implements the GripContext and GripMiddleware classes.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+from struct import pack
+from .gripcontrol import (
+    validate_sig,
+    create_grip_channel_header,
+    create_grip_keep_alive_header,
+    decode_websocket_events,
+    encode_websocket_events,
+    _jitter_timeout,
+)
+from .websocketevent import WebSocketEvent, OPEN, CLOSE
+from .websocketcontext import WebSocketContext
+
+# The key under which the GripContext is stored in the WSGI environ or the
+# ASGI scope.
+GRIP_CONTEXT_KEY = "gripcontrol.context"
+
+
+# The GripContext class holds the GRIP information for a single request.
+# It is created by the middleware and made available to handlers via the
+# WSGI environ or ASGI scope. The Grip-Sig header is validated at most once
+# per request and WebSocket-over-HTTP events are only decoded when the
+# handler first accesses the 'websocket' property. Handlers can also ask
+# for the request to be held, in which case the middleware adds the GRIP
+# instruction headers to the response.
+class GripContext(object):
+
+    # Initialize with a dict of request headers keyed by lowercase name, the
+    # request body as bytes or a callable returning it, and the optional key
+    # and issuer used to validate the Grip-Sig header. The grip_prefix and
+    # buffered parameters are passed to the WebSocketContext.
+    def __init__(
+        self, headers, body=None, key=None, iss=None, grip_prefix="", buffered=False
+    ):
+        self.headers = headers
+        self.hold_mode = None
+        self.hold_channels = None
+        self.hold_timeout = None
+        self.hold_keep_alive = None
+        self._body = body
+        self._key = key
+        self._iss = iss
+        self._grip_prefix = grip_prefix
+        self._buffered = buffered
+        self._signed = None
+        self._websocket = None
+
+    # True if the request was forwarded by a GRIP proxy. When a key is
+    # configured the Grip-Sig header must also be valid.
+    @property
+    def proxied(self):
+        if self._key is not None:
+            return self.signed
+        return "grip-sig" in self.headers
+
+    # True if the request carries a valid Grip-Sig header. The result is
+    # computed once and cached for the rest of the request.
+    @property
+    def signed(self):
+        if self._signed is None:
+            sig = self.headers.get("grip-sig")
+            self._signed = bool(
+                sig
+                and self._key is not None
+                and validate_sig(sig, self._key, self._iss)
+            )
+        return self._signed
+
+    # True if the request uses the WebSocket-over-HTTP protocol.
+    @property
+    def is_websocket(self):
+        return _is_websocket_request(self.headers)
+
+    # True if the handler has accessed the websocket context.
+    @property
+    def websocket_used(self):
+        return self._websocket is not None
+
+    # The WebSocketContext for a WebSocket-over-HTTP request, created on
+    # first access. A ValueError is raised for other requests.
+    @property
+    def websocket(self):
+        if self._websocket is None:
+            if not self.is_websocket:
+                raise ValueError("not a websocket-over-http request")
+            body = self._body() if callable(self._body) else self._body
+            meta = dict()
+            for name, value in self.headers.items():
+                if name.startswith("meta-"):
+                    meta[name[5:]] = value
+            self._websocket = WebSocketContext(
+                self.headers.get("connection-id"),
+                meta,
+                decode_websocket_events(body or b""),
+                self._grip_prefix,
+                self._buffered,
+            )
+        return self._websocket
+
+    # Instruct the GRIP proxy to hold the request as a long-poll on the
+    # specified channels, with an optional timeout in seconds. The timeout
+    # jitter and keep-alive parameters are as for create_hold.
+    def set_hold_longpoll(
+        self,
+        channels,
+        timeout=None,
+        timeout_jitter=None,
+        keep_alive=None,
+        keep_alive_format=None,
+        keep_alive_interval=None,
+    ):
+        self.hold_mode = "response"
+        self.hold_channels = channels
+        self.hold_timeout = timeout and _jitter_timeout(timeout, timeout_jitter)
+        self._set_keep_alive(keep_alive, keep_alive_format, keep_alive_interval)
+
+    # Instruct the GRIP proxy to hold the request as a stream on the
+    # specified channels. The keep-alive parameters are as for create_hold.
+    def set_hold_stream(
+        self,
+        channels,
+        keep_alive=None,
+        keep_alive_format=None,
+        keep_alive_interval=None,
+    ):
+        self.hold_mode = "stream"
+        self.hold_channels = channels
+        self.hold_timeout = None
+        self._set_keep_alive(keep_alive, keep_alive_format, keep_alive_interval)
+
+    # Return the list of (name, value) GRIP instruction headers to add to
+    # the response.
+    def get_response_headers(self):
+        headers = list()
+        if self.hold_mode is not None:
+            headers.append(("Grip-Hold", self.hold_mode))
+            headers.append(
+                ("Grip-Channel", create_grip_channel_header(self.hold_channels))
+            )
+            if self.hold_timeout:
+                headers.append(("Grip-Timeout", str(self.hold_timeout)))
+            if self.hold_keep_alive is not None:
+                headers.append(("Grip-Keep-Alive", self.hold_keep_alive))
+        return headers
+
+    # An internal method for setting the Grip-Keep-Alive header value.
+    def _set_keep_alive(self, content, format, interval):
+        if content is None:
+            self.hold_keep_alive = None
+        else:
+            self.hold_keep_alive = create_grip_keep_alive_header(
+                content, format, interval
+            )
+
+    # Return True if the response should be replaced with the WebSocket
+    # events produced by the handler: the handler used the websocket
+    # context and returned an empty 200 response.
+    def should_encode_websocket(self, status_code, body_empty):
+        return self.websocket_used and status_code == 200 and body_empty
+
+    # Return a tuple of the response headers and body carrying the events
+    # produced through the WebSocketContext.
+    def get_websocket_response(self):
+        ws = self._websocket
+        parts = list()
+        if ws.accepted:
+            parts.append(encode_websocket_events([WebSocketEvent(OPEN)]))
+        parts.append(ws.encode_out_events())
+        if ws.closed:
+            close = WebSocketEvent(CLOSE, pack(">H", ws.out_close_code))
+            parts.append(encode_websocket_events([close]))
+        headers = [("Content-Type", "application/websocket-events")]
+        if ws.accepted:
+            headers.append(("Sec-WebSocket-Extensions", "grip"))
+        for name, value in ws.meta.items():
+            if ws.orig_meta.get(name) != value:
+                headers.append(("Set-Meta-" + name, value))
+        for name in ws.orig_meta:
+            if name not in ws.meta:
+                headers.append(("Set-Meta-" + name, ""))
+        return headers, b"".join(parts)
+
+
+# The GripMiddleware class is WSGI middleware that creates a GripContext
+# for every request and stores it in the environ under GRIP_CONTEXT_KEY.
+# On the way out it adds hold instruction headers requested through the
+# context, and for WebSocket-over-HTTP requests whose handler used the
+# websocket context and returned an empty 200 response, it replaces the
+# response with the encoded WebSocket events.
+class GripMiddleware(object):
+
+    # Initialize with the WSGI application to wrap and the optional key and
+    # issuer used to validate the Grip-Sig header. Set buffered to True to
+    # have websocket contexts write outgoing events straight into a buffer.
+    def __init__(self, app, key=None, iss=None, grip_prefix="", buffered=False):
+        self.app = app
+        self.key = key
+        self.iss = iss
+        self.grip_prefix = grip_prefix
+        self.buffered = buffered
+
+    def __call__(self, environ, start_response):
+        grip = GripContext(
+            _environ_headers(environ),
+            lambda: _read_environ_body(environ),
+            self.key,
+            self.iss,
+            self.grip_prefix,
+            self.buffered,
+        )
+        environ[GRIP_CONTEXT_KEY] = grip
+        captured = list()
+        returned = list()
+
+        def grip_start_response(status, headers, exc_info=None):
+            if grip.websocket_used and not returned:
+                # decided once the body is known
+                captured.append((status, headers, exc_info))
+                return captured_write
+            headers = list(headers) + grip.get_response_headers()
+            return start_response(status, headers, exc_info)
+
+        written = list()
+        captured_write = written.append
+
+        result = self.app(environ, grip_start_response)
+        if not captured and grip.is_websocket:
+            # generator applications only call start_response once they
+            # are iterated
+            result = _PrimedResult(result)
+        if not captured:
+            returned.append(True)
+            return result
+
+        try:
+            body = b"".join(written) + b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        status, headers, exc_info = captured[-1]
+        if grip.should_encode_websocket(int(status.split(" ", 1)[0]), not body):
+            ws_headers, body = grip.get_websocket_response()
+            headers = [
+                (name, value)
+                for name, value in headers
+                if name.lower() not in ("content-type", "content-length")
+            ]
+            headers.extend(ws_headers)
+            headers.append(("Content-Length", str(len(body))))
+        else:
+            headers = list(headers) + grip.get_response_headers()
+        start_response(status, headers, exc_info)
+        return [body]
+
+
+# An internal class wrapping the result of a WSGI application whose first
+# chunk has already been taken from it, so that an application implemented
+# as a generator has called start_response.
+class _PrimedResult(object):
+    def __init__(self, result):
+        self.result = result
+        self.iterator = iter(result)
+        self.first = list()
+        for chunk in self.iterator:
+            self.first.append(chunk)
+            break
+
+    def __iter__(self):
+        for chunk in self.first:
+            yield chunk
+        for chunk in self.iterator:
+            yield chunk
+
+    def close(self):
+        if hasattr(self.result, "close"):
+            self.result.close()
+
+
+# An internal method for determining whether the request with the specified
+# headers uses the WebSocket-over-HTTP protocol.
+def _is_websocket_request(headers):
+    content_type = headers.get("content-type", "")
+    return content_type.split(";")[0].strip() == "application/websocket-events"
+
+
+# An internal method for collecting the request headers from a WSGI
+# environ into a dict keyed by lowercase header name.
+def _environ_headers(environ):
+    headers = dict()
+    for name, value in environ.items():
+        if name.startswith("HTTP_"):
+            headers[name[5:].replace("_", "-").lower()] = value
+    if environ.get("CONTENT_TYPE"):
+        headers["content-type"] = environ["CONTENT_TYPE"]
+    return headers
+
+
+# An internal method for reading the request body from a WSGI environ.
+def _read_environ_body(environ):
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length <= 0:
+        return b""
+    return environ["wsgi.input"].read(length)
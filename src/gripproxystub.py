@@ -0,0 +1,694 @@
+#    gripproxystub.py
+#    ~~~~~~~~~
+#    This module implements the GripProxyStub class and the
+#    create_websocket_request_body method.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from base64 import b64decode
+from http.client import responses
+from io import BytesIO
+from urllib.parse import parse_qsl
+from .gripcontrol import encode_websocket_events, validate_sig
+from .websocketevent import WebSocketEvent
+
+# The formats a published item may contain.
+_FORMATS = ("http-response", "http-stream", "ws-message")
+
+# The hold timeout used when the instructions don't specify one.
+_DEFAULT_TIMEOUT = 55
+
+# The response headers that carry GRIP instructions.
+_GRIP_HEADERS = ("grip-hold", "grip-channel", "grip-timeout", "grip-keep-alive")
+
+
+# The GripProxyStub class is a lightweight, in-process stand-in for a GRIP
+# proxy such as Pushpin, for load, latency and integration tests that run
+# offline against the library's real code paths. It serves HTTP on a local
+# port from an asyncio event loop running in a background thread.
+#
+# Items published to '<uri>/publish/' (for example by a GripPubControl with
+# the stub's uri as its control URI) are validated and recorded in the
+# items list; a request containing an invalid item is rejected with a 400
+# response and none of its items are recorded. If control_key is set, the
+# Authorization header must carry a JWT token valid for that key. Publish
+# requests can be slowed down by latency seconds (or a random duration
+# within a (min, max) tuple) and fail with failure_status at failure_rate
+# (a probability between 0 and 1), using a random generator seeded with
+# seed.
+#
+# Origin settings posted to '<uri>/http/<route_domain>/' (for example by
+# GripPubControl.set_origin) are recorded in the origins dict, which maps
+# each route domain to the posted parameters. They are authorized with
+# control_key like publish requests but do not affect routing.
+#
+# Requests to '<uri>/route/<route_domain>/<path>' are passed to the WSGI
+# application added for the route domain with add_route, signed with a
+# Grip-Sig header if sig_key is set. Hold instructions in the response,
+# as JSON or as Grip-* headers, are carried out: response holds wait for an
+# http-response item on one of their channels or for their timeout, and
+# stream holds send http-stream items and keep-alives until an item closes
+# the stream. Other responses, including WebSocket-over-HTTP responses, are
+# passed through. Channel filters and previous IDs are not evaluated.
+class GripProxyStub(object):
+
+    # Initialize with the optional routes (a dict mapping route domains to
+    # WSGI applications), the keys used to sign requests to the routes and
+    # to verify publish requests, the latency and failure injection
+    # parameters, and the address to listen on (port 0 picks a free port).
+    def __init__(
+        self,
+        routes=None,
+        sig_key=None,
+        control_key=None,
+        latency=0,
+        failure_rate=0.0,
+        failure_status=500,
+        seed=None,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.routes = dict(routes or {})
+        self.sig_key = sig_key
+        self.control_key = control_key
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.host = host
+        self.port = port
+        self.items = list()
+        self.origins = dict()
+        self.publish_requests = 0
+        self.failures_injected = 0
+        self._random = random.Random(seed)
+        self._cond = threading.Condition()
+        self._holds = dict()
+        self._held = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._tasks = set()
+
+    # The base URI of the stub, to be used as a control URI.
+    @property
+    def uri(self):
+        return "http://%s:%d" % (self.host, self.port)
+
+    # The number of requests currently held.
+    @property
+    def held(self):
+        with self._cond:
+            return self._held
+
+    # Add or replace the WSGI application serving the specified route
+    # domain.
+    def add_route(self, route_domain, app):
+        self.routes[route_domain] = app
+
+    # Start serving in a background thread. Returns this instance.
+    def start(self):
+        started = threading.Event()
+        errors = list()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._server = self._loop.run_until_complete(
+                    asyncio.start_server(self._handle, self.host, self.port)
+                )
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                self._loop.close()
+                return
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            try:
+                self._loop.run_forever()
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        if errors:
+            self._thread.join()
+            self._thread = None
+            raise errors[0]
+        return self
+
+    # Stop serving, closing all connections including held ones.
+    def stop(self):
+        if self._thread is None:
+            return
+
+        def shutdown():
+            self._server.close()
+            for task in list(self._tasks):
+                task.cancel()
+            self._loop.create_task(self._stop_loop())
+
+        self._loop.call_soon_threadsafe(shutdown)
+        self._thread.join()
+        self._thread = None
+        self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # Forget the recorded items and origin settings and reset the counters.
+    def reset(self):
+        with self._cond:
+            self.items = list()
+            self.origins = dict()
+            self.publish_requests = 0
+            self.failures_injected = 0
+
+    # Wait until at least count items have been recorded or the timeout in
+    # seconds has elapsed. Returns whether enough items were recorded.
+    def wait_items(self, count, timeout=5.0):
+        return self._wait(lambda: len(self.items) >= count, timeout)
+
+    # Wait until at least count requests are held or the timeout in seconds
+    # has elapsed. Returns whether enough requests were held.
+    def wait_held(self, count, timeout=5.0):
+        return self._wait(lambda: self._held >= count, timeout)
+
+    # An internal method for waiting on the condition for the specified
+    # predicate.
+    def _wait(self, predicate, timeout):
+        deadline = time.time() + timeout
+        with self._cond:
+            while not predicate():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    # An internal coroutine for stopping the loop once the cancelled
+    # connections have finished.
+    async def _stop_loop(self):
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+        await self._server.wait_closed()
+        self._loop.stop()
+
+    # An internal coroutine serving the requests of a connection.
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                keep_open = await self._dispatch(request, writer)
+                if not keep_open or request["close"]:
+                    break
+        except (asyncio.CancelledError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    # An internal coroutine for serving a request. Returns whether the
+    # connection can be used for further requests.
+    async def _dispatch(self, request, writer):
+        path = request["path"].split("?", 1)[0]
+        if path.startswith("/route/"):
+            return await self._proxy(request, writer)
+        if path.startswith("/http/"):
+            status, body = self._set_origin(request, path)
+        elif path.rstrip("/").endswith("/publish"):
+            status, body = await self._publish(request)
+        else:
+            status, body = 404, "Not Found\n"
+        await _write_response(writer, status, None, [], body.encode("utf-8"))
+        return True
+
+    # An internal coroutine for handling a publish request. Returns the
+    # status code and body of the response.
+    async def _publish(self, request):
+        with self._cond:
+            self.publish_requests += 1
+        if request["method"] != "POST":
+            return 405, "Method Not Allowed\n"
+        if not self._is_authorized(request):
+            return 401, "Unauthorized\n"
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self._random.uniform(latency[0], latency[1])
+        if latency:
+            await asyncio.sleep(latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            with self._cond:
+                self.failures_injected += 1
+            return self.failure_status, "Injected failure\n"
+        try:
+            content = json.loads(request["body"].decode("utf-8"))
+            items = content.get("items") if isinstance(content, dict) else None
+            if not isinstance(items, list):
+                raise ValueError("items must be a list")
+            for item in items:
+                _validate_item(item)
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, "Invalid request: %s\n" % e
+        with self._cond:
+            self.items.extend(items)
+            self._cond.notify_all()
+        for item in items:
+            for queue in list(self._holds.get(item["channel"], ())):
+                queue.put_nowait(item)
+        return 200, "Published\n"
+
+    # An internal method for handling a request updating the origin
+    # settings of a route domain. Returns the status code and body of the
+    # response.
+    def _set_origin(self, request, path):
+        route_domain, _, rest = path[6:].partition("/")
+        if not route_domain or rest:
+            return 404, "Not Found\n"
+        if request["method"] != "POST":
+            return 405, "Method Not Allowed\n"
+        if not self._is_authorized(request):
+            return 401, "Unauthorized\n"
+        try:
+            params = dict(parse_qsl(request["body"].decode("utf-8")))
+        except ValueError as e:
+            return 400, "Invalid request: %s\n" % e
+        with self._cond:
+            self.origins[route_domain] = params
+            self._cond.notify_all()
+        return 200, "Updated\n"
+
+    # An internal method for determining whether the specified request
+    # carries valid control credentials, if control_key is set.
+    def _is_authorized(self, request):
+        if self.control_key is None:
+            return True
+        auth = request["headers"].get("authorization", "")
+        return auth.startswith("Bearer ") and validate_sig(auth[7:], self.control_key)
+
+    # An internal coroutine for passing a request to the WSGI application
+    # of its route domain and carrying out any hold instructions in the
+    # response. Returns whether the connection can be used for further
+    # requests.
+    async def _proxy(self, request, writer):
+        route_domain, _, path = request["path"][7:].partition("/")
+        app = self.routes.get(route_domain)
+        if app is None:
+            await _write_response(writer, 502, None, [], b"Unknown route\n")
+            return True
+        headers = dict(request["headers"])
+        if self.sig_key is not None:
+            import jwt
+
+            token = jwt.encode(
+                {"iss": "pushpin", "exp": int(time.time()) + 3600}, self.sig_key
+            )
+            if isinstance(token, bytes):
+                token = token.decode("utf-8")
+            headers["grip-sig"] = token
+        environ = _make_environ(request, route_domain, "/" + path, headers)
+        loop = asyncio.get_event_loop()
+        status, response_headers, body = await loop.run_in_executor(
+            None, _call_wsgi, app, environ
+        )
+        code, reason = status
+        hold, response = _parse_instructions(code, reason, response_headers, body)
+        if hold is None:
+            await _write_response(writer, code, reason, response_headers, body)
+            return True
+        if hold["mode"] == "stream":
+            await self._hold_stream(writer, hold, response)
+            return False
+        await self._hold_response(writer, hold, response)
+        return True
+
+    # An internal coroutine for holding a request in response mode.
+    async def _hold_response(self, writer, hold, response):
+        queue = self._add_hold(hold["channels"])
+        try:
+            timeout = hold.get("timeout") or _DEFAULT_TIMEOUT
+            deadline = self._loop.time() + timeout
+            while True:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if "http-response" in item:
+                    response = _response_from_format(item["http-response"])
+                    break
+        finally:
+            self._remove_hold(hold["channels"], queue)
+        await _write_response(writer, *response)
+
+    # An internal coroutine for holding a request in stream mode. The
+    # response is sent without a length and the connection is closed when
+    # the stream ends.
+    async def _hold_stream(self, writer, hold, response):
+        code, reason, headers, body = response
+        headers = [h for h in headers if h[0].lower() != "content-length"]
+        headers.append(("Connection", "close"))
+        await _write_head(writer, code, reason, headers)
+        writer.write(body)
+        await writer.drain()
+        queue = self._add_hold(hold["channels"])
+        try:
+            keep_alive = hold.get("keep-alive")
+            interval = None
+            if keep_alive is not None:
+                interval = keep_alive.get("timeout") or _DEFAULT_TIMEOUT
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), interval)
+                except asyncio.TimeoutError:
+                    writer.write(_content(keep_alive))
+                    await writer.drain()
+                    continue
+                stream = item.get("http-stream")
+                if stream is None:
+                    continue
+                if stream.get("action") == "close":
+                    break
+                writer.write(_content(stream))
+                await writer.drain()
+        finally:
+            self._remove_hold(hold["channels"], queue)
+
+    # An internal method for registering a held request on the specified
+    # channels. Returns the queue receiving the items published to them.
+    def _add_hold(self, channels):
+        queue = asyncio.Queue()
+        for channel in channels:
+            self._holds.setdefault(channel, set()).add(queue)
+        with self._cond:
+            self._held += 1
+            self._cond.notify_all()
+        return queue
+
+    # An internal method for unregistering a held request.
+    def _remove_hold(self, channels, queue):
+        for channel in channels:
+            queues = self._holds.get(channel)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._holds[channel]
+        with self._cond:
+            self._held -= 1
+            self._cond.notify_all()
+
+
+# Create a synthetic WebSocket-over-HTTP request body for the specified
+# list of messages, as sent by a GRIP proxy to the origin. Each message is
+# a TEXT event, or a BINARY event if it is bytes. If open is set to True
+# the body starts with an OPEN event, and if close is set to True it ends
+# with a CLOSE event with the specified close code. The body is returned as
+# bytes.
+def create_websocket_request_body(
+    messages=(), open=False, close=False, close_code=1000
+):
+    events = list()
+    if open:
+        events.append(WebSocketEvent("OPEN"))
+    for message in messages:
+        if isinstance(message, bytes):
+            events.append(WebSocketEvent("BINARY", message))
+        else:
+            events.append(WebSocketEvent("TEXT", message))
+    if close:
+        events.append(WebSocketEvent("CLOSE", bytearray(close_code.to_bytes(2, "big"))))
+    body = encode_websocket_events(events)
+    if not isinstance(body, bytes):
+        body = body.encode("utf-8")
+    return body
+
+
+# An internal method for validating a published item. A ValueError is
+# raised if it is invalid.
+def _validate_item(item):
+    if not isinstance(item, dict):
+        raise ValueError("item must be an object")
+    channel = item.get("channel")
+    if not isinstance(channel, str) or not channel:
+        raise ValueError("item channel missing")
+    for name in ("id", "prev-id"):
+        if name in item and not isinstance(item[name], str):
+            raise ValueError("item %s must be a string" % name)
+    formats = [name for name in _FORMATS if name in item]
+    if not formats:
+        raise ValueError("item has no known format")
+    response = item.get("http-response")
+    if response is not None:
+        if "code" in response and not isinstance(response["code"], int):
+            raise ValueError("http-response code must be an integer")
+        _validate_content(response, "body")
+    stream = item.get("http-stream")
+    if stream is not None:
+        if "action" in stream:
+            if stream["action"] != "close":
+                raise ValueError("unknown http-stream action")
+        elif not _validate_content(stream, "content"):
+            raise ValueError("http-stream content missing")
+    message = item.get("ws-message")
+    if message is not None:
+        if "action" not in message and not _validate_content(message, "content"):
+            raise ValueError("ws-message content missing")
+
+
+# An internal method for validating the text or base64 content stored
+# under the specified name of a format. Returns whether content is present.
+def _validate_content(format, name):
+    if name in format and name + "-bin" in format:
+        raise ValueError("both %s and %s-bin specified" % (name, name))
+    if name + "-bin" in format:
+        b64decode(format[name + "-bin"].encode("utf-8"), validate=True)
+        return True
+    return name in format
+
+
+# An internal method for getting the content of an http-stream format or
+# keep-alive instruction as bytes.
+def _content(format):
+    if "content-bin" in format:
+        return b64decode(format["content-bin"].encode("utf-8"))
+    return format.get("content", "").encode("utf-8")
+
+
+# An internal method for making a (code, reason, headers, body) response
+# from an http-response format or the response of hold instructions.
+def _response_from_format(format):
+    if format is None:
+        return (200, None, [], b"")
+    headers = format.get("headers") or {}
+    if isinstance(headers, dict):
+        headers = list(headers.items())
+    if "body-bin" in format:
+        body = b64decode(format["body-bin"].encode("utf-8"))
+    else:
+        body = format.get("body", "").encode("utf-8")
+    return (format.get("code", 200), format.get("reason"), headers, body)
+
+
+# An internal method for parsing the hold instructions of an origin
+# response. Returns the hold instructions (a dict with 'mode', 'channels'
+# as a list of names, and the optional 'timeout' and 'keep-alive') and the
+# response to send, or None and the original response if it doesn't hold
+# the request.
+def _parse_instructions(code, reason, headers, body):
+    names = dict((name.lower(), value) for name, value in headers)
+    if names.get("content-type", "").split(";")[0].strip() == (
+        "application/grip-instruct"
+    ):
+        instruct = json.loads(body.decode("utf-8"))
+        hold = instruct.get("hold")
+        response = _response_from_format(instruct.get("response"))
+        if hold is None:
+            return None, response
+        hold = dict(hold)
+        hold["channels"] = [c["name"] for c in hold["channels"]]
+        return hold, response
+    headers = [(n, v) for n, v in headers if n.lower() not in _GRIP_HEADERS]
+    if "grip-hold" not in names:
+        return None, (code, reason, headers, body)
+    hold = {"mode": names["grip-hold"]}
+    hold["channels"] = [
+        c.split(";")[0].strip() for c in names.get("grip-channel", "").split(",")
+    ]
+    if "grip-timeout" in names:
+        hold["timeout"] = int(names["grip-timeout"])
+    if "grip-keep-alive" in names:
+        hold["keep-alive"] = _parse_keep_alive(names["grip-keep-alive"])
+    return hold, (code, reason, headers, body)
+
+
+# An internal method for parsing a Grip-Keep-Alive header value into a
+# keep-alive instruction.
+def _parse_keep_alive(value):
+    parts = value.split(";")
+    params = dict()
+    for part in parts[1:]:
+        name, _, val = part.strip().partition("=")
+        params[name] = val
+    content = parts[0].strip()
+    keep_alive = dict()
+    format = params.get("format", "raw")
+    if format == "base64":
+        keep_alive["content-bin"] = content
+    elif format == "cstring":
+        keep_alive["content"] = _unescape_cstring(content)
+    else:
+        keep_alive["content"] = content
+    if "timeout" in params:
+        keep_alive["timeout"] = int(params["timeout"])
+    return keep_alive
+
+
+# An internal method for unescaping a C string.
+def _unescape_cstring(s):
+    out = list()
+    i = 0
+    escapes = {"\\": "\\", "r": "\r", "n": "\n", "t": "\t", '"': '"'}
+    while i < len(s):
+        c = s[i]
+        if c == "\\" and i + 1 < len(s):
+            out.append(escapes.get(s[i + 1], s[i + 1]))
+            i += 2
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out)
+
+
+# An internal coroutine for reading an HTTP request from a connection.
+# Returns a dict with the method, path, lowercase headers, body and whether
+# the connection should be closed afterwards, or None at the end of the
+# connection. A ValueError is raised for malformed requests.
+async def _read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError("malformed request line")
+    method, path, version = parts
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        line = line.decode("latin-1").rstrip("\r\n")
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = list()
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    else:
+        body = await reader.readexactly(int(headers.get("content-length", "0")))
+    connection = headers.get("connection", "").lower()
+    close = connection == "close" or (
+        version == "HTTP/1.0" and connection != "keep-alive"
+    )
+    return {
+        "method": method,
+        "path": path,
+        "headers": headers,
+        "body": body,
+        "close": close,
+    }
+
+
+# An internal coroutine for writing the status line and headers of a
+# response.
+async def _write_head(writer, code, reason, headers):
+    if reason is None:
+        reason = responses.get(code, "Unknown")
+    lines = ["HTTP/1.1 %d %s" % (code, reason)]
+    for name, value in headers:
+        lines.append("%s: %s" % (name, value))
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+
+# An internal coroutine for writing a complete response.
+async def _write_response(writer, code, reason, headers, body):
+    headers = [h for h in headers if h[0].lower() != "content-length"]
+    headers.append(("Content-Length", str(len(body))))
+    await _write_head(writer, code, reason, headers)
+    writer.write(body)
+    await writer.drain()
+
+
+# An internal method for making the WSGI environ of a proxied request.
+def _make_environ(request, route_domain, path, headers):
+    path, _, query = path.partition("?")
+    environ = {
+        "REQUEST_METHOD": request["method"],
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "SERVER_NAME": route_domain,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(request["body"]),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(request["body"])),
+    }
+    for name, value in headers.items():
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name not in ("content-length", "connection", "transfer-encoding"):
+            environ["HTTP_" + name.upper().replace("-", "_")] = value
+    return environ
+
+
+# An internal method for calling a WSGI application. Returns the status
+# as a (code, reason) tuple, the list of headers and the body as bytes.
+def _call_wsgi(app, environ):
+    state = dict()
+    written = list()
+
+    def start_response(status, headers, exc_info=None):
+        state["status"] = status
+        state["headers"] = list(headers)
+        return written.append
+
+    result = app(environ, start_response)
+    try:
+        body = b"".join(written) + b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    code, _, reason = state["status"].partition(" ")
+    return (int(code), reason or None), state["headers"], body
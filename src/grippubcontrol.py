@@ -5,31 +5,124 @@
 #    :copyright: (c) 2015 by Fanout, Inc.
 #    :license: MIT, see LICENSE for more details.
 
-from pubcontrol import PubControl, Item
+import os
+import threading
+import weakref
+from uuid import uuid4
+from pubcontrol import (
+    PubControl,
+    PubControlClient,
+    PubControlClientCallbackHandler,
+    ZmqPubControlClient,
+    Item,
+)
 from .httpresponseformat import HttpResponseFormat
 from .httpstreamformat import HttpStreamFormat
+from .grippubcontrolclient import (
+    GripPubControlClient,
+    _rebuild_sub_monitor,
+    _reset_client,
+)
+from .gripzmqpubcontrolclient import (
+    GripZmqPubControlClient,
+    _RawBinaryItem,
+    _reset_zmq_client,
+)
+from .retrypolicy import RetryPolicy
+from .circuitbreaker import CircuitBreaker
+from .jwtcache import JwtCache
+from .channelsequencer import ChannelSequencer
+from .streamcoalescer import StreamCoalescer
+from .publishlane import PublishLane
 from .gripcontrol import _is_basestring_instance
 import six
 
+# The GripPubControl instances to reinitialize in a forked child process.
+_instances = weakref.WeakSet()
+
 
 # The GripPubControl class allows consumers to easily publish HTTP response
 # and HTTP stream format messages to GRIP proxies. Configuring GripPubControl
 # is slightly different from configuring PubControl in that the 'uri' and
 # 'iss' keys in each config entry should have a 'control_' prefix.
 # GripPubControl inherits from PubControl and therefore also provides all
-# of the same functionality.
+# of the same functionality. GripPubControl is fork-safe: an instance
+# created before a pre-fork server forks its workers (for example at import
+# time) reinitializes itself in each child process, either from an
+# os.register_at_fork hook or, where those are not available, when it
+# detects a changed process ID on the next call. Locks and queues are
+# reset, and worker threads, HTTP connections and ZMQ sockets are created
+# anew on demand in the child. Asynchronous publishes still queued at the
+# time of the fork are left for the parent to send.
 class GripPubControl(PubControl):
 
+    # The PublishMetrics instance passed to clients, if any.
+    metrics = None
+
+    # The ChannelSequencer used to assign message IDs, if any.
+    sequencer = None
+
+    # Whether http-response publishes are conflated by default.
+    conflate = False
+
+    # The StreamCoalescer used for HTTP stream publishes, if any.
+    coalescer = None
+
+    # The PublishLanes passed to clients, by name.
+    lanes = None
+
+    # The ID of the process the instance was last used in.
+    _pid = None
+
+    # The PubControlClients whose subscription monitor must be recreated
+    # before the next publish, after a fork.
+    _stale_monitors = ()
+
     # Initialize with or without a configuration. A configuration can be applied
     # after initialization via the apply_grip_config method. Optionally specify
     # a subscription callback method that will be executed whenever a channel is
     # subscribed to or unsubscribed from. The callback accepts two parameters:
     # the first parameter a string containing 'sub' or 'unsub' and the second
     # parameter containing the channel name. Optionally specify a ZMQ context
-    # to use otherwise the global ZMQ context will be used.
-    def __init__(self, config=None, sub_callback=None, zmq_context=None):
+    # to use otherwise the global ZMQ context will be used. Optionally
+    # specify a PublishMetrics instance (or compatible object) to collect
+    # publish counters and latencies for each 'control_uri' endpoint; by
+    # default no metrics are collected and publishes are not timed.
+    # Optionally specify a ChannelSequencer instance, or True to create one,
+    # to have IDs and previous IDs assigned automatically per channel.
+    # Optionally set conflate to True to have an asynchronous http-response
+    # publish replace the one still queued for the same channel, for
+    # channels where only the latest value matters (see
+    # GripPubControlClient). Optionally specify a StreamCoalescer instance,
+    # a dict of its parameters or True for the defaults to have HTTP stream
+    # messages to the same channel combined and rate limited. Optionally
+    # specify a dict mapping lane names (such as 'realtime' and 'bulk') to
+    # PublishLane instances, dicts of their parameters or True, so that
+    # asynchronous publishes can select a lane with its own queue on each
+    # 'control_uri' endpoint.
+    def __init__(
+        self,
+        config=None,
+        sub_callback=None,
+        zmq_context=None,
+        metrics=None,
+        sequencer=None,
+        conflate=False,
+        coalesce=None,
+        lanes=None,
+    ):
         super(GripPubControl, self).__init__(None, sub_callback, zmq_context)
+        self._pid = os.getpid()
+        _instances.add(self)
         self.clients = list()
+        self.metrics = metrics
+        self.conflate = conflate
+        self.coalescer = _make_option(coalesce, StreamCoalescer)
+        if lanes:
+            self.lanes = dict(
+                (name, _make_option(lane, PublishLane)) for name, lane in lanes.items()
+            )
+        self.sequencer = _make_option(sequencer, ChannelSequencer)
         if config:
             self.apply_grip_config(config)
 
@@ -37,23 +130,57 @@ class GripPubControl(PubControl):
     # configuration object can either be a hash or an array of hashes where
     # each hash corresponds to a single PubControlClient instance. Each hash
     # will be parsed and a PubControlClient will be created either using just
-    # a URI or a URI and JWT authentication information.
+    # a URI or a URI and JWT authentication information. 'control_uri'
+    # entries may also include a 'retry' key (a RetryPolicy instance, a dict
+    # of RetryPolicy parameters, or True for the defaults) and a
+    # 'circuit_breaker' key (likewise for CircuitBreaker). Each entry gets
+    # its own circuit breaker unless an instance is passed explicitly.
+    # Entries with JWT authentication cache their token in a JwtCache; the
+    # 'jwt_cache' key accepts the same kinds of values, or False to sign a
+    # token for every publish. A 'conflate' key overrides the conflation
+    # setting of this instance for the entry.
     def apply_grip_config(self, config):
         if not isinstance(config, list):
             config = [config]
         for entry in config:
-            pc_config = {}
             if "control_uri" in entry:
-                pc_config["uri"] = entry["control_uri"]
-                if "control_iss" in entry:
-                    pc_config["iss"] = entry["control_iss"]
-                if "key" in entry:
-                    pc_config["key"] = entry["key"]
+                self._apply_control_uri_entry(entry)
             elif "control_zmq_uri" in entry:
-                pc_config["zmq_uri"] = entry["control_zmq_uri"]
-            if entry.get("require_subscribers"):
-                pc_config["require_subscribers"] = True
-            self.apply_config(pc_config)
+                self._apply_control_zmq_uri_entry(entry)
+
+    # Return a dict mapping the URI of each client that has a circuit
+    # breaker to the current state of that breaker ('closed', 'open' or
+    # 'half-open').
+    def get_circuit_states(self):
+        out = {}
+        for client in self.clients:
+            breaker = getattr(client, "circuit_breaker", None)
+            if breaker is not None:
+                out[client.uri] = breaker.state
+        return out
+
+    # Publish the specified item to all of the configured clients. If lane
+    # is specified, asynchronous publishes are queued in the lane of that
+    # name on each 'control_uri' client; other clients ignore it.
+    def publish(self, channel, item, blocking=False, callback=None, lane=None):
+        self._check_fork()
+        if self._stale_monitors:
+            self._rebuild_monitors()
+        if lane is None:
+            super(GripPubControl, self).publish(channel, item, blocking, callback)
+            return
+        if not self.lanes or lane not in self.lanes:
+            raise ValueError("unknown lane: " + str(lane))
+        self._verify_not_closed()
+        cb = callback
+        if not blocking and callback:
+            cb = PubControlClientCallbackHandler(len(self.clients), callback).handler
+        for client in self.clients:
+            if isinstance(client, GripPubControlClient):
+                client.publish(channel, item, blocking=blocking, callback=cb, lane=lane)
+            else:
+                client.publish(channel, item, blocking=blocking, callback=cb)
+        self._send_to_zmq(channel, item)
 
     # Publish an HTTP response format message to all of the configured
     # PubControlClients with a specified channel, message, and optional
@@ -64,7 +191,11 @@ class GripPubControl(PubControl):
     # blocking parameter indicates whether the call should be blocking or
     # non-blocking. When specified, the callback method will be called after
     # publishing is complete and passed a result and error message (if an
-    # error was encountered).
+    # error was encountered). If a sequencer is configured and neither ID is
+    # specified, both are assigned by the sequencer. The lane parameter
+    # selects the lane of an asynchronous publish, and the optional meta
+    # dict is published with the item for the GRIP proxy's subscription
+    # filters (see filter_meta).
     def publish_http_response(
         self,
         channel,
@@ -73,11 +204,15 @@ class GripPubControl(PubControl):
         prev_id=None,
         blocking=False,
         callback=None,
+        lane=None,
+        meta=None,
     ):
         if _is_basestring_instance(http_response):
             http_response = HttpResponseFormat(body=http_response)
-        item = Item(http_response, id, prev_id)
-        self.publish(channel, item, blocking=blocking, callback=callback)
+        if id is None and prev_id is None and self.sequencer is not None:
+            id, prev_id = self.sequencer.sequence(channel)
+        item = Item(http_response, id, prev_id, meta or {})
+        self._publish_item(channel, item, blocking, callback, lane)
 
     # Publish an HTTP stream format message to all of the configured
     # PubControlClients with a specified channel, message, and optional
@@ -88,14 +223,136 @@ class GripPubControl(PubControl):
     # blocking parameter indicates whether the call should be blocking or
     # non-blocking. When specified, the callback method will be called after
     # publishing is complete and passed a result and error message (if an
-    # error was encountered).
+    # error was encountered). If a sequencer is configured and neither ID is
+    # specified, both are assigned by the sequencer. If a coalescer is
+    # configured the message is passed to it instead of being published
+    # right away; messages with different meta are never combined. The lane
+    # and meta parameters are as for publish_http_response.
     def publish_http_stream(
-        self, channel, http_stream, id=None, prev_id=None, blocking=False, callback=None
+        self,
+        channel,
+        http_stream,
+        id=None,
+        prev_id=None,
+        blocking=False,
+        callback=None,
+        lane=None,
+        meta=None,
     ):
         if _is_basestring_instance(http_stream):
             http_stream = HttpStreamFormat(http_stream)
-        item = Item(http_stream, id, prev_id)
-        self.publish(channel, item, blocking=blocking, callback=callback)
+        if id is None and prev_id is None and self.sequencer is not None:
+            id, prev_id = self.sequencer.sequence(channel)
+        if self.coalescer is not None:
+            self._verify_not_closed()
+            self._check_fork()
+            if lane is not None and (not self.lanes or lane not in self.lanes):
+                raise ValueError("unknown lane: " + str(lane))
+            self.coalescer.add(
+                self, channel, http_stream, id, prev_id, blocking, callback, lane, meta
+            )
+            return
+        item = Item(http_stream, id, prev_id, meta or {})
+        self._publish_item(channel, item, blocking, callback, lane)
+
+    # Publish a sequence of HTTP stream format messages to the specified
+    # channel, one for each chunk produced by the 'chunks' iterable. The
+    # iterable is consumed lazily and at most 'max_in_flight' chunks are
+    # being published at any time, so memory use does not depend on the
+    # total size of the stream. Each message gets an ID made from 'id_prefix'
+    # (a random value by default) and a sequence number, and its previous ID
+    # is set to the ID of the message before it; the first message uses the
+    # specified 'prev_id'. If a sequencer is configured and no 'id_prefix' is
+    # specified, IDs and previous IDs are assigned by the sequencer instead,
+    # continuing the channel's sequence. If 'close' is set to True a final
+    # message closing the stream is published after the last chunk. This
+    # method blocks until every message has been published and returns the
+    # ID of the last message. If publishing a message fails, no further
+    # chunks are read and an error is raised. The content_filters and meta
+    # parameters apply to every message, and the lane parameter selects the
+    # lane the messages are published in.
+    def publish_http_stream_chunks(
+        self,
+        channel,
+        chunks,
+        prev_id=None,
+        close=False,
+        max_in_flight=4,
+        id_prefix=None,
+        content_filters=None,
+        lane=None,
+        meta=None,
+    ):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        sequencer = self.sequencer if id_prefix is None else None
+        if id_prefix is None:
+            id_prefix = uuid4().hex
+        slots = threading.Semaphore(max_in_flight)
+        errors = list()
+
+        def done(result, message):
+            if not result and not errors:
+                errors.append(message)
+            slots.release()
+
+        def publish_format(http_stream, seq, prev_id):
+            slots.acquire()
+            if sequencer is not None:
+                id, prev_id = sequencer.sequence(channel)
+            else:
+                id = "%s-%d" % (id_prefix, seq)
+            item = Item(http_stream, id, prev_id, meta or {})
+            try:
+                self._publish_item(channel, item, False, done, lane)
+            except Exception:
+                slots.release()
+                raise
+            if not self.clients:
+                # nothing will call back without clients
+                slots.release()
+            return id
+
+        seq = 0
+        for chunk in chunks:
+            if errors:
+                break
+            seq += 1
+            prev_id = publish_format(
+                HttpStreamFormat(chunk, content_filters=content_filters), seq, prev_id
+            )
+        if close and not errors:
+            seq += 1
+            prev_id = publish_format(HttpStreamFormat(close=True), seq, prev_id)
+
+        # wait for the remaining messages
+        for n in range(max_in_flight):
+            slots.acquire()
+        if errors:
+            raise ValueError("failed to publish stream chunk: %s" % errors[0])
+        return prev_id
+
+    # Wait until all asynchronous publishes, including HTTP stream content
+    # held by the coalescer, have been sent.
+    def wait_all_sent(self):
+        self._check_fork()
+        if self.coalescer is not None:
+            self.coalescer.flush()
+        super(GripPubControl, self).wait_all_sent()
+
+    # Send any HTTP stream content held by the coalescer, then close this
+    # instance.
+    def close(self):
+        self._check_fork()
+        if self.coalescer is not None:
+            self.coalescer.flush()
+        super(GripPubControl, self).close()
+
+    # Make an HTTP request using each configured client, as with
+    # PubControl.http_call.
+    def http_call(self, endpoint, data, headers={}):
+        self._check_fork()
+        return super(GripPubControl, self).http_call(endpoint, data, headers)
 
     # Update the origin server settings for the GRIP proxy. To set a non-SSL
     # target, set 'host' and 'port'. To set an SSL target, set 'ssl_host' and
@@ -137,5 +394,146 @@ class GripPubControl(PubControl):
             if len(result) == 1:
                 e = result[0]
                 raise ValueError(
-                    "failed to set origin for service %s: %s" % (client.uri, e.message)
+                    "failed to set origin for service %s: %s" % (client.uri, e)
                 )
+
+    # An internal method for publishing the specified item on the ZMQ PUB
+    # socket, overridden to export the item with raw binary content as done
+    # by GripZmqPubControlClient. Nothing is done if no PUB socket is
+    # configured.
+    def _send_to_zmq(self, channel, item):
+        if self._zmq_pub_controller is not None:
+            super(GripPubControl, self)._send_to_zmq(channel, _RawBinaryItem(item))
+
+    # An internal method for reinitializing this instance if the process
+    # has forked since it was last used.
+    def _check_fork(self):
+        if self._pid is not None and self._pid != os.getpid():
+            self._after_fork()
+
+    # An internal method for reinitializing the process-local state of this
+    # instance, its clients and its helpers in a forked child process.
+    def _after_fork(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # the controller's thread and sockets belong to the parent
+        self._zmq_pub_controller = None
+        instance = getattr(type(self._zmq_ctx), "instance", None)
+        if instance is not None:
+            self._zmq_ctx = instance()
+        stale = list()
+        for client in self.clients:
+            if hasattr(client, "_after_fork"):
+                client._after_fork()
+            elif isinstance(client, PubControlClient):
+                if _reset_client(client):
+                    stale.append(client)
+            elif isinstance(client, ZmqPubControlClient):
+                if _reset_zmq_client(client):
+                    client.connect_zmq()
+        for helper in (self.metrics, self.sequencer, self.coalescer):
+            if hasattr(helper, "_after_fork"):
+                helper._after_fork()
+        self._stale_monitors = stale
+
+    # An internal method for recreating the subscription monitors of the
+    # PubControlClients that were marked stale after a fork.
+    def _rebuild_monitors(self):
+        self._lock.acquire()
+        try:
+            clients = self._stale_monitors
+            self._stale_monitors = ()
+            for client in clients:
+                _rebuild_sub_monitor(client)
+        finally:
+            self._lock.release()
+
+    # An internal method for publishing an item in the specified lane. The
+    # lane is only passed on when specified, so that subclasses overriding
+    # publish without a lane parameter keep working.
+    def _publish_item(self, channel, item, blocking, callback, lane):
+        if lane is not None:
+            self.publish(channel, item, blocking=blocking, callback=callback, lane=lane)
+        else:
+            self.publish(channel, item, blocking=blocking, callback=callback)
+
+    # An internal method for creating a GripPubControlClient from a
+    # 'control_uri' config entry and adding it to the list of clients.
+    def _apply_control_uri_entry(self, entry):
+        self._verify_not_closed()
+        claim = None
+        key = None
+        bearer = None
+        if "key" in entry:
+            if "control_iss" in entry:
+                claim = {"iss": entry["control_iss"]}
+                key = entry["key"]
+            else:
+                bearer = entry["key"]
+        handler = PubControl.SubCallbackHandler(self._client_sub_callback)
+        handler.lock.acquire()
+        try:
+            client = GripPubControlClient(
+                entry["control_uri"],
+                claim,
+                key,
+                bool(entry.get("require_subscribers")),
+                handler.handle,
+                auth_bearer=bearer,
+                retry_policy=_make_option(entry.get("retry"), RetryPolicy),
+                circuit_breaker=_make_option(
+                    entry.get("circuit_breaker"), CircuitBreaker
+                ),
+                metrics=self.metrics,
+                jwt_cache=(
+                    _make_option(entry.get("jwt_cache", True), JwtCache)
+                    if claim is not None
+                    else None
+                ),
+                conflate=entry.get("conflate", self.conflate),
+                lanes=self.lanes,
+            )
+            handler.client = client
+        finally:
+            handler.lock.release()
+        self.add_client(client)
+
+    # An internal method for creating a GripZmqPubControlClient from the
+    # specified 'control_zmq_uri' config entry and adding it.
+    def _apply_control_zmq_uri_entry(self, entry):
+        self._verify_not_closed()
+        client = GripZmqPubControlClient(
+            entry["control_zmq_uri"],
+            None,
+            None,
+            bool(entry.get("require_subscribers")),
+            True,
+            None,
+            self._zmq_ctx,
+            self._discovery_callback,
+        )
+        self.add_client(client)
+
+
+# An internal method run in a forked child process to reinitialize all
+# GripPubControl instances.
+def _after_fork_in_child():
+    for pub in list(_instances):
+        pub._check_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+# An internal method for building an optional helper object from a config
+# value. The value may be None or False (disabled), True (defaults), a dict
+# of constructor parameters, or an already constructed instance.
+def _make_option(value, cls):
+    if value is None or value is False:
+        return None
+    if value is True:
+        return cls()
+    if isinstance(value, dict):
+        return cls(**value)
+    return value
@@ -0,0 +1,492 @@
+#    grippubcontrolclient.py
+#    ~~~~~~~~~
+#    This module implements the GripPubControlClient class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+import time
+from collections import deque
+from pubcontrol import PubControlClient
+from pubcontrol.pubsubmonitor import PubSubMonitor
+from .jsonbackend import json_dumps_bytes
+from .publishlane import _LaneQueue
+from .publishmetrics import (
+    PHASE_EXPORT,
+    PHASE_SERIALIZE,
+    PHASE_QUEUE,
+    PHASE_NETWORK,
+)
+
+# Status codes indicating that the endpoint is overloaded or temporarily
+# unavailable. Requests failing with these codes are retried and count
+# against the circuit breaker. Any other failed status code is treated as
+# a permanent error for that request.
+_RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+# The fields of an exported item that are not formats.
+_ITEM_FIELDS = frozenset(["channel", "id", "prev-id", "meta"])
+
+# The clock used for latency measurements.
+_clock = getattr(time, "perf_counter", time.time)
+
+
+# The GripPubControlClient class is the PubControlClient used by
+# GripPubControl for 'control_uri' endpoints. In addition to the base
+# functionality it can retry failed requests according to a RetryPolicy
+# and guard the endpoint with a CircuitBreaker. While the breaker is open,
+# publishes fail immediately instead of queuing behind a dead endpoint.
+# When a metrics object (see PublishMetrics) is set, each publish phase is
+# timed and counted under this client's URI; otherwise no timing is done.
+# When a JwtCache is set, JWT authorization tokens are taken from it rather
+# than signed for every publish. When conflate is set to True, an
+# asynchronous publish of an item whose only format is 'http-response'
+# replaces the item still queued for the same channel, if any, so that at
+# most one such update per channel is waiting to be sent. The replaced
+# item's previous ID is kept so that the ID chain seen by the GRIP proxy
+# stays intact, and the callbacks of both publishes are called with the
+# result. A blocking publish of such an item likewise replaces the item
+# still queued for its channel, so that the older item is never sent after
+# the newer one. Asynchronous publishes can be sent through one of the
+# named PublishLanes given in lanes, each with its own queue and workers;
+# publishes without a lane use the default queue.
+class GripPubControlClient(PubControlClient):
+
+    # Whether the subscription monitor must be recreated before the next
+    # publish, after a fork.
+    _stale_monitor = False
+
+    # Initialize with the same parameters as PubControlClient plus an
+    # optional RetryPolicy, CircuitBreaker, metrics and JwtCache instance
+    # and whether to conflate http-response publishes, and an optional dict
+    # mapping lane names to PublishLane instances. If the JwtCache
+    # prefetches, the first token is minted right away.
+    def __init__(
+        self,
+        uri,
+        auth_jwt_claim=None,
+        auth_jwt_key=None,
+        require_subscribers=False,
+        sub_callback=None,
+        auth_bearer=None,
+        retry_policy=None,
+        circuit_breaker=None,
+        metrics=None,
+        jwt_cache=None,
+        conflate=False,
+        lanes=None,
+    ):
+        super(GripPubControlClient, self).__init__(
+            uri,
+            auth_jwt_claim,
+            auth_jwt_key,
+            require_subscribers,
+            sub_callback,
+            auth_bearer=auth_bearer,
+        )
+        self.retry_policy = retry_policy
+        if retry_policy is not None:
+            # retries are left to the policy, so that the circuit breaker
+            # and Retry-After handling see every attempt
+            _disable_session_retries(self.requests_session)
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
+        self.jwt_cache = jwt_cache
+        self.conflate = conflate
+        self._conflate_lock = threading.Lock()
+        # channel -> (queued item, _ConflatedCallback, lane)
+        self._conflate_pending = {}
+        self._lanes = dict(
+            (name, _LaneQueue(lane, self._pubbatch))
+            for name, lane in (lanes or {}).items()
+        )
+        if jwt_cache is not None and jwt_cache.prefetch and auth_jwt_claim:
+            jwt_cache.warm(auth_jwt_claim, auth_jwt_key)
+
+    # Publish the specified item to the specified channel. If the circuit
+    # breaker is open the publish is rejected right away: the callback is
+    # passed a failure result or, when no callback is given, an error is
+    # raised. Otherwise this behaves like PubControlClient.publish. If lane
+    # is specified, an asynchronous publish is queued in that lane.
+    def publish(self, channel, item, blocking=False, callback=None, lane=None):
+        self._verify_notclosed()
+        if lane is not None and lane not in self._lanes:
+            raise ValueError("unknown lane: " + str(lane))
+        if self._stale_monitor:
+            self.lock.acquire()
+            try:
+                if self._stale_monitor:
+                    self._stale_monitor = False
+                    _rebuild_sub_monitor(self)
+            finally:
+                self.lock.release()
+        metrics = self.metrics
+        if self.circuit_breaker is not None and self.circuit_breaker.is_open():
+            if metrics is not None:
+                metrics.increment("circuit_rejected", self.uri)
+            if callback:
+                callback(False, "circuit breaker open for " + self.uri)
+                return
+            raise ValueError("circuit breaker open for " + self.uri)
+        if self.sub_monitor and self.sub_monitor.is_closed():
+            if callback:
+                callback(False, "failed to retrieve channel subscribers")
+            else:
+                raise ValueError("failed to retrieve channel subscribers")
+            return
+        elif self.sub_monitor and not self.sub_monitor.is_channel_subscribed_to(
+            channel
+        ):
+            if callback:
+                callback(True, "")
+            return
+
+        if metrics is not None:
+            start = _clock()
+        i = item.export()
+        i["channel"] = channel
+        if metrics is not None:
+            metrics.record_latency(PHASE_EXPORT, self.uri, _clock() - start)
+
+        self.lock.acquire()
+        uri = self.uri
+        auth = self._gen_auth_header()
+        if not blocking:
+            self._ensure_thread()
+        self.lock.release()
+        if blocking:
+            superseded = None
+            if self.conflate and _is_conflatable(i):
+                superseded = self._supersede(i)
+            try:
+                self._pubcall(uri, auth, [i])
+            except Exception as e:
+                if superseded is not None:
+                    superseded(False, str(e))
+                raise
+            if superseded is not None:
+                superseded(True, "")
+        else:
+            if self.conflate and _is_conflatable(i):
+                callback = self._conflate(i, callback, lane)
+                if callback is None:
+                    return
+            if metrics is not None:
+                callback = _QueuedCallback(callback, _clock())
+            if lane is not None:
+                self._lanes[lane].put((uri, auth, i, callback))
+            else:
+                self._queue_req(("pub", uri, auth, i, callback))
+
+    # Wait until all asynchronous publishes, in every lane, have been sent.
+    def wait_all_sent(self):
+        super(GripPubControlClient, self).wait_all_sent()
+        for lane in self._lanes.values():
+            lane.wait_all_sent()
+
+    # An internal method for reinitializing the client in a forked child
+    # process, where the locks may have been held by threads of the parent,
+    # the worker threads do not exist and pooled connections are shared
+    # with the parent. Requests queued in the parent are left for the
+    # parent to send; threads, connections and the subscription monitor
+    # are recreated on demand.
+    def _after_fork(self):
+        self._stale_monitor = _reset_client(self)
+        self._conflate_lock = threading.Lock()
+        self._conflate_pending = {}
+        for lane in self._lanes.values():
+            lane._after_fork()
+        for helper in (self.circuit_breaker, self.jwt_cache, self.metrics):
+            if hasattr(helper, "_after_fork"):
+                helper._after_fork()
+
+    # An internal method for conflating the specified exported item with the
+    # item still queued for its channel in the same lane. If there is one,
+    # it is updated in place and None is returned. Otherwise the item is
+    # registered as the pending item of its channel, if none is pending in
+    # another lane, and the callback to queue it with is returned.
+    def _conflate(self, i, callback, lane=None):
+        channel = i["channel"]
+        self._conflate_lock.acquire()
+        try:
+            pending = self._conflate_pending.get(channel)
+            if pending is None:
+                callback = _ConflatedCallback(callback)
+                self._conflate_pending[channel] = (i, callback, lane)
+            elif pending[2] == lane:
+                _merge_item(pending[0], i)
+                pending[1].callbacks.append(callback)
+            else:
+                pending = None
+        finally:
+            self._conflate_lock.release()
+        if pending is not None:
+            if self.metrics is not None:
+                self.metrics.increment("items_conflated", self.uri)
+            return None
+        return callback
+
+    # An internal method for superseding the item still queued for the
+    # channel of the specified exported item, which is about to be published
+    # synchronously. The queued item is dropped rather than sent after the
+    # newer one, its previous ID is kept as for conflation, and its
+    # callback, to be called with the result of the synchronous publish, is
+    # returned. Returns None if no item is queued for the channel.
+    def _supersede(self, i):
+        self._conflate_lock.acquire()
+        try:
+            pending = self._conflate_pending.pop(i["channel"], None)
+            if pending is None:
+                return None
+            pending[1].superseded = True
+        finally:
+            self._conflate_lock.release()
+        prev_id = pending[0].get("prev-id")
+        if prev_id is not None:
+            i["prev-id"] = prev_id
+        else:
+            i.pop("prev-id", None)
+        if self.metrics is not None:
+            self.metrics.increment("items_conflated", self.uri)
+        return pending[1]
+
+    # An internal method for generating the Authorization header, using the
+    # JwtCache for JWT authorization when one is set.
+    def _gen_auth_header(self):
+        if (
+            self.jwt_cache is not None
+            and self.auth_jwt_claim
+            and not self.auth_basic_user
+            and not self.auth_bearer
+        ):
+            return self.jwt_cache.get_header(self.auth_jwt_claim, self.auth_jwt_key)
+        return super(GripPubControlClient, self)._gen_auth_header()
+
+    # An internal method for preparing the HTTP POST request for publishing
+    # data to the endpoint. This method accepts the URI endpoint, authorization
+    # header, and a list of items to publish.
+    def _pubcall(self, uri, auth_header, items):
+        metrics = self.metrics
+        uri = uri + "/publish/"
+
+        headers = dict()
+        if auth_header:
+            headers["Authorization"] = auth_header
+        headers["Content-Type"] = "application/json"
+
+        if metrics is not None:
+            start = _clock()
+        content_raw = json_dumps_bytes({"items": items})
+        if metrics is not None:
+            now = _clock()
+            metrics.record_latency(PHASE_SERIALIZE, self.uri, now - start)
+            metrics.increment("requests", self.uri)
+            start = now
+
+        try:
+            self._make_http_request(uri, content_raw, headers)
+        except Exception as e:
+            if metrics is not None:
+                metrics.record_latency(PHASE_NETWORK, self.uri, _clock() - start)
+                metrics.increment("items_failed", self.uri, len(items))
+            raise ValueError("failed to publish: " + str(e))
+        if metrics is not None:
+            metrics.record_latency(PHASE_NETWORK, self.uri, _clock() - start)
+            metrics.increment("items_published", self.uri, len(items))
+
+    # An internal method for publishing a batch of queued requests. Items
+    # taken from the queue stop being pending for conflation, and items
+    # superseded by a synchronous publish are dropped. When metrics are
+    # enabled the time each request spent in the queue is recorded before
+    # publishing.
+    def _pubbatch(self, reqs):
+        if self.conflate:
+            self._conflate_lock.acquire()
+            for req in reqs:
+                item = req[2]
+                pending = self._conflate_pending.get(item["channel"])
+                if pending is not None and pending[0] is item:
+                    del self._conflate_pending[item["channel"]]
+            reqs = [req for req in reqs if not _is_superseded(req[3])]
+            self._conflate_lock.release()
+            if not reqs:
+                return
+        metrics = self.metrics
+        if metrics is not None:
+            now = _clock()
+            for req in reqs:
+                callback = req[3]
+                if isinstance(callback, _QueuedCallback):
+                    metrics.record_latency(
+                        PHASE_QUEUE, self.uri, now - callback.queued_at
+                    )
+        super(GripPubControlClient, self)._pubbatch(reqs)
+
+    # An internal method for making an HTTP request to the specified URI
+    # with the specified content and headers. Failed attempts are retried
+    # with backoff according to the retry policy and the outcome of each
+    # attempt is recorded with the circuit breaker.
+    def _make_http_request(self, uri, data, headers):
+        attempt = 0
+        while True:
+            breaker = self.circuit_breaker
+            if breaker is not None and not breaker.allow_request():
+                raise ValueError("circuit breaker open for " + self.uri)
+
+            retry_after = None
+            try:
+                res = self.requests_session.post(uri, headers=headers, data=data)
+            except Exception as e:
+                error = e
+                retryable = True
+            else:
+                if 200 <= res.status_code < 300:
+                    if breaker is not None:
+                        breaker.record_success()
+                    return (res.status_code, res.headers, res.text)
+                error = ValueError(
+                    "received failed status code "
+                    + str(res.status_code)
+                    + " with message: "
+                    + res.text
+                )
+                retryable = res.status_code in _RETRY_STATUS_CODES
+                retry_after = _parse_retry_after(res.headers.get("Retry-After"))
+
+            if breaker is not None:
+                # a non-retryable failure means the endpoint is responding
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+            policy = self.retry_policy
+            if not retryable or policy is None or attempt >= policy.max_retries:
+                raise error
+            if self.metrics is not None:
+                self.metrics.increment("retries", self.uri)
+
+            delay = policy.get_delay(attempt)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, policy.max_delay))
+            time.sleep(delay)
+            attempt += 1
+
+
+# The _QueuedCallback class wraps the callback of an asynchronous publish
+# to remember when the request was queued. It is only used when metrics
+# are enabled.
+class _QueuedCallback(object):
+    def __init__(self, callback, queued_at):
+        self.callback = callback
+        self.queued_at = queued_at
+
+    def __call__(self, result, message):
+        if self.callback:
+            self.callback(result, message)
+
+
+# The _ConflatedCallback class calls the callbacks of all publishes that
+# were conflated into a single queued item.
+class _ConflatedCallback(object):
+    def __init__(self, callback):
+        self.callbacks = [callback]
+        self.superseded = False
+
+    def __call__(self, result, message):
+        for callback in self.callbacks:
+            if callback:
+                callback(result, message)
+
+
+# An internal method for reinitializing the process-local state of the
+# specified PubControlClient in a forked child process. Returns whether the
+# client's subscription monitor is stale and must be recreated with
+# _rebuild_sub_monitor before the client is used, which is left to the
+# first publish so that no thread is started in the fork hook.
+def _reset_client(client):
+    client.lock = threading.Lock()
+    client.thread = None
+    client.thread_cond = None
+    client.req_queue = deque()
+    # drop the connections shared with the parent
+    client.requests_session.close()
+    monitor = client.sub_monitor
+    if monitor is None:
+        return False
+    # the monitor's lock may have been held by a thread of the parent and
+    # its stream thread only exists in the parent
+    monitor._lock = threading.Lock()
+    return not monitor.is_closed()
+
+
+# An internal method for replacing the stale subscription monitor of the
+# specified client, inherited from the parent process, with a new one.
+def _rebuild_sub_monitor(client):
+    monitor = client.sub_monitor
+    callback = monitor._callback
+    monitor.close()
+    monitor._requests_session.close()
+    client.sub_monitor = PubSubMonitor(
+        client.uri,
+        client.auth_jwt_claim,
+        client.auth_jwt_key,
+        callback,
+        client.auth_bearer,
+    )
+
+
+# An internal method for replacing the retrying adapters that
+# PubControlClient mounts on the specified requests session with adapters
+# that never retry.
+def _disable_session_retries(session):
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+# An internal method for determining whether the specified exported item
+# can be conflated, which is the case if its only format is 'http-response'.
+def _is_conflatable(i):
+    if "http-response" not in i:
+        return False
+    for name in i:
+        if name not in _ITEM_FIELDS and name != "http-response":
+            return False
+    return True
+
+
+# An internal method for determining whether the queued item with the
+# specified callback was superseded by a synchronous publish.
+def _is_superseded(callback):
+    if isinstance(callback, _QueuedCallback):
+        callback = callback.callback
+    return isinstance(callback, _ConflatedCallback) and callback.superseded
+
+
+# An internal method for replacing the contents of the specified pending
+# exported item with those of the specified newer item. The pending item's
+# previous ID is kept, since the newer item's previous ID refers to the
+# item being replaced, which is never sent.
+def _merge_item(pending, i):
+    prev_id = pending.get("prev-id")
+    pending.clear()
+    pending.update(i)
+    if prev_id is not None:
+        pending["prev-id"] = prev_id
+    else:
+        pending.pop("prev-id", None)
+
+
+# An internal method for parsing the number of seconds from a Retry-After
+# header. HTTP-date values are ignored.
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
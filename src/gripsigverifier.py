@@ -0,0 +1,138 @@
+#    gripsigverifier.py
+#    ~~~~~~~~~
+#    This module implements the GripSigVerifier class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import jwt
+from jwt.algorithms import get_default_algorithms
+from .gripcontrol import _is_unicode_instance, _timestamp_utcnow
+
+# The signature algorithms accepted for the Grip-Sig header, as in
+# validate_sig.
+_ALGORITHMS = ["HS256", "RS256", "ES256"]
+
+
+# The GripSigVerifier class validates Grip-Sig headers against a set of
+# keys, such as during key rotation. Each key can have a key ID ('kid')
+# and an expected issuer ('iss'). The key for a token is selected through
+# an index on the 'kid' in the JWT header; a token whose 'kid' is not in
+# the keyset is rejected without trying any key. Only tokens without a
+# 'kid' fall back to trying the keys, starting with those whose issuer
+# matches the token's 'iss' claim. Keys are prepared for their algorithm
+# once and cached. The keyset can be replaced at any time with set_keys;
+# readers never lock, they simply use the keyset that was current when
+# they started.
+class GripSigVerifier(object):
+
+    # Initialize with the keys to verify against. The keys parameter can
+    # be a dict mapping key IDs to keys, or a list of dicts each with a
+    # 'key' entry and optional 'kid' and 'iss' entries.
+    def __init__(self, keys=None):
+        self._keyset = _KeySet([])
+        if keys:
+            self.set_keys(keys)
+
+    # Replace the keyset. The keys parameter is as for the constructor.
+    def set_keys(self, keys):
+        if isinstance(keys, dict):
+            keys = [{"kid": kid, "key": key} for kid, key in keys.items()]
+        self._keyset = _KeySet(
+            [_Key(k["key"], k.get("kid"), k.get("iss")) for k in keys]
+        )
+
+    # The key IDs of the current keyset.
+    @property
+    def kids(self):
+        return sorted(self._keyset.by_kid)
+
+    # Validate the specified JWT token in the same way as validate_sig,
+    # using the key selected from the keyset. If iss is specified the
+    # token's 'iss' claim must also match it.
+    def validate(self, token, iss=None):
+        keyset = self._keyset
+        if _is_unicode_instance(token):
+            token = token.encode("utf-8")
+        try:
+            header = jwt.get_unverified_header(token)
+        except Exception:
+            return False
+        alg = header.get("alg")
+        kid = header.get("kid")
+        if kid is not None:
+            key = keyset.by_kid.get(kid)
+            if key is None:
+                return False
+            return _verify(token, key, alg, iss)
+        candidates = keyset.keys
+        if keyset.by_iss:
+            try:
+                claim = jwt.decode(token, options={"verify_signature": False})
+            except Exception:
+                return False
+            preferred = keyset.by_iss.get(claim.get("iss"), [])
+            if preferred:
+                candidates = preferred + [k for k in keyset.keys if k not in preferred]
+        for key in candidates:
+            if _verify(token, key, alg, iss):
+                return True
+        return False
+
+
+# An internal class holding a key, its ID and issuer and its prepared form
+# for each algorithm it has been used with.
+class _Key(object):
+    def __init__(self, key, kid=None, iss=None):
+        self.key = key
+        self.kid = kid
+        self.iss = iss
+        self.prepared = dict()
+
+    # Return the key prepared for the specified algorithm.
+    def prepare(self, alg):
+        prepared = self.prepared.get(alg)
+        if prepared is None:
+            algorithm = get_default_algorithms().get(alg)
+            prepared = algorithm.prepare_key(self.key) if algorithm else self.key
+            self.prepared[alg] = prepared
+        return prepared
+
+
+# An internal class holding an immutable keyset and its indexes.
+class _KeySet(object):
+    def __init__(self, keys):
+        self.keys = keys
+        self.by_kid = dict()
+        self.by_iss = dict()
+        for key in keys:
+            if key.kid is not None:
+                self.by_kid[key.kid] = key
+            if key.iss is not None:
+                self.by_iss.setdefault(key.iss, []).append(key)
+
+
+# An internal method for verifying the specified token with the specified
+# key.
+def _verify(token, key, alg, iss):
+    if alg not in _ALGORITHMS:
+        return False
+    try:
+        claim = jwt.decode(token, key.prepare(alg), algorithms=_ALGORITHMS)
+    except Exception:
+        return False
+
+    exp = claim.get("exp")
+    if not exp:
+        return False
+
+    if _timestamp_utcnow() >= exp:
+        return False
+
+    if key.iss is not None and claim.get("iss") != key.iss:
+        return False
+
+    if iss is not None and claim.get("iss") != iss:
+        return False
+
+    return True
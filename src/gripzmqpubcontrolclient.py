@@ -0,0 +1,101 @@
+#    gripzmqpubcontrolclient.py
+#    ~~~~~~~~~
+#    This module implements the GripZmqPubControlClient class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+from pubcontrol import ZmqPubControlClient, Item, Format
+from .httpresponseformat import HttpResponseFormat
+from .httpstreamformat import HttpStreamFormat
+
+
+# The GripZmqPubControlClient class is the ZmqPubControlClient used by
+# GripPubControl for 'control_zmq_uri' config entries. Since TNetStrings
+# carry byte strings natively, binary HTTP response bodies and HTTP stream
+# content are published as raw bytes in the 'body' and 'content' fields
+# instead of being base64-encoded into 'body-bin' and 'content-bin'.
+class GripZmqPubControlClient(ZmqPubControlClient):
+
+    # Whether the sockets must be recreated before the next publish, after
+    # a fork.
+    _reconnect = False
+
+    # An internal method for publishing the specified item, overridden to
+    # export the item with raw binary content.
+    def _publish(self, channel, item, blocking=False, callback=None):
+        if self._reconnect:
+            self._reconnect = False
+            self.connect_zmq()
+        super(GripZmqPubControlClient, self)._publish(
+            channel, _RawBinaryItem(item), blocking, callback
+        )
+
+    # An internal method for reinitializing the client in a forked child
+    # process. ZMQ sockets and contexts must not be used across a fork, so
+    # the sockets of the parent are abandoned and new ones are connected,
+    # with the child's own context, on the next publish.
+    def _after_fork(self):
+        self._reconnect = _reset_zmq_client(self)
+
+
+# An internal class wrapping an Item so that the formats supporting it are
+# exported with raw binary content. Other formats are exported as usual.
+class _RawBinaryItem(Item):
+    def __init__(self, item):
+        super(_RawBinaryItem, self).__init__(
+            [_raw_binary_format(f) for f in item.formats],
+            item.id,
+            item.prev_id,
+            item.meta,
+        )
+
+
+# An internal class wrapping a format so that it is exported with raw
+# binary content.
+class _RawBinaryFormat(Format):
+    def __init__(self, format):
+        self.format = format
+
+    def name(self):
+        return self.format.name()
+
+    def export(self):
+        return self.format.export(raw_binary=True)
+
+
+# The _RawBinaryFormat subclasses by wrapped format class. Each is named
+# after the class it wraps, so that Item.export still rejects duplicate
+# formats.
+_raw_binary_types = {}
+
+
+# An internal method for wrapping the specified format in a
+# _RawBinaryFormat if it supports raw binary content.
+def _raw_binary_format(format):
+    if not isinstance(format, (HttpResponseFormat, HttpStreamFormat)):
+        return format
+    cls = format.__class__
+    wrapper = _raw_binary_types.get(cls)
+    if wrapper is None:
+        wrapper = type(cls.__name__, (_RawBinaryFormat,), {})
+        _raw_binary_types[cls] = wrapper
+    return wrapper(format)
+
+
+# An internal method for reinitializing the process-local state of the
+# specified ZmqPubControlClient in a forked child process. Returns whether
+# the client had connected sockets, which must be connected again.
+def _reset_zmq_client(client):
+    client._lock = threading.Lock()
+    client._thread_cond = threading.Condition()
+    client._publish_threads = list()
+    client._discovery_in_progress = False
+    connected = client._push_sock is not None or client._pub_controller is not None
+    client._push_sock = None
+    client._pub_controller = None
+    instance = getattr(type(client._context), "instance", None)
+    if instance is not None:
+        client._context = instance()
+    return connected
@@ -0,0 +1,67 @@
+#    headerset.py
+#    ~~~~~~~~~
+#    This module implements the HeaderSet class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import os
+import threading
+
+
+# The HeaderSet class is an immutable dict of HTTP response headers. Since
+# it cannot change it can be shared by any number of responses and formats
+# without being copied. Use HeaderSet.intern to get a single shared
+# instance for each distinct set of headers.
+class HeaderSet(dict):
+
+    # The maximum number of distinct header sets kept by intern.
+    max_interned = 1024
+
+    _interned = dict()
+    _lock = threading.Lock()
+
+    # Return the shared HeaderSet with the same headers as the specified
+    # dict, creating it if needed. Once max_interned header sets are held a
+    # new unshared instance is returned for any other header set.
+    @classmethod
+    def intern(cls, headers):
+        key = frozenset(headers.items())
+        with cls._lock:
+            out = cls._interned.get(key)
+            if out is None:
+                out = cls(headers)
+                if len(cls._interned) < cls.max_interned:
+                    cls._interned[key] = out
+        return out
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def __repr__(self):
+        return "HeaderSet(%s)" % dict.__repr__(self)
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("HeaderSet is immutable")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+    __ior__ = _readonly
+
+    # An internal method for reinitializing the intern lock in a forked
+    # child process.
+    @classmethod
+    def _after_fork(cls):
+        cls._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=HeaderSet._after_fork)
@@ -7,7 +7,8 @@
 
 from base64 import b64encode
 from pubcontrol import Format
-from .gripcontrol import _bin_or_text
+from .gripcontrol import _bin_or_text, _is_unicode_instance
+from .gripfilters import _add_content_filters
 
 
 # The HttpResponseFormat class is the format used to publish messages to
@@ -29,10 +30,19 @@ class HttpResponseFormat(Format):
     def name(self):
         return "http-response"
 
+    # Add the specified content filters, such as VAR_SUBST from the
+    # gripfilters module, to those the GRIP proxy applies to the body of
+    # this message. Filters already present are not added again. Returns
+    # this instance.
+    def add_content_filters(self, *filters):
+        _add_content_filters(self, filters)
+        return self
+
     # Export the message into the required format and include only the fields
     # that are set. The body is exported as base64 if the text is encoded as
-    # binary.
-    def export(self):
+    # binary, unless raw_binary is set to True for transports that carry raw
+    # bytes (such as ZMQ), in which case it is exported as bytes.
+    def export(self, raw_binary=False):
         out = dict()
         if self.content_filters is not None:
             out["content-filters"] = self.content_filters
@@ -42,12 +52,25 @@ class HttpResponseFormat(Format):
             out["reason"] = self.reason
         if self.headers:
             out["headers"] = self.headers
-        if self.body is not None:
-            is_text, val = _bin_or_text(self.body)
-            if is_text:
-                out["body"] = val
-            else:
-                out["body-bin"] = b64encode(val)
-        else:
-            out["body"] = ""
+        _export_body(out, self.body, raw_binary)
         return out
+
+
+# An internal method for adding the specified body to an exported
+# http-response dict. The body is exported as base64 if the text is
+# encoded as binary, or always as bytes if raw_binary is set.
+def _export_body(out, body, raw_binary=False):
+    if raw_binary:
+        if body is None:
+            body = b""
+        elif _is_unicode_instance(body):
+            body = body.encode("utf-8")
+        out["body"] = body
+    elif body is not None:
+        is_text, val = _bin_or_text(body)
+        if is_text:
+            out["body"] = val
+        else:
+            out["body-bin"] = b64encode(val)
+    else:
+        out["body"] = ""
@@ -7,7 +7,8 @@
 
 from base64 import b64encode
 from pubcontrol import Format
-from .gripcontrol import _bin_or_text
+from .gripcontrol import _bin_or_text, _is_unicode_instance
+from .gripfilters import _add_content_filters
 
 
 # The HttpStreamFormat class is the format used to publish messages to
@@ -28,10 +29,20 @@ class HttpStreamFormat(Format):
     def name(self):
         return "http-stream"
 
+    # Add the specified content filters, such as VAR_SUBST from the
+    # gripfilters module, to those the GRIP proxy applies to the content of
+    # this message. Filters already present are not added again. Returns
+    # this instance.
+    def add_content_filters(self, *filters):
+        _add_content_filters(self, filters)
+        return self
+
     # Exports the message in the required format depending on whether the
     # message content is binary or not, or whether the connection should
-    # be closed.
-    def export(self):
+    # be closed. If raw_binary is set to True, for transports that carry raw
+    # bytes (such as ZMQ), the content is always exported as bytes instead
+    # of as base64.
+    def export(self, raw_binary=False):
         out = dict()
         if self.close:
             out["action"] = "close"
@@ -39,6 +50,13 @@ class HttpStreamFormat(Format):
             if self.content_filters is not None:
                 out["content-filters"] = self.content_filters
 
+            if raw_binary:
+                val = self.content
+                if _is_unicode_instance(val):
+                    val = val.encode("utf-8")
+                out["content"] = val
+                return out
+
             is_text, val = _bin_or_text(self.content)
             if is_text:
                 out["content"] = val
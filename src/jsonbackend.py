@@ -0,0 +1,129 @@
+#    jsonbackend.py
+#    ~~~~~~~~~
+#    This module implements the pluggable JSON serializer.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+# All JSON produced by this package (hold instructions, WebSocket control
+# messages and publish request bodies) goes through json_dumps or
+# json_dumps_bytes. The default 'json' backend uses the standard library
+# and produces exactly the same output as json.dumps. The 'orjson' and
+# 'ujson' backends are faster but produce compact output (no spaces after
+# separators); the decoded values are identical. Use set_json_backend to
+# select a backend by name, 'auto' for the fastest one installed, or pass
+# a custom dumps callable returning either str or bytes.
+
+import json
+
+
+def _json_dumps(obj):
+    return json.dumps(obj)
+
+
+def _json_dumps_bytes(obj):
+    out = json.dumps(obj)
+    if not isinstance(out, bytes):
+        out = out.encode("utf-8")
+    return out
+
+
+def _make_orjson_dumps(orjson):
+    def dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    return dumps, orjson.dumps
+
+
+def _make_ujson_dumps(ujson):
+    def dumps(obj):
+        return ujson.dumps(obj, escape_forward_slashes=False)
+
+    def dumps_bytes(obj):
+        return ujson.dumps(obj, escape_forward_slashes=False).encode("utf-8")
+
+    return dumps, dumps_bytes
+
+
+_backend = "json"
+_dumps = _json_dumps
+_dumps_bytes = _json_dumps_bytes
+
+
+# Select the JSON backend. The backend parameter can be 'json', 'orjson',
+# 'ujson', 'auto' (orjson, then ujson, then json, whichever is installed
+# first) or a callable accepting an object and returning str or bytes. A
+# ValueError is raised if the named backend is not installed.
+def set_json_backend(backend):
+    global _backend, _dumps, _dumps_bytes
+    if backend == "auto":
+        if _import_backend("orjson") is not None:
+            backend = "orjson"
+        elif _import_backend("ujson") is not None:
+            backend = "ujson"
+        else:
+            backend = "json"
+    if backend == "json":
+        dumps, dumps_bytes = _json_dumps, _json_dumps_bytes
+    elif backend in ("orjson", "ujson"):
+        module = _import_backend(backend)
+        if module is None:
+            raise ValueError("%s package must be installed" % backend)
+        if backend == "orjson":
+            dumps, dumps_bytes = _make_orjson_dumps(module)
+        else:
+            dumps, dumps_bytes = _make_ujson_dumps(module)
+    elif callable(backend):
+        dumps, dumps_bytes = _wrap_custom(backend)
+    else:
+        raise ValueError("unknown json backend: %s" % backend)
+    _backend = backend
+    _dumps = dumps
+    _dumps_bytes = dumps_bytes
+
+
+# Return the name of the current JSON backend, or the callable if a custom
+# backend was set.
+def get_json_backend():
+    return _backend
+
+
+# Serialize the specified object to a JSON text string using the current
+# backend.
+def json_dumps(obj):
+    return _dumps(obj)
+
+
+# Serialize the specified object to UTF-8 encoded JSON bytes using the
+# current backend. Backends that natively produce bytes avoid an extra
+# encoding pass.
+def json_dumps_bytes(obj):
+    return _dumps_bytes(obj)
+
+
+# An internal method for importing an optional backend module. Returns
+# None if the module is not installed. Backends are only imported when
+# selected so that importing this package stays cheap.
+def _import_backend(name):
+    try:
+        return __import__(name)
+    except ImportError:
+        return None
+
+
+# An internal method for adapting a custom dumps callable so that it can
+# be used for both text and bytes output.
+def _wrap_custom(func):
+    def dumps(obj):
+        out = func(obj)
+        if isinstance(out, bytes):
+            out = out.decode("utf-8")
+        return out
+
+    def dumps_bytes(obj):
+        out = func(obj)
+        if not isinstance(out, bytes):
+            out = out.encode("utf-8")
+        return out
+
+    return dumps, dumps_bytes
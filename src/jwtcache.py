@@ -0,0 +1,131 @@
+#    jwtcache.py
+#    ~~~~~~~~~
+#    This module implements the JwtCache class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import copy
+import threading
+import time
+import jwt
+
+
+# The JwtCache class caches the signed JWT Authorization header used to
+# publish to a control URI, so that a token is signed once and then reused
+# until refresh_margin seconds before it expires instead of being signed
+# for every publish. Tokens get an 'exp' claim ttl seconds in the future
+# unless the claim already has one. If the header is requested while
+# another thread is refreshing it and the current token is still valid,
+# the current token is returned rather than waiting. With prefetch set to
+# True the next token is minted in a background thread once the refresh
+# time is reached, so publishing threads never sign a token after the
+# first one. The cache is keyed on the identity of the claim and key
+# objects; passing a different claim or key mints a new token.
+class JwtCache(object):
+
+    # Initialize with the token lifetime, the number of seconds before
+    # expiry at which the token is refreshed, and whether to refresh in the
+    # background.
+    def __init__(self, ttl=3600, refresh_margin=300, prefetch=False):
+        if refresh_margin >= ttl:
+            raise ValueError("refresh_margin must be less than ttl")
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.prefetch = prefetch
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        # (claim, key, header, refresh_at, expires_at)
+        self._state = None
+
+    # Return the 'Bearer' Authorization header value for the specified
+    # claim and key, minting a new token only when needed.
+    def get_header(self, claim, key):
+        state = self._state
+        now = time.time()
+        if state is not None and state[0] is claim and state[1] is key:
+            if now < state[3]:
+                return state[2]
+            if now < state[4]:
+                # still valid: refresh without making callers wait
+                if self.prefetch:
+                    self._start_refresh(claim, key)
+                    return state[2]
+                if not self._lock.acquire(False):
+                    return state[2]
+                try:
+                    return self._mint(claim, key)
+                finally:
+                    self._lock.release()
+        with self._lock:
+            state = self._state
+            if (
+                state is not None
+                and state[0] is claim
+                and state[1] is key
+                and time.time() < state[3]
+            ):
+                return state[2]
+            return self._mint(claim, key)
+
+    # Mint a token for the specified claim and key ahead of the first
+    # publish.
+    def warm(self, claim, key):
+        self.get_header(claim, key)
+
+    # Drop the cached token.
+    def clear(self):
+        with self._lock:
+            self._state = None
+
+    # An internal method for reinitializing the cache in a forked child
+    # process. The cached token stays valid; a refresh running in the
+    # parent does not exist in the child.
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    # An internal method for starting a background refresh unless one is
+    # already running. Only the refresh lock is taken, which is never held
+    # while signing.
+    def _start_refresh(self, claim, key):
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        thread = threading.Thread(target=self._refresh, args=(claim, key))
+        thread.daemon = True
+        thread.start()
+
+    # An internal method run by the background refresh thread. The token is
+    # signed without holding any lock and the cached state is then replaced
+    # in a single assignment, so publishing threads never wait for it.
+    def _refresh(self, claim, key):
+        try:
+            self._state = self._sign(claim, key)
+        finally:
+            with self._refresh_lock:
+                self._refreshing = False
+
+    # An internal method for signing a new token and caching its header.
+    # Must be called with the lock held.
+    def _mint(self, claim, key):
+        self._state = self._sign(claim, key)
+        return self._state[2]
+
+    # An internal method for signing a new token. Returns the new cached
+    # state.
+    def _sign(self, claim, key):
+        now = time.time()
+        token_claim = claim
+        if "exp" not in claim:
+            token_claim = copy.copy(claim)
+            token_claim["exp"] = int(now) + self.ttl
+        token = jwt.encode(token_claim, key)
+        if isinstance(token, bytes):
+            token = token.decode("utf-8")
+        header = "Bearer " + token
+        expires_at = token_claim["exp"]
+        return (claim, key, header, expires_at - self.refresh_margin, expires_at)
@@ -0,0 +1,131 @@
+#    publishlane.py
+#    ~~~~~~~~~
+#    This module implements the PublishLane class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+from collections import deque
+
+
+# The PublishLane class describes a named priority lane for asynchronous
+# publishes, such as a 'realtime' lane for user-visible notifications and a
+# 'bulk' lane for backfills. Each GripPubControlClient gives every lane its
+# own queue, so items published to one lane are never queued behind items
+# of another. Queued items are sent in requests of up to batch_size items
+# by up to concurrency worker threads. With a concurrency greater than 1,
+# requests of the same lane may complete out of order.
+class PublishLane(object):
+
+    # Initialize with the maximum number of items per request and the
+    # maximum number of requests in flight.
+    def __init__(self, batch_size=10, concurrency=1):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+
+# An internal class implementing the queue and worker threads of a lane for
+# a single client. Queued requests are (uri, auth header, item, callback)
+# tuples, and each batch is passed to the specified pubbatch method.
+class _LaneQueue(object):
+    def __init__(self, lane, pubbatch):
+        self.lane = lane
+        self.pubbatch = pubbatch
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.threads = list()
+        self.idle = 0
+        self.stopping = False
+
+    # Queue the specified request, starting a worker thread if none is idle
+    # and the lane's concurrency allows. Workers that have exited no longer
+    # count towards the concurrency.
+    def put(self, req):
+        self.cond.acquire()
+        try:
+            self.queue.append(req)
+            self.threads = [t for t in self.threads if t.is_alive()]
+            if self.idle == 0 and len(self.threads) < self.lane.concurrency:
+                self._start_thread()
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    # Wait until all queued requests have been sent and stop the worker
+    # threads.
+    def wait_all_sent(self):
+        self.cond.acquire()
+        self.stopping = True
+        threads = list(self.threads)
+        self.cond.notify_all()
+        self.cond.release()
+        for thread in threads:
+            thread.join()
+        self.cond.acquire()
+        # workers started while the others were stopping are kept
+        self.threads = [t for t in self.threads if t.is_alive()]
+        self.stopping = False
+        if self.queue and self.idle == 0 and not self.threads:
+            # queued while the workers were stopping
+            self._start_thread()
+        self.cond.release()
+
+    # An internal method for reinitializing the queue in a forked child
+    # process. Requests queued in the parent are left for the parent.
+    def _after_fork(self):
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.threads = list()
+        self.idle = 0
+        self.stopping = False
+
+    # An internal method for starting a worker thread. Must be called with
+    # the lock held.
+    def _start_thread(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        self.threads.append(thread)
+        thread.start()
+
+    # An internal method run by each worker thread. If publishing a batch
+    # raises an error, the callbacks of its requests are passed a failure
+    # result.
+    def _run(self):
+        self.cond.acquire()
+        try:
+            while True:
+                while not self.queue and not self.stopping:
+                    self.idle += 1
+                    self.cond.wait()
+                    self.idle -= 1
+                if not self.queue:
+                    return
+                reqs = list()
+                while self.queue and len(reqs) < self.lane.batch_size:
+                    reqs.append(self.queue.popleft())
+                self.cond.release()
+                try:
+                    self.pubbatch(reqs)
+                except Exception as e:
+                    _fail(reqs, str(e))
+                finally:
+                    self.cond.acquire()
+        finally:
+            self.cond.release()
+
+
+# An internal method for passing a failure result with the specified message
+# to the callbacks of the specified requests.
+def _fail(reqs, message):
+    for req in reqs:
+        callback = req[3]
+        if callback:
+            try:
+                callback(False, message)
+            except Exception:
+                pass
@@ -0,0 +1,152 @@
+#    publishmetrics.py
+#    ~~~~~~~~~
+#    This module implements the PublishMetrics and LatencyHistogram classes.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+
+# The publish phases timed by GripPubControlClient. 'export' covers
+# exporting the item and its formats, 'serialize' covers JSON encoding of
+# a request body, 'queue' is the time an asynchronous publish waits before
+# the worker thread picks it up and 'network' is the HTTP request to the
+# control endpoint including any retries.
+PHASE_EXPORT = "export"
+PHASE_SERIALIZE = "serialize"
+PHASE_QUEUE = "queue"
+PHASE_NETWORK = "network"
+
+
+# The LatencyHistogram class records latencies in an HDR-style log-linear
+# histogram. Values are stored in microseconds and bucketed so that the
+# relative error of any bucket is bounded by 2 ** -significant_bits. Buckets
+# are allocated sparsely, so memory use depends only on the spread of the
+# recorded values. This class is not thread-safe on its own; PublishMetrics
+# serializes access to it.
+class LatencyHistogram(object):
+
+    # Initialize with the number of significant bits kept per value.
+    def __init__(self, significant_bits=3):
+        self._significant_bits = significant_bits
+        self._buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    # Record a latency given in seconds.
+    def record(self, seconds):
+        value = max(0, int(seconds * 1000000))
+        shift = max(0, value.bit_length() - self._significant_bits - 1)
+        key = (value >> shift) << shift
+        self._buckets[key] = self._buckets.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    # Return the latency in seconds at or below which the specified
+    # fraction (0.0 - 1.0) of recorded values fall, or None if nothing has
+    # been recorded.
+    def percentile(self, fraction):
+        if self.count == 0:
+            return None
+        target = max(1, fraction * self.count)
+        seen = 0
+        for lower, count in sorted(self._buckets.items()):
+            seen += count
+            if seen >= target:
+                return min(self._upper_bound(lower), self.max) / 1000000.0
+        return self.max / 1000000.0
+
+    # Export the histogram as a plain dict. Latencies are in seconds and
+    # 'buckets' is a list of [upper bound, count] pairs sorted by bound.
+    def export(self):
+        out = {"count": self.count, "sum": self.total / 1000000.0}
+        if self.count:
+            out["min"] = self.min / 1000000.0
+            out["max"] = self.max / 1000000.0
+            out["p50"] = self.percentile(0.5)
+            out["p90"] = self.percentile(0.9)
+            out["p99"] = self.percentile(0.99)
+            out["p999"] = self.percentile(0.999)
+        out["buckets"] = [
+            [self._upper_bound(lower) / 1000000.0, count]
+            for lower, count in sorted(self._buckets.items())
+        ]
+        return out
+
+    # An internal method for getting the inclusive upper bound in
+    # microseconds of the bucket starting at the specified value.
+    def _upper_bound(self, lower):
+        shift = max(0, lower.bit_length() - self._significant_bits - 1)
+        return lower + (1 << shift) - 1
+
+
+# The PublishMetrics class collects counters and per-phase latency
+# histograms for each control URI. An instance can be passed to
+# GripPubControl via the 'metrics' parameter; when no instance is passed
+# the publish path skips all timing. Subclasses may override
+# record_latency and increment to forward measurements elsewhere, and
+# export returns a plain dict suitable for Prometheus or StatsD adapters.
+# All methods are thread-safe.
+class PublishMetrics(object):
+
+    # Initialize with the number of significant bits used by histograms.
+    def __init__(self, significant_bits=3):
+        self._significant_bits = significant_bits
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    # Record a latency in seconds for the specified phase and control URI.
+    def record_latency(self, phase, control_uri, seconds):
+        self._lock.acquire()
+        try:
+            phases = self._histograms.setdefault(control_uri, {})
+            hist = phases.get(phase)
+            if hist is None:
+                hist = LatencyHistogram(self._significant_bits)
+                phases[phase] = hist
+            hist.record(seconds)
+        finally:
+            self._lock.release()
+
+    # Increment the named counter for the specified control URI.
+    def increment(self, name, control_uri, value=1):
+        self._lock.acquire()
+        counters = self._counters.setdefault(control_uri, {})
+        counters[name] = counters.get(name, 0) + value
+        self._lock.release()
+
+    # Export all counters and histograms as a plain dict of the form
+    # {'counters': {uri: {name: value}},
+    #  'latencies': {uri: {phase: histogram}}}.
+    def export(self):
+        self._lock.acquire()
+        try:
+            counters = dict(
+                (uri, dict(values)) for uri, values in self._counters.items()
+            )
+            latencies = dict(
+                (uri, dict((phase, h.export()) for phase, h in phases.items()))
+                for uri, phases in self._histograms.items()
+            )
+        finally:
+            self._lock.release()
+        return {"counters": counters, "latencies": latencies}
+
+    # Discard everything recorded so far.
+    def reset(self):
+        self._lock.acquire()
+        self._counters = {}
+        self._histograms = {}
+        self._lock.release()
+
+    # An internal method for reinitializing the lock in a forked child
+    # process, where it may have been held by a thread of the parent.
+    def _after_fork(self):
+        self._lock = threading.Lock()
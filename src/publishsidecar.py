@@ -0,0 +1,345 @@
+#    publishsidecar.py
+#    ~~~~~~~~~
+#    This module implements the PublishSidecar and SidecarPubControl classes.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import json
+import os
+import socket
+import struct
+import threading
+from collections import OrderedDict
+from pubcontrol import Format, Item
+from .jsonbackend import json_dumps_bytes
+from .httpresponseformat import HttpResponseFormat
+from .httpstreamformat import HttpStreamFormat
+from .gripcontrol import _is_basestring_instance
+
+# The frame header: the length of the JSON payload that follows.
+_HEADER = struct.Struct(">I")
+
+
+# The PublishSidecar class is a per-host aggregator for pre-fork servers
+# with many worker processes. Instead of each worker keeping its own
+# GripPubControl and connections to the control URI, workers publish
+# through a SidecarPubControl, which sends the items over a local Unix
+# socket to a single PublishSidecar. The sidecar forwards them
+# asynchronously through its GripPubControl, whose clients batch them into
+# as few requests as possible over their pooled connections. Items with an
+# ID that was already forwarded to the same channel recently (such as the
+# same event published by several workers) are dropped; dedupe_size sets
+# how many recent IDs are remembered, or 0 to disable this. The forwarded,
+# deduped and failed attributes count the messages received. Frames larger
+# than max_frame bytes close the connection they were received on. The
+# socket file is given the permissions in mode, so that by default only
+# the sidecar's user can publish with its control credentials.
+class PublishSidecar(object):
+
+    # Initialize with the GripPubControl to forward items to and the path
+    # of the Unix socket to listen on.
+    def __init__(
+        self, pub, path, dedupe_size=10000, max_frame=16 * 1024 * 1024, mode=0o600
+    ):
+        self.pub = pub
+        self.path = path
+        self.mode = mode
+        self.dedupe_size = dedupe_size
+        self.max_frame = max_frame
+        self.forwarded = 0
+        self.deduped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self._sock = None
+        self._conns = set()
+        self._thread = None
+        self._stopped = False
+
+    # Start listening in a background thread. An existing socket file at
+    # the path is replaced.
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        os.chmod(self.path, self.mode)
+        sock.listen(128)
+        sock.settimeout(0.2)
+        self._sock = sock
+        self._stopped = False
+        self._thread = threading.Thread(target=self._accept_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Stop listening, close all connections and remove the socket file.
+    # Items already forwarded are still published by the GripPubControl;
+    # call its wait_all_sent method to wait for them.
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    # Start the sidecar and block until it is stopped.
+    def serve_forever(self):
+        self.start()
+        self._thread.join()
+
+    # An internal method run by the thread accepting connections.
+    def _accept_loop(self):
+        while not self._stopped:
+            try:
+                conn, addr = self._sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                if self._stopped:
+                    break
+                raise
+            conn.settimeout(None)
+            with self._lock:
+                self._conns.add(conn)
+            thread = threading.Thread(target=self._read_loop, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    # An internal method run by a thread for each connection, forwarding
+    # the items received on it until it is closed.
+    def _read_loop(self, conn):
+        try:
+            while True:
+                header = _recv_exact(conn, _HEADER.size)
+                if header is None:
+                    break
+                size = _HEADER.unpack(header)[0]
+                if size > self.max_frame:
+                    break
+                data = _recv_exact(conn, size)
+                if data is None:
+                    break
+                try:
+                    self._forward(json.loads(data.decode("utf-8")))
+                except Exception:
+                    with self._lock:
+                        self.failed += 1
+        except socket.error:
+            pass
+        finally:
+            with self._lock:
+                self._conns.discard(conn)
+            conn.close()
+
+    # An internal method for forwarding a received message, unless its item
+    # was already forwarded. The item's ID is only remembered once it has
+    # been published, so that a retry of an item that failed is forwarded
+    # again; while it is being published, duplicates are dropped.
+    def _forward(self, message):
+        channel = message["channel"]
+        export = message["item"]
+        item = _item_from_export(export)
+        key = None
+        id = export.get("id")
+        if id is not None and self.dedupe_size > 0:
+            key = (channel, id)
+            with self._lock:
+                if key in self._seen:
+                    self.deduped += 1
+                    return
+                self._seen[key] = True
+                if len(self._seen) > self.dedupe_size:
+                    self._seen.popitem(last=False)
+        callback = None
+        if key is not None:
+
+            def callback(result, message):
+                if not result:
+                    self._forget(key)
+
+        lane = message.get("lane")
+        try:
+            if lane is not None:
+                self.pub.publish(channel, item, callback=callback, lane=lane)
+            else:
+                self.pub.publish(channel, item, callback=callback)
+        except Exception:
+            if key is not None:
+                self._forget(key)
+            raise
+        with self._lock:
+            self.forwarded += 1
+
+    # An internal method for forgetting the specified (channel, ID) key of
+    # an item that failed to publish.
+    def _forget(self, key):
+        with self._lock:
+            self._seen.pop(key, None)
+
+
+# The SidecarPubControl class is used by worker processes to publish
+# through a PublishSidecar listening on the specified Unix socket path. It
+# provides the publish methods of GripPubControl; items are exported in
+# the worker and written to the socket, and callbacks are called once an
+# item has been handed to the sidecar. The connection is opened on first
+# use, reopened once if writing fails, and reopened in a child process
+# after a fork.
+class SidecarPubControl(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sock = None
+        self._pid = None
+
+    # Send the specified item for the specified channel to the sidecar. The
+    # blocking parameter is accepted for compatibility; writing to the
+    # socket is always synchronous. If lane is specified, the sidecar
+    # publishes the item in that lane.
+    def publish(self, channel, item, blocking=False, callback=None, lane=None):
+        message = {"channel": channel, "item": item.export()}
+        if lane is not None:
+            message["lane"] = lane
+        data = json_dumps_bytes(message)
+        try:
+            self._send(_HEADER.pack(len(data)) + data)
+        except Exception as e:
+            if callback:
+                callback(False, "failed to publish to sidecar: " + str(e))
+                return
+            raise ValueError("failed to publish to sidecar: " + str(e))
+        if callback:
+            callback(True, "")
+
+    # Publish an HTTP response format message, as with
+    # GripPubControl.publish_http_response.
+    def publish_http_response(
+        self,
+        channel,
+        http_response,
+        id=None,
+        prev_id=None,
+        blocking=False,
+        callback=None,
+        lane=None,
+        meta=None,
+    ):
+        if _is_basestring_instance(http_response):
+            http_response = HttpResponseFormat(body=http_response)
+        item = Item(http_response, id, prev_id, meta or {})
+        self.publish(channel, item, blocking, callback, lane)
+
+    # Publish an HTTP stream format message, as with
+    # GripPubControl.publish_http_stream.
+    def publish_http_stream(
+        self,
+        channel,
+        http_stream,
+        id=None,
+        prev_id=None,
+        blocking=False,
+        callback=None,
+        lane=None,
+        meta=None,
+    ):
+        if _is_basestring_instance(http_stream):
+            http_stream = HttpStreamFormat(http_stream)
+        item = Item(http_stream, id, prev_id, meta or {})
+        self.publish(channel, item, blocking, callback, lane)
+
+    # Close the connection to the sidecar.
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    # An internal method for writing a frame to the sidecar, connecting
+    # first if needed and retrying once on a new connection.
+    def _send(self, frame):
+        with self._lock:
+            if self._pid != os.getpid():
+                # inherited from the parent process
+                self._sock = None
+            for attempt in (0, 1):
+                if self._sock is None:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    try:
+                        sock.connect(self.path)
+                    except socket.error:
+                        sock.close()
+                        raise
+                    self._sock = sock
+                    self._pid = os.getpid()
+                try:
+                    self._sock.sendall(frame)
+                    return
+                except socket.error:
+                    self._sock.close()
+                    self._sock = None
+                    if attempt == 1:
+                        raise
+
+
+# An internal format carrying the exported form of a format received by
+# the sidecar.
+class _ExportedFormat(Format):
+    def __init__(self, export):
+        self._export = export
+
+    def name(self):
+        return self.format_name
+
+    def export(self, *args, **kwargs):
+        return self._export
+
+
+# Subclasses of _ExportedFormat for the GRIP format names a received item
+# may contain, since an Item may only contain one format of each class.
+_format_classes = dict(
+    (
+        name,
+        type(str("_ExportedFormat_" + name), (_ExportedFormat,), {"format_name": name}),
+    )
+    for name in ("http-response", "http-stream", "ws-message")
+)
+
+
+# An internal method for creating an Item from its exported form. A
+# ValueError is raised if it contains an unknown format.
+def _item_from_export(export):
+    export = dict(export)
+    id = export.pop("id", None)
+    prev_id = export.pop("prev-id", None)
+    meta = export.pop("meta", {})
+    formats = list()
+    for name, value in export.items():
+        cls = _format_classes.get(name)
+        if cls is None:
+            raise ValueError("unknown format: " + str(name))
+        formats.append(cls(value))
+    return Item(formats, id, prev_id, meta)
+
+
+# An internal method for reading exactly the specified number of bytes from
+# a socket. Returns None if the connection was closed first.
+def _recv_exact(sock, size):
+    chunks = list()
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,92 @@
+#    responsetemplate.py
+#    ~~~~~~~~~
+#    This module implements the ResponseTemplate class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+from base64 import b64encode
+from .gripcontrol import _bin_or_text
+from .jsonbackend import json_dumps
+from .headerset import HeaderSet
+from .response import Response
+from .httpresponseformat import HttpResponseFormat, _export_body
+
+
+# The ResponseTemplate class is a factory for Response and
+# HttpResponseFormat instances that share the same code, reason and
+# headers and only differ in their body. The headers are interned as a
+# HeaderSet, and the exported fields and the JSON fragment for the code,
+# reason and headers are computed once when the template is created, so
+# that exporting a format or creating hold instructions only has to encode
+# the body. The code, reason and headers of the created instances must
+# therefore be left unchanged.
+class ResponseTemplate(object):
+
+    # Initialize with an HTTP response code, reason and headers.
+    def __init__(self, code=None, reason=None, headers=None):
+        self.code = code
+        self.reason = reason
+        self.headers = HeaderSet.intern(headers) if headers else None
+        fields = dict()
+        if code is not None:
+            fields["code"] = code
+        if reason:
+            fields["reason"] = reason
+        if self.headers:
+            fields["headers"] = self.headers
+        self._fields = fields
+        self._json_prefix = json_dumps(fields)[:-1]
+
+    # Create an HttpResponseFormat with the template's code, reason and
+    # headers and the specified body and content filters.
+    def format(self, body=None, content_filters=None):
+        return _TemplateHttpResponseFormat(self, body, content_filters)
+
+    # Create a Response with the template's code, reason and headers and
+    # the specified body, for use with create_hold and related methods.
+    def response(self, body=None):
+        return _TemplateResponse(self, body)
+
+
+# The HttpResponseFormat created by ResponseTemplate.format. Exporting
+# copies the precomputed fields and only encodes the body.
+class _TemplateHttpResponseFormat(HttpResponseFormat):
+    def __init__(self, template, body, content_filters):
+        super(_TemplateHttpResponseFormat, self).__init__(
+            template.code, template.reason, template.headers, body, content_filters
+        )
+        self._fields = template._fields
+
+    def export(self, raw_binary=False):
+        if self.content_filters is not None:
+            out = {"content-filters": self.content_filters}
+            out.update(self._fields)
+        else:
+            out = dict(self._fields)
+        _export_body(out, self.body, raw_binary)
+        return out
+
+
+# The Response created by ResponseTemplate.response. create_hold uses the
+# precomputed JSON fragment to serialize it.
+class _TemplateResponse(Response):
+    def __init__(self, template, body):
+        super(_TemplateResponse, self).__init__(
+            template.code, template.reason, template.headers, body
+        )
+        self._json_prefix = template._json_prefix
+
+    # Return the JSON text of the response as used in hold instructions.
+    def _to_json(self):
+        if self.body:
+            is_text, val = _bin_or_text(self.body)
+            if is_text:
+                body = '"body": ' + json_dumps(val)
+            else:
+                body = '"body-bin": ' + json_dumps(b64encode(val).decode("utf-8"))
+        else:
+            return self._json_prefix + "}"
+        if self._json_prefix == "{":
+            return "{" + body + "}"
+        return self._json_prefix + ", " + body + "}"
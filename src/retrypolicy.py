@@ -0,0 +1,39 @@
+#    retrypolicy.py
+#    ~~~~~~~~~
+#    This module implements the RetryPolicy class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import random
+
+
+# The RetryPolicy class describes how failed publishes to a GRIP control
+# endpoint are retried. Delays grow exponentially with each attempt and are
+# capped at max_delay. When jitter is enabled the delay is chosen uniformly
+# between zero and the computed value ("full jitter") so that many clients
+# retrying against the same overloaded endpoint spread out instead of
+# retrying in lockstep.
+class RetryPolicy(object):
+
+    # Initialize with the maximum number of retries (not counting the first
+    # attempt), the base delay and maximum delay in seconds, the growth
+    # multiplier applied per attempt, and whether to apply jitter.
+    def __init__(
+        self, max_retries=3, base_delay=0.1, max_delay=10.0, multiplier=2.0, jitter=True
+    ):
+        if max_retries < 0:
+            raise ValueError("max_retries must not be negative")
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    # Return the number of seconds to wait before the retry following the
+    # specified zero-based attempt number.
+    def get_delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (self.multiplier**attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
@@ -0,0 +1,336 @@
+#    streamcoalescer.py
+#    ~~~~~~~~~
+#    This module implements the StreamCoalescer class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import math
+import threading
+import time
+from collections import deque
+from pubcontrol import Item
+from .httpstreamformat import HttpStreamFormat
+from .gripcontrol import _is_unicode_instance
+
+# The clock used for windows and token buckets.
+_clock = getattr(time, "monotonic", time.time)
+
+
+# The StreamCoalescer class combines HTTP stream messages published to the
+# same channel into fewer, larger messages. Content published to a channel
+# is collected for up to window seconds, or until max_size characters or
+# bytes have been collected, and then published as a single HttpStreamFormat
+# item whose ID is that of the last message and whose previous ID is that
+# of the first, so that the ID chain stays intact. Messages with different
+# content filters or meta are never combined, and a message closing the
+# stream is published on its own after the content before it. If rate is
+# set, each channel may publish at most rate items per second with bursts
+# of up to burst items (a token bucket); while a channel is limited its
+# content keeps collecting, and once max_backlog items are waiting for its
+# rate limit further messages for it are rejected, their callbacks being
+# called with a failure result. Items are published from a single
+# background thread, in the order their content was added, and the
+# callbacks of the combined messages are all called with the result. An
+# instance should only be used by a single GripPubControl.
+class StreamCoalescer(object):
+
+    # Initialize with the collection window in seconds, the maximum size of
+    # a combined message, and optionally the per-channel rate in items per
+    # second, burst size (which defaults to the rate, rounded up) and
+    # maximum number of items per channel waiting for the rate limit.
+    def __init__(
+        self, window=0.05, max_size=65536, rate=None, burst=None, max_backlog=64
+    ):
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be positive")
+        if max_backlog < 1:
+            raise ValueError("max_backlog must be positive")
+        self.window = window
+        self.max_size = max_size
+        self.rate = rate
+        self.max_backlog = max_backlog
+        if burst is None:
+            burst = max(1, int(math.ceil(rate))) if rate is not None else 1
+        self.burst = burst
+        self._cond = threading.Condition()
+        self._channels = dict()
+        self._thread = None
+        self._draining = 0
+        self._busy = False
+
+    # Add an HTTP stream message for the specified channel. Items are
+    # published through the publish method of the specified target, in the
+    # specified lane if any, with the specified meta; messages for
+    # different lanes or with different meta are not combined.
+    # If blocking is set to True, the channel's collected content is
+    # published right away (subject to its rate) and this method waits for
+    # the result, raising an error if publishing failed or the message was
+    # rejected because the channel's backlog is full.
+    def add(
+        self,
+        target,
+        channel,
+        http_stream,
+        id=None,
+        prev_id=None,
+        blocking=False,
+        callback=None,
+        lane=None,
+        meta=None,
+    ):
+        meta = meta or {}
+        if blocking:
+            waiter = _Waiter()
+            callback = waiter.callback
+        self._cond.acquire()
+        try:
+            state = self._channels.get(channel)
+            if state is None:
+                state = _ChannelState(target, self.rate, self.burst)
+                self._channels[channel] = state
+            rejected = state.bucket is not None and len(state.ready) >= self.max_backlog
+            if not rejected:
+                if state.formats and (
+                    http_stream.close
+                    or http_stream.content_filters != state.formats[0].content_filters
+                    or lane != state.lane
+                    or meta != state.meta
+                ):
+                    state.seal()
+                if http_stream.close:
+                    state.ready.append(
+                        (Item(http_stream, id, prev_id, meta), [callback], lane)
+                    )
+                else:
+                    if not state.formats:
+                        state.deadline = _clock() + self.window
+                        state.prev_id = prev_id
+                        state.lane = lane
+                        state.meta = meta
+                    state.formats.append(http_stream)
+                    state.callbacks.append(callback)
+                    state.id = id
+                    state.size += len(http_stream.content)
+                    if blocking or state.size >= self.max_size:
+                        state.seal()
+                self._ensure_thread()
+                self._cond.notify()
+        finally:
+            self._cond.release()
+        if rejected and callback:
+            callback(False, "rate limit backlog full for channel " + channel)
+        if blocking:
+            waiter.wait()
+
+    # Publish all collected content right away, ignoring rate limits, and
+    # wait until it has been handed to the target.
+    def flush(self):
+        self._cond.acquire()
+        try:
+            self._draining += 1
+            self._cond.notify_all()
+            while self._busy or any(
+                s.formats or s.ready for s in self._channels.values()
+            ):
+                self._cond.wait()
+        finally:
+            self._draining -= 1
+            self._cond.release()
+
+    # An internal method for reinitializing the coalescer in a forked child
+    # process. Content collected in the parent is left for the parent to
+    # publish.
+    def _after_fork(self):
+        self._cond = threading.Condition()
+        self._channels = dict()
+        self._thread = None
+        self._draining = 0
+        self._busy = False
+
+    # An internal method for starting the background thread if it is not
+    # running. Must be called with the lock held.
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    # An internal method run by the background thread. It publishes the
+    # items that are due and exits once nothing is left to publish.
+    def _run(self):
+        self._cond.acquire()
+        try:
+            while True:
+                items, timeout = self._collect(_clock())
+                if items:
+                    self._busy = True
+                    self._cond.release()
+                    try:
+                        for item in items:
+                            _publish(*item)
+                    finally:
+                        self._cond.acquire()
+                        self._busy = False
+                    continue
+                self._cond.notify_all()
+                if timeout is None:
+                    self._thread = None
+                    return
+                self._cond.wait(timeout)
+        finally:
+            self._cond.release()
+
+    # An internal method for taking the items that are due from all
+    # channels. Returns the list of (target, channel, item, callbacks, lane)
+    # tuples to publish and the number of seconds until the next item is
+    # due, or None if nothing is left. Must be called with the lock held.
+    def _collect(self, now):
+        draining = self._draining > 0
+        items = list()
+        timeout = None
+        for channel in list(self._channels):
+            state = self._channels[channel]
+            if state.formats:
+                if draining or (now >= state.deadline and not state.ready):
+                    state.seal()
+                elif not state.ready:
+                    timeout = _min(timeout, state.deadline - now)
+            while state.ready:
+                if state.bucket is not None and not draining:
+                    wait = state.bucket.take(now)
+                    if wait > 0:
+                        timeout = _min(timeout, wait)
+                        break
+                item, callbacks, lane = state.ready.popleft()
+                items.append((state.target, channel, item, callbacks, lane))
+            if not state.formats and not state.ready:
+                if state.bucket is None or state.bucket.is_full(now):
+                    del self._channels[channel]
+        return items, timeout
+
+
+# An internal class holding the collected content and the published items
+# waiting for their rate limit of a channel.
+class _ChannelState(object):
+    def __init__(self, target, rate, burst):
+        self.target = target
+        self.bucket = _TokenBucket(rate, burst) if rate is not None else None
+        self.ready = deque()
+        self.formats = list()
+        self.callbacks = list()
+        self.size = 0
+        self.id = None
+        self.prev_id = None
+        self.deadline = None
+        self.lane = None
+        self.meta = None
+
+    # Combine the collected content into an item that is ready to publish.
+    def seal(self):
+        if not self.formats:
+            return
+        if len(self.formats) == 1:
+            http_stream = self.formats[0]
+        else:
+            http_stream = HttpStreamFormat(
+                _join([f.content for f in self.formats]),
+                content_filters=self.formats[0].content_filters,
+            )
+        self.ready.append(
+            (
+                Item(http_stream, self.id, self.prev_id, self.meta),
+                self.callbacks,
+                self.lane,
+            )
+        )
+        self.formats = list()
+        self.callbacks = list()
+        self.size = 0
+        self.id = None
+        self.prev_id = None
+        self.deadline = None
+        self.lane = None
+        self.meta = None
+
+
+# An internal class implementing a token bucket that refills at rate tokens
+# per second up to burst tokens.
+class _TokenBucket(object):
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now if now is not None else _clock()
+
+    # Take a token. Returns 0 if one was taken, otherwise the number of
+    # seconds until one is available.
+    def take(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    # Return whether the bucket has refilled completely.
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+
+# An internal class for waiting for the result of a blocking add.
+class _Waiter(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+    def callback(self, result, message):
+        self.result = (result, message)
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        if not self.result[0]:
+            raise ValueError("failed to publish: " + str(self.result[1]))
+
+
+# An internal method for publishing an item through the specified target
+# and calling the specified callbacks with the result.
+def _publish(target, channel, item, callbacks, lane):
+    def callback(result, message):
+        for c in callbacks:
+            if c:
+                c(result, message)
+
+    try:
+        if lane is not None:
+            target.publish(channel, item, blocking=False, callback=callback, lane=lane)
+        else:
+            target.publish(channel, item, blocking=False, callback=callback)
+    except Exception as e:
+        callback(False, str(e))
+        return
+    if not target.clients:
+        # nothing will call back without clients
+        callback(True, "")
+
+
+# An internal method for concatenating stream content. Text is joined as
+# text unless some of the content is binary.
+def _join(contents):
+    if all(_is_unicode_instance(c) for c in contents):
+        return "".join(contents)
+    return b"".join(
+        c.encode("utf-8") if _is_unicode_instance(c) else c for c in contents
+    )
+
+
+def _min(a, b):
+    return b if a is None else min(a, b)
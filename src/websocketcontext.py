@@ -1,11 +1,49 @@
 from copy import deepcopy
 from struct import unpack
-from .gripcontrol import is_python3, websocket_control_message
-from .websocketevent import WebSocketEvent
+from .gripcontrol import (
+    is_python3,
+    websocket_control_message,
+    encode_websocket_events,
+    _is_basestring_instance,
+    _is_unicode_instance,
+)
+from .websocketevent import (
+    WebSocketEvent,
+    OPEN,
+    TEXT,
+    BINARY,
+    PING,
+    PONG,
+    CLOSE,
+    DISCONNECT,
+)
+from .websocketeventbatch import WebSocketEventBatch
+
+# Incoming event types returned by recv, and those handled automatically.
+_RECV_TYPES = frozenset((TEXT, BINARY, CLOSE, DISCONNECT))
+_PING_PONG_TYPES = frozenset((PING, PONG))
+
+# The encoded name of each outgoing event type.
+_WIRE_NAMES = dict((t, t.encode("utf-8")) for t in (TEXT, BINARY, PONG))
 
 
 class WebSocketContext(object):
-    def __init__(self, id, meta, in_events, grip_prefix=""):
+    # When buffered is set to True, outgoing events are written in
+    # WebSocket-over-HTTP wire format straight into the out_buffer
+    # bytearray instead of being appended to out_events as WebSocketEvent
+    # instances, so that the response body needs no second encoding pass.
+    def __init__(self, id, meta, in_events, grip_prefix="", buffered=False):
+        self.out_events = []
+        self.out_buffer = bytearray() if buffered else None
+        self.meta = {}
+        self.reset(id, meta, in_events, grip_prefix)
+
+    # Reinitialize the context for a new request so that the instance and
+    # its buffers can be reused. No state from the previous request is
+    # kept, but the out_events list and meta dict are cleared and refilled
+    # rather than replaced, so references to them must not be held across
+    # a reset.
+    def reset(self, id, meta, in_events, grip_prefix=""):
         self.id = id
         self.in_events = in_events
         self.read_index = 0
@@ -13,13 +51,19 @@ class WebSocketContext(object):
         self.close_code = None
         self.closed = False
         self.out_close_code = None
-        self.out_events = []
+        del self.out_events[:]
+        if self.out_buffer is not None:
+            del self.out_buffer[:]
         self.orig_meta = meta
-        self.meta = deepcopy(meta)
+        self.meta.clear()
+        for name, value in meta.items():
+            if not (_is_basestring_instance(value) or isinstance(value, bytes)):
+                value = deepcopy(value)
+            self.meta[name] = value
         self.grip_prefix = grip_prefix
 
     def is_opening(self):
-        return self.in_events and self.in_events[0].type == "OPEN"
+        return len(self.in_events) > 0 and self._in_type(0) == OPEN
 
     def accept(self):
         self.accepted = True
@@ -35,7 +79,7 @@ class WebSocketContext(object):
         self.handle_upcoming_pings_and_pongs()
 
         for n in range(self.read_index, len(self.in_events)):
-            if self.in_events[n].type in ("TEXT", "BINARY", "CLOSE", "DISCONNECT"):
+            if self._in_type(n) in _RECV_TYPES:
                 return True
         return False
 
@@ -44,18 +88,13 @@ class WebSocketContext(object):
 
         e = None
         while e is None and self.read_index < len(self.in_events):
-            if self.in_events[self.read_index].type in (
-                "TEXT",
-                "BINARY",
-                "CLOSE",
-                "DISCONNECT",
-            ):
+            if self._in_type(self.read_index) in _RECV_TYPES:
                 e = self.in_events[self.read_index]
             self.read_index += 1
         if e is None:
             raise IndexError("read from empty buffer")
 
-        if e.type == "TEXT":
+        if e.type == TEXT:
             if e.content:
                 return e.content.decode("utf-8")
             else:
@@ -63,7 +102,7 @@ class WebSocketContext(object):
                     return ""
                 else:
                     return ""
-        elif e.type == "BINARY":
+        elif e.type == BINARY:
             if e.content:
                 return e.content
             else:
@@ -71,7 +110,7 @@ class WebSocketContext(object):
                     return b""
                 else:
                     return ""
-        elif e.type == "CLOSE":
+        elif e.type == CLOSE:
             if e.content and len(e.content) == 2:
                 self.close_code = unpack(">H", e.content)[0]
             return None
@@ -79,63 +118,84 @@ class WebSocketContext(object):
             raise IOError("client disconnected unexpectedly")
 
     def send(self, message):
-        if is_python3:
-            if isinstance(message, str):
-                message = message.encode("utf-8")
-            content = b"m:" + message
-        else:
-            if isinstance(message, unicode):
-                message = message.encode("utf-8")
-            content = "m:" + message
-        self.out_events.append(WebSocketEvent("TEXT", content))
+        self._send(TEXT, b"m:", message)
 
     def send_binary(self, message):
-        if is_python3:
-            if isinstance(message, str):
-                message = message.encode("utf-8")
-            content = b"m:" + message
-        else:
-            if isinstance(message, unicode):
-                message = message.encode("utf-8")
-            content = "m:" + message
-        self.out_events.append(WebSocketEvent("BINARY", content))
+        self._send(BINARY, b"m:", message)
 
     def send_control(self, message):
-        if is_python3:
-            if isinstance(message, str):
-                message = message.encode("utf-8")
-            content = b"c:" + message
-        else:
-            if isinstance(message, unicode):
-                message = message.encode("utf-8")
-            content = "c:" + message
-        self.out_events.append(WebSocketEvent("TEXT", content))
+        self._send(TEXT, b"c:", message)
 
     def subscribe(self, channel):
         self.send_control(
             websocket_control_message(
-                "subscribe", {"channel": self.grip_prefix + channel}
+                "subscribe", {"channel": self.grip_prefix + channel}, as_bytes=True
             )
         )
 
     def unsubscribe(self, channel):
         self.send_control(
             websocket_control_message(
-                "unsubscribe", {"channel": self.grip_prefix + channel}
+                "unsubscribe",
+                {"channel": self.grip_prefix + channel},
+                as_bytes=True,
             )
         )
 
     def detach(self):
-        self.send_control(websocket_control_message("detach"))
+        self.send_control(websocket_control_message("detach", as_bytes=True))
 
     def handle_upcoming_pings_and_pongs(self):
-        while self.read_index < len(self.in_events) and self.in_events[
-            self.read_index
-        ].type in ("PING", "PONG"):
+        while (
+            self.read_index < len(self.in_events)
+            and self._in_type(self.read_index) in _PING_PONG_TYPES
+        ):
             event = self.in_events[self.read_index]
             self.read_index += 1
 
-            if event.type == "PING":
-                self.out_events.append(
-                    WebSocketEvent(type="PONG", content=event.content)
-                )
+            if event.type == PING:
+                if self.out_buffer is not None:
+                    _write_event(self.out_buffer, PONG, b"", event.content)
+                else:
+                    self.out_events.append(
+                        WebSocketEvent(type=PONG, content=event.content)
+                    )
+
+    # Return the outgoing events encoded in WebSocket-over-HTTP format. In
+    # buffered mode this is a copy of the out_buffer.
+    def encode_out_events(self):
+        if self.out_buffer is not None:
+            return bytes(self.out_buffer)
+        return encode_websocket_events(self.out_events)
+
+    # An internal method for sending a message with the specified event
+    # type and content prefix.
+    def _send(self, etype, prefix, message):
+        if _is_unicode_instance(message):
+            message = message.encode("utf-8")
+        if self.out_buffer is not None:
+            _write_event(self.out_buffer, etype, prefix, message)
+        else:
+            self.out_events.append(WebSocketEvent(etype, prefix + message))
+
+    # An internal method for getting the type of the incoming event at the
+    # specified index. Types are read straight from the columns when the
+    # incoming events are a WebSocketEventBatch.
+    def _in_type(self, index):
+        if isinstance(self.in_events, WebSocketEventBatch):
+            return self.in_events.get_type(index)
+        return self.in_events[index].type
+
+
+# An internal method for appending an event with the specified type and
+# content (after the specified prefix) to a buffer in WebSocket-over-HTTP
+# wire format. A content of None writes an event without content.
+def _write_event(buf, etype, prefix, content):
+    buf += _WIRE_NAMES[etype]
+    if content is None:
+        buf += b"\r\n"
+        return
+    buf += (" %x\r\n" % (len(prefix) + len(content))).encode("ascii")
+    buf += prefix
+    buf += content
+    buf += b"\r\n"
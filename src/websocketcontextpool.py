@@ -0,0 +1,70 @@
+#    websocketcontextpool.py
+#    ~~~~~~~~~
+#    This module implements the WebSocketContextPool class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import threading
+from contextlib import contextmanager
+from .websocketcontext import WebSocketContext
+
+
+# The WebSocketContextPool class keeps released WebSocketContext instances
+# for reuse so that endpoints handling many WebSocket-over-HTTP requests
+# do not allocate a new context, event list and meta dict per request. Each
+# thread has its own free list, so acquiring and releasing never contend
+# on a lock. Every acquired context is reset, and every released one has
+# its request data dropped, so no state leaks between requests. A context
+# must not be used after it has been released.
+class WebSocketContextPool(object):
+
+    # Initialize with the maximum number of free contexts kept per thread
+    # and whether new contexts use the buffered output mode.
+    def __init__(self, max_size=64, buffered=False):
+        self.max_size = max_size
+        self.buffered = buffered
+        self._local = threading.local()
+
+    # Return a context for a new request, reusing a released one if
+    # available. The parameters are the same as for WebSocketContext.
+    def acquire(self, id, meta, in_events, grip_prefix=""):
+        free = self._free()
+        if free:
+            ws = free.pop()
+            ws._pooled = False
+            ws.reset(id, meta, in_events, grip_prefix)
+            return ws
+        return WebSocketContext(id, meta, in_events, grip_prefix, self.buffered)
+
+    # Return the specified context to the calling thread's free list. A
+    # ValueError is raised if the context was already released.
+    def release(self, ws):
+        if getattr(ws, "_pooled", False):
+            raise ValueError("context already released")
+        ws.reset(None, {}, [])
+        ws._pooled = True
+        free = self._free()
+        if len(free) < self.max_size:
+            free.append(ws)
+
+    # A context manager acquiring a context and releasing it on exit.
+    @contextmanager
+    def context(self, id, meta, in_events, grip_prefix=""):
+        ws = self.acquire(id, meta, in_events, grip_prefix)
+        try:
+            yield ws
+        finally:
+            self.release(ws)
+
+    # The number of free contexts held for the calling thread.
+    def __len__(self):
+        return len(self._free())
+
+    # An internal method for getting the calling thread's free list.
+    def _free(self):
+        free = getattr(self._local, "free", None)
+        if free is None:
+            free = list()
+            self._local.free = free
+        return free
@@ -5,6 +5,63 @@
 #    :copyright: (c) 2015 by Fanout, Inc.
 #    :license: MIT, see LICENSE for more details.
 
+# The known GRIP WebSocket-over-HTTP event types. Decoding maps type names
+# to these interned constants with a single lookup so that type checks
+# compare identical objects; unknown types are carried through as decoded
+# strings. The position of each type in EVENT_TYPES is its code in a
+# WebSocketEventBatch.
+OPEN = "OPEN"
+TEXT = "TEXT"
+BINARY = "BINARY"
+PING = "PING"
+PONG = "PONG"
+CLOSE = "CLOSE"
+DISCONNECT = "DISCONNECT"
+
+EVENT_TYPES = (OPEN, TEXT, BINARY, PING, PONG, CLOSE, DISCONNECT)
+
+# Map of each encoded type name to its constant.
+_TYPES_BY_NAME = dict((t.encode("utf-8"), t) for t in EVENT_TYPES)
+
+# The digits allowed in an event's content length.
+_HEX_DIGITS = "0123456789abcdefABCDEF"
+_HEX_DIGITS_BYTES = _HEX_DIGITS.encode("ascii")
+
+
+# Return the event type for the specified encoded type name: one of the
+# constants above for known types, otherwise the decoded name.
+def decode_event_type(name):
+    etype = _TYPES_BY_NAME.get(name)
+    if etype is None:
+        etype = name.decode("utf-8")
+    return etype
+
+
+# An internal method used when decoding for parsing the hexadecimal content
+# length of an event. Unlike int, only hex digits are accepted: signs,
+# whitespace, underscores and prefixes raise a ValueError.
+def _parse_event_length(s):
+    digits = _HEX_DIGITS_BYTES if isinstance(s, bytes) else _HEX_DIGITS
+    if not s or s.strip(digits):
+        raise ValueError("bad format")
+    return int(s, 16)
+
+
+# An internal method used when decoding for checking the payload of the
+# event whose content of the specified length starts at the specified
+# position in the body. A ValueError is raised if the length is negative or
+# exceeds max_payload or, in strict mode, if the payload is truncated or is
+# not followed by CRLF. The check happens before the payload is sliced.
+def _check_event_payload(body, start, length, max_payload, strict):
+    if length < 0:
+        raise ValueError("bad format")
+    if max_payload is not None and length > max_payload:
+        raise ValueError("event payload too large")
+    if strict and (
+        start + length + 2 > len(body) or not body.startswith(b"\r\n", start + length)
+    ):
+        raise ValueError("bad format")
+
 
 # The WebSocketEvent class represents WebSocket event information that is
 # used with the GRIP WebSocket-over-HTTP protocol. It includes information
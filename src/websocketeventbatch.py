@@ -0,0 +1,256 @@
+#    websocketeventbatch.py
+#    ~~~~~~~~~
+#    This module implements the WebSocketEventBatch class.
+#    :authors: Justin Karneges, Konstantin Bokarius.
+#    :copyright: (c) 2015 by Fanout, Inc.
+#    :license: MIT, see LICENSE for more details.
+
+import sys
+from array import array
+from .websocketevent import (
+    WebSocketEvent,
+    EVENT_TYPES,
+    _TYPES_BY_NAME,
+    _check_event_payload,
+    _parse_event_length,
+)
+
+# The typecode used for the offset and length columns. Python 2 has no 'Q'
+# typecode.
+_SPAN_TYPECODE = "Q" if sys.version_info >= (3, 3) else "L"
+
+# The length stored for events that have no content.
+NO_CONTENT = (1 << (8 * array(_SPAN_TYPECODE).itemsize)) - 1
+
+
+# The WebSocketEventBatch class holds the events decoded from any number of
+# WebSocket-over-HTTP bodies in columnar form instead of as one
+# WebSocketEvent instance per event: an array of type codes, an array of
+# (offset, length) pairs and a single payload buffer that the offsets point
+# into. The codes index the type_names list, which starts with the known
+# GRIP event types (EVENT_TYPES) and is extended with any other types
+# encountered. The bounds array holds the index of the first event of each
+# body followed by the total number of events, so that the events of body n
+# are in the range bounds[n] to bounds[n + 1]. Indexing and iterating
+# produce WebSocketEventView instances rather than copies, and since the
+# columns are arrays and a bytes buffer a batch pickles compactly, making
+# it cheap to pass between processes. WebSocketContext and
+# encode_websocket_events accept a batch in place of a list of events.
+class WebSocketEventBatch(object):
+
+    # Initialize an empty batch, or one made of the specified columns.
+    def __init__(
+        self, types=None, spans=None, payload=b"", bounds=None, type_names=None
+    ):
+        self.types = types if types is not None else array("B")
+        self.spans = spans if spans is not None else array(_SPAN_TYPECODE)
+        self.payload = payload
+        self.bounds = bounds if bounds is not None else array(_SPAN_TYPECODE, [0])
+        self.type_names = type_names if type_names is not None else list(EVENT_TYPES)
+
+    # The total number of events in the batch.
+    def __len__(self):
+        return len(self.types)
+
+    # The number of bodies the batch was decoded from.
+    @property
+    def body_count(self):
+        return len(self.bounds) - 1
+
+    # Return the type of the event at the specified index.
+    def get_type(self, index):
+        return self.type_names[self.types[index]]
+
+    # Return the content of the event at the specified index as bytes, or
+    # None if the event has no content.
+    def get_content(self, index):
+        length = self.spans[2 * index + 1]
+        if length == NO_CONTENT:
+            return None
+        offset = self.spans[2 * index]
+        return self.payload[offset : offset + length]
+
+    # Return a view of the event at the specified index, or a list of views
+    # for a slice. Negative indexes count from the end.
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [
+                WebSocketEventView(self, n) for n in range(*index.indices(len(self)))
+            ]
+        if index < 0:
+            index += len(self.types)
+        if index < 0 or index >= len(self.types):
+            raise IndexError("event index out of range")
+        return WebSocketEventView(self, index)
+
+    # Iterate over views of all events in the batch.
+    def __iter__(self):
+        for n in range(len(self.types)):
+            yield WebSocketEventView(self, n)
+
+    # Return a batch holding only the events of the specified body. The
+    # payload buffer is shared with this batch rather than copied.
+    def body(self, index):
+        first = self.bounds[index]
+        last = self.bounds[index + 1]
+        return WebSocketEventBatch(
+            self.types[first:last],
+            self.spans[2 * first : 2 * last],
+            self.payload,
+            array(self.bounds.typecode, [0, last - first]),
+            self.type_names,
+        )
+
+    # Create a batch holding the specified WebSocketEvent instances (or
+    # views) as a single body. Text content is encoded as UTF-8.
+    @classmethod
+    def from_events(cls, events):
+        batch = cls()
+        parts = list()
+        offset = 0
+        for e in events:
+            batch.types.append(batch._type_code(e.type))
+            content = e.content
+            if content is None:
+                batch.spans.append(0)
+                batch.spans.append(NO_CONTENT)
+                continue
+            if not isinstance(content, bytes):
+                content = content.encode("utf-8")
+            batch.spans.append(offset)
+            batch.spans.append(len(content))
+            parts.append(content)
+            offset += len(content)
+        batch.payload = b"".join(parts)
+        batch.bounds.append(len(batch.types))
+        return batch
+
+    # Encode the events of the batch into a single WebSocket-over-HTTP body
+    # directly from the columns.
+    def encode(self):
+        names = [name.encode("utf-8") for name in self.type_names]
+        payload = self.payload
+        spans = self.spans
+        parts = list()
+        for n, code in enumerate(self.types):
+            length = spans[2 * n + 1]
+            if length == NO_CONTENT:
+                parts.append(names[code] + b"\r\n")
+            else:
+                offset = spans[2 * n]
+                parts.append(names[code] + (" %x\r\n" % length).encode("utf-8"))
+                parts.append(payload[offset : offset + length])
+                parts.append(b"\r\n")
+        return b"".join(parts)
+
+    # Create WebSocketEvent instances for the events of the specified body,
+    # or for all events if no body is specified.
+    def to_events(self, body=None):
+        if body is None:
+            indexes = range(len(self.types))
+        else:
+            indexes = range(self.bounds[body], self.bounds[body + 1])
+        return [WebSocketEvent(self.get_type(n), self.get_content(n)) for n in indexes]
+
+    # Append the columns of another batch, whose offsets are relative to
+    # the specified position in this batch's payload. The payload itself is
+    # not copied; the caller is responsible for it.
+    def _extend(self, other, base):
+        remap = None
+        if other.type_names != self.type_names[: len(other.type_names)]:
+            remap = array("B", [self._type_code(t) for t in other.type_names])
+        if remap is None:
+            self.types.extend(other.types)
+        else:
+            self.types.extend(array("B", [remap[c] for c in other.types]))
+        spans = other.spans
+        if base:
+            spans = array(spans.typecode, spans)
+            for n in range(0, len(spans), 2):
+                if spans[n + 1] != NO_CONTENT:
+                    spans[n] += base
+        self.spans.extend(spans)
+        count = self.bounds[-1]
+        self.bounds.extend(b + count for b in other.bounds[1:])
+
+    # An internal method for getting the code of the specified type name,
+    # adding it to the type names if needed.
+    def _type_code(self, name):
+        try:
+            return self.type_names.index(name)
+        except ValueError:
+            if len(self.type_names) >= 256:
+                raise ValueError("too many event types")
+            self.type_names.append(name)
+            return len(self.type_names) - 1
+
+
+# The WebSocketEventView class is a lightweight read-only view of a single
+# event in a WebSocketEventBatch. It offers the same 'type' and 'content'
+# attributes as WebSocketEvent; the content is sliced from the shared
+# payload buffer when accessed.
+class WebSocketEventView(object):
+    __slots__ = ("batch", "index")
+
+    # Initialize with the batch and the index of the event.
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def type(self):
+        return self.batch.get_type(self.index)
+
+    @property
+    def content(self):
+        return self.batch.get_content(self.index)
+
+
+# An internal method for scanning a single WebSocket-over-HTTP body and
+# appending its events to the columns of the specified batch. Offsets are
+# relative to the body's position (base) in the batch payload. The
+# type_codes dict maps encoded type names to codes and is updated for
+# unknown types. A ValueError is raised if the format is invalid or if
+# the strict mode, max_events or max_payload checks of
+# decode_websocket_events fail.
+def _scan_body(
+    batch, body, base, type_codes, strict=False, max_events=None, max_payload=None
+):
+    types = batch.types
+    spans = batch.spans
+    start = 0
+    end = len(body)
+    count = 0
+    while start < end:
+        if max_events is not None and count >= max_events:
+            raise ValueError("too many events")
+        count += 1
+        at = body.find(b"\r\n", start)
+        if at == -1:
+            raise ValueError("bad format")
+        space = body.find(b" ", start, at)
+        if space != -1:
+            name = body[start:space]
+            length = _parse_event_length(body[space + 1 : at])
+            start = at + 2
+            _check_event_payload(body, start, length, max_payload, strict)
+            spans.append(base + start)
+            spans.append(min(length, max(end - start, 0)))
+            start += length + 2
+        else:
+            name = body[start:at]
+            start = at + 2
+            spans.append(0)
+            spans.append(NO_CONTENT)
+        code = type_codes.get(name)
+        if code is None:
+            code = batch._type_code(name.decode("utf-8"))
+            type_codes[name] = code
+        types.append(code)
+    batch.bounds.append(len(types))
+
+
+# An internal method for creating the dict mapping encoded type names to
+# codes used by _scan_body.
+def _initial_type_codes():
+    return dict((name, EVENT_TYPES.index(t)) for name, t in _TYPES_BY_NAME.items())
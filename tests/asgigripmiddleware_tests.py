@@ -0,0 +1,85 @@
+import sys
+import asyncio
+import unittest
+
+sys.path.append("../")
+from src.asgigripmiddleware import AsgiGripMiddleware
+from src.gripmiddleware import GRIP_CONTEXT_KEY
+from src.gripcontrol import decode_websocket_events
+
+
+def _call(app, headers, chunks=(b"",)):
+    scope = {
+        "type": "http",
+        "headers": [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers.items()
+        ],
+    }
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": n < len(chunks) - 1}
+        for n, chunk in enumerate(chunks)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+class TestAsgiGripMiddleware(unittest.TestCase):
+    def test_hold(self):
+        async def app(scope, receive, send):
+            scope[GRIP_CONTEXT_KEY].set_hold_stream("channel")
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"start\n"})
+
+        sent = _call(AsgiGripMiddleware(app), {})
+        self.assertEqual(
+            sent[0]["headers"],
+            [(b"grip-hold", b"stream"), (b"grip-channel", b"channel")],
+        )
+        self.assertEqual(sent[1]["body"], b"start\n")
+
+    def test_websocket(self):
+        async def app(scope, receive, send):
+            # the request body is still available to the application
+            first = await receive()
+            second = await receive()
+            self.assertEqual(first["body"] + second["body"], b"OPEN\r\n")
+            ws = scope[GRIP_CONTEXT_KEY].websocket
+            self.assertEqual(ws.id, "conn-1")
+            ws.accept()
+            ws.send("hi")
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        sent = _call(
+            AsgiGripMiddleware(app),
+            {"Content-Type": "application/websocket-events", "Connection-Id": "conn-1"},
+            (b"OPEN", b"\r\n"),
+        )
+        self.assertEqual(len(sent), 2)
+        headers = dict(sent[0]["headers"])
+        self.assertEqual(headers[b"content-type"], b"application/websocket-events")
+        self.assertEqual(headers[b"sec-websocket-extensions"], b"grip")
+        events = decode_websocket_events(sent[1]["body"])
+        self.assertEqual([e.type for e in events], ["OPEN", "TEXT"])
+
+    def test_non_http(self):
+        calls = []
+
+        async def app(scope, receive, send):
+            calls.append(scope)
+
+        asyncio.run(AsgiGripMiddleware(app)({"type": "lifespan"}, None, None))
+        self.assertEqual(calls, [{"type": "lifespan"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
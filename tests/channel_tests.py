@@ -14,6 +14,13 @@ class TestChannel(unittest.TestCase):
         channel = Channel("name", "prev-id")
         self.assertEqual(channel.name, "name")
         self.assertEqual(channel.prev_id, "prev-id")
+        self.assertEqual(channel.filters, [])
+
+        filters = ("skip-self",)
+        channel = Channel("name", filters=filters)
+        self.assertEqual(channel.filters, ["skip-self"])
+        channel.filters.append("require-sub")
+        self.assertEqual(filters, ("skip-self",))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.append("../")
+from src.channelsequencer import ChannelSequencer
+
+
+class TestChannelSequencer(unittest.TestCase):
+    def test_sequence(self):
+        seq = ChannelSequencer()
+        ns = seq._namespace
+        self.assertEqual(seq.sequence("a"), (ns + "1", None))
+        self.assertEqual(seq.sequence("a"), (ns + "2", ns + "1"))
+        self.assertEqual(seq.sequence("b"), (ns + "3", None))
+        self.assertEqual(seq.sequence("a"), (ns + "4", ns + "2"))
+        self.assertEqual(seq.last_id("a"), ns + "4")
+        self.assertEqual(seq.last_id("c"), None)
+        self.assertEqual(len(seq), 2)
+
+    def test_prefix(self):
+        seq = ChannelSequencer(prefix="w1-")
+        ns = "w1-" + seq._namespace
+        self.assertEqual(seq.sequence("a"), (ns + "1", None))
+        self.assertEqual(seq.sequence("a"), (ns + "2", ns + "1"))
+
+    def test_namespace(self):
+        # separately started processes must not share IDs
+        seqs = [ChannelSequencer() for n in range(2)]
+        ids = [seq.sequence("a")[0] for seq in seqs]
+        self.assertNotEqual(ids[0], ids[1])
+        for id in ids:
+            self.assertTrue(id.startswith("%d-" % os.getpid()))
+            self.assertTrue(id.endswith("-1"))
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    def test_fork(self):
+        seq = ChannelSequencer(prefix="p-")
+        ns = "p-" + seq._namespace
+        seq.sequence("a")
+        ids = []
+        for n in range(2):
+            r, w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(r)
+                seq._after_fork()
+                id, prev_id = seq.sequence("a")
+                os.write(w, ("%s %s" % (id, prev_id)).encode("utf-8"))
+                os._exit(0)
+            os.close(w)
+            ids.append(os.read(r, 1024).decode("utf-8").split(" "))
+            os.close(r)
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertNotEqual(ids[0][0], ids[1][0])
+        for id, prev_id in ids:
+            self.assertTrue(id.startswith("p-"))
+            self.assertFalse(id.startswith(ns))
+            self.assertEqual(prev_id, "None")
+        self.assertEqual(seq.sequence("a"), (ns + "2", ns + "1"))
+
+    def test_reset(self):
+        seq = ChannelSequencer()
+        seq.sequence("a")
+        seq.sequence("b")
+        seq.reset("a")
+        self.assertEqual(seq.last_id("a"), None)
+        self.assertEqual(seq.last_id("b"), seq._namespace + "2")
+        seq.reset()
+        self.assertEqual(len(seq), 0)
+        self.assertEqual(seq.sequence("b"), (seq._namespace + "3", None))
+
+    def test_eviction(self):
+        seq = ChannelSequencer(max_channels=2, stripes=1)
+        seq.sequence("a")
+        seq.sequence("b")
+        seq.sequence("a")
+        seq.sequence("c")
+        # 'b' was the least recently used channel
+        self.assertEqual(len(seq), 2)
+        self.assertEqual(seq.last_id("b"), None)
+        self.assertEqual(seq.last_id("a"), seq._namespace + "3")
+        with self.assertRaises(ValueError):
+            ChannelSequencer(stripes=0)
+
+    def test_threads(self):
+        seq = ChannelSequencer()
+        results = dict((n, []) for n in range(4))
+
+        def run(n):
+            for i in range(500):
+                results[n].append(seq.sequence("channel%d" % (i % 3)))
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        chains = {}
+        for n in results:
+            for id, prev_id in results[n]:
+                chains[prev_id] = chains.get(prev_id, 0) + 1
+        # every ID is used as a previous ID at most once and the chains
+        # start exactly once per channel
+        self.assertEqual(chains.pop(None), 3)
+        self.assertTrue(all(count == 1 for count in chains.values()))
+        self.assertEqual(len(chains), 2000 - 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
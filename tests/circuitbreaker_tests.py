@@ -0,0 +1,62 @@
+import sys
+import time
+import unittest
+
+sys.path.append("../")
+from src.circuitbreaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_initialize(self):
+        breaker = CircuitBreaker()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.failure_threshold, 5)
+        self.assertEqual(breaker.reset_timeout, 30.0)
+        with self.assertRaises(ValueError):
+            CircuitBreaker(failure_threshold=0)
+
+    def test_open_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow_request())
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        time.sleep(0.02)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.is_open())
+        self.assertTrue(breaker.allow_request())
+        # only a single probe is let through
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+    def test_half_open_failure(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.01)
+        for n in range(3):
+            breaker.record_failure()
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        breaker.reset()
+        self.assertEqual(breaker.state, CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
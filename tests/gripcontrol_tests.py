@@ -10,6 +10,7 @@ from base64 import b64encode, b64decode
 is_python3 = sys.version_info >= (3,)
 
 sys.path.append("../")
+from src.websocketevent import OPEN, TEXT, _check_event_payload
 from src.gripcontrol import (
     WebSocketEvent,
     Channel,
@@ -18,9 +19,12 @@ from src.gripcontrol import (
     create_hold,
     validate_sig,
     create_grip_channel_header,
+    create_grip_keep_alive_header,
     create_hold_response,
     create_hold_stream,
+    create_hold_http_response,
     decode_websocket_events,
+    decode_websocket_events_many,
     encode_websocket_events,
     websocket_control_message,
     _parse_channels,
@@ -199,6 +203,129 @@ class TestGripControl(unittest.TestCase):
         self.assertEqual("response" in hold, False)
         self.assertEqual(hold["hold"]["mode"], "stream")
 
+    def test_create_hold_http_response(self):
+        code, reason, headers, body = create_hold_http_response(
+            "response", "chan", Response(body="hello"), 30
+        )
+        self.assertEqual((code, reason), (200, None))
+        self.assertEqual(headers, [("Content-Type", "application/grip-instruct")])
+        self.assertEqual(
+            json.loads(body.decode("utf-8")),
+            json.loads(create_hold_response("chan", Response(body="hello"), 30)),
+        )
+        code, reason, headers, body = create_hold_http_response("stream", "chan")
+        self.assertEqual(json.loads(body.decode("utf-8"))["hold"]["mode"], "stream")
+        data = pack("hhh", 253, 254, 255)
+        code, reason, headers, body = create_hold_http_response(
+            "response",
+            [Channel("a"), Channel("b", "1")],
+            Response(404, "Not Found", {"Content-Type": "image/png"}, data),
+            30,
+        )
+        self.assertEqual((code, reason), (404, "Not Found"))
+        self.assertEqual(
+            headers,
+            [
+                ("Grip-Hold", "response"),
+                ("Grip-Channel", "a, b; prev-id=1"),
+                ("Grip-Timeout", "30"),
+                ("Content-Type", "image/png"),
+            ],
+        )
+        self.assertEqual(body, data)
+        code, reason, headers, body = create_hold_http_response("stream", "c", data)
+        self.assertEqual(code, 200)
+        self.assertEqual(headers, [("Grip-Hold", "stream"), ("Grip-Channel", "c")])
+        self.assertEqual(body, data)
+
+    def test_create_hold_timeout_jitter(self):
+        timeouts = set()
+        for n in range(200):
+            hold = json.loads(
+                create_hold_response("chan", None, 100, timeout_jitter=0.1)
+            )
+            timeouts.add(hold["hold"]["timeout"])
+        self.assertTrue(min(timeouts) >= 90 and max(timeouts) <= 110)
+        self.assertTrue(len(timeouts) > 1)
+        for n in range(20):
+            hold = json.loads(create_hold_response("chan", None, 1, timeout_jitter=0.9))
+            self.assertTrue(hold["hold"]["timeout"] >= 1)
+        self.assertEqual(
+            create_hold_response("chan", None, 30, timeout_jitter=0),
+            create_hold_response("chan", None, 30),
+        )
+        with self.assertRaises(ValueError):
+            create_hold_response("chan", None, 30, timeout_jitter=1)
+        headers = create_hold_http_response(
+            "response", "chan", pack("hhh", 253, 254, 255), 100, timeout_jitter=0.5
+        )[2]
+        self.assertTrue(50 <= int(dict(headers)["Grip-Timeout"]) <= 150)
+
+    def test_create_hold_keep_alive(self):
+        hold = json.loads(
+            create_hold_stream("chan", keep_alive="\n", keep_alive_interval=20)
+        )
+        self.assertEqual(hold["hold"]["keep-alive"], {"content": "\n", "timeout": 20})
+        self.assertEqual("timeout" in hold["hold"], False)
+        hold = json.loads(create_hold_response("chan", None, 30, keep_alive=":"))
+        self.assertEqual(hold["hold"]["keep-alive"], {"content": ":"})
+        hold = json.loads(
+            create_hold_stream("chan", keep_alive="x", keep_alive_format="base64")
+        )
+        self.assertEqual(hold["hold"]["keep-alive"], {"content-bin": "eA=="})
+        data = pack("hhh", 253, 254, 255)
+        hold = json.loads(create_hold_stream("chan", keep_alive=data))
+        self.assertEqual(
+            b64decode(hold["hold"]["keep-alive"]["content-bin"].encode("utf-8")), data
+        )
+        for format in ("raw", "cstring"):
+            hold = json.loads(
+                create_hold_stream("chan", keep_alive="\r\n", keep_alive_format=format)
+            )
+            self.assertEqual(hold["hold"]["keep-alive"], {"content": "\r\n"})
+            with self.assertRaises(ValueError):
+                create_hold_stream("chan", keep_alive=data, keep_alive_format=format)
+        with self.assertRaises(ValueError):
+            create_hold_stream("chan", keep_alive="x", keep_alive_format="hex")
+        self.assertEqual("keep-alive" in create_hold_stream("chan"), False)
+        code, reason, headers, body = create_hold_http_response(
+            "stream", "chan", data, keep_alive="\n", keep_alive_interval=20
+        )
+        self.assertEqual(
+            headers,
+            [
+                ("Grip-Hold", "stream"),
+                ("Grip-Channel", "chan"),
+                ("Grip-Keep-Alive", "\\n; format=cstring; timeout=20"),
+            ],
+        )
+
+    def test_create_grip_keep_alive_header(self):
+        self.assertEqual(create_grip_keep_alive_header(":ping"), ":ping")
+        self.assertEqual(
+            create_grip_keep_alive_header(":ping", interval=55), ":ping; timeout=55"
+        )
+        self.assertEqual(
+            create_grip_keep_alive_header(":\r\n\\"), ":\\r\\n\\\\; format=cstring"
+        )
+        self.assertEqual(
+            create_grip_keep_alive_header("a;b\n"), "YTtiCg==; format=base64"
+        )
+        self.assertEqual(
+            create_grip_keep_alive_header(b"\xff", interval=10),
+            "/w==; format=base64; timeout=10",
+        )
+        self.assertEqual(
+            create_grip_keep_alive_header("x", "base64"), "eA==; format=base64"
+        )
+        self.assertEqual(
+            create_grip_keep_alive_header("\n", "cstring"), "\\n; format=cstring"
+        )
+        with self.assertRaises(ValueError):
+            create_grip_keep_alive_header(b"\xff", "raw")
+        with self.assertRaises(ValueError):
+            create_grip_keep_alive_header("x", "hex")
+
     def test_decode_websocket_events(self):
         if is_python3:
             events = decode_websocket_events(
@@ -251,6 +378,132 @@ class TestGripControl(unittest.TestCase):
         with self.assertRaises(ValueError):
             decode_websocket_events("OPEN\r\nTEXT")
 
+    def test_decode_websocket_events_bad_length(self):
+        for length in [b"-2", b"+5", b"1_0", b" 5", b"0x5", b"g", b""]:
+            body = b"TEXT " + length + b"\r\nabcde\r\n"
+            with self.assertRaises(ValueError):
+                decode_websocket_events(body)
+            with self.assertRaises(ValueError):
+                decode_websocket_events_many([b"OPEN\r\n", body])
+        events = decode_websocket_events_many([b"TEXT A\r\n0123456789\r\n"])
+        self.assertEqual(events.get_content(0), b"0123456789")
+        self.assertEqual(
+            decode_websocket_events(b"TEXT a\r\n0123456789\r\n")[0].content,
+            b"0123456789",
+        )
+
+    def test_decode_websocket_events_strict(self):
+        body = b"OPEN\r\nTEXT 5\r\nHello\r\nCLOSE\r\n"
+        events = decode_websocket_events(
+            body, strict=True, max_events=3, max_payload=5, max_total=len(body)
+        )
+        self.assertEqual(len(events), 3)
+        with self.assertRaises(ValueError):
+            decode_websocket_events(body, max_total=len(body) - 1)
+        with self.assertRaises(ValueError):
+            decode_websocket_events(body, max_events=2)
+        with self.assertRaises(ValueError):
+            decode_websocket_events(body, max_payload=4)
+        # huge declared lengths are rejected without slicing
+        with self.assertRaises(ValueError):
+            decode_websocket_events(b"TEXT ffffffffffff\r\nHello\r\n", strict=True)
+        # truncated payload and missing CRLF are only accepted when not strict
+        self.assertEqual(
+            decode_websocket_events(b"TEXT 9\r\nHello")[0].content, b"Hello"
+        )
+        with self.assertRaises(ValueError):
+            decode_websocket_events(b"TEXT 9\r\nHello", strict=True)
+        # the CRLF ending the type line must not satisfy a negative length
+        for decode in (decode_websocket_events, decode_websocket_events_many):
+            body = b"TEXT -2\r\nab\r\n"
+            with self.assertRaises(ValueError):
+                decode(
+                    body if decode is decode_websocket_events else [body], strict=True
+                )
+        for length in (-2, -1):
+            with self.assertRaises(ValueError):
+                _check_event_payload(b"TEXT -2\r\nab\r\n", 9, length, None, True)
+            with self.assertRaises(ValueError):
+                _check_event_payload(b"TEXT -2\r\nab\r\n", 9, length, None, False)
+        with self.assertRaises(ValueError):
+            _check_event_payload(b"TEXT 2\r\nab\r", 8, 2, None, True)
+        _check_event_payload(b"TEXT 2\r\nab\r\n", 8, 2, None, True)
+        with self.assertRaises(ValueError):
+            decode_websocket_events(b"TEXT 2\r\nHello\r\n", strict=True)
+        with self.assertRaises(ValueError):
+            decode_websocket_events(b"TEXT zz\r\nHello\r\n", strict=True)
+
+    def test_decode_websocket_events_many_strict(self):
+        bodies = [b"OPEN\r\n", b"TEXT 2\r\nhi\r\nTEXT 1\r\nx\r\n"]
+        batch = decode_websocket_events_many(
+            bodies, strict=True, max_events=2, max_payload=2, max_total=23
+        )
+        self.assertEqual(len(batch), 3)
+        with self.assertRaises(ValueError):
+            decode_websocket_events_many(bodies, max_events=1)
+        with self.assertRaises(ValueError):
+            decode_websocket_events_many(bodies, max_payload=1)
+        with self.assertRaises(ValueError):
+            decode_websocket_events_many(bodies, max_total=10)
+        with self.assertRaises(ValueError):
+            decode_websocket_events_many([b"TEXT 2\r\nhi!"], strict=True)
+        with self.assertRaises(ValueError):
+            decode_websocket_events_many(
+                [b"TEXT 2\r\nhi!"] * 4, workers=2, chunk_size=1, strict=True
+            )
+
+    def test_decode_websocket_events_interned_types(self):
+        events = decode_websocket_events(b"OPEN\r\nTEXT 2\r\nhi\r\nOTHER 1\r\nx\r\n")
+        self.assertTrue(events[0].type is OPEN)
+        self.assertTrue(events[1].type is TEXT)
+        self.assertEqual(events[2].type, "OTHER")
+        self.assertEqual(events[2].content, b"x")
+
+    def test_decode_websocket_events_many(self):
+        bodies = [
+            b"OPEN\r\nTEXT 5\r\nHello\r\n",
+            b"",
+            b"PING 2\r\nhi\r\nCUSTOM\r\nCLOSE 2\r\n\x03\xe8\r\n",
+        ]
+        batch = decode_websocket_events_many(bodies)
+        self.assertEqual(len(batch), 5)
+        self.assertEqual(batch.body_count, 3)
+        self.assertEqual(batch.payload, b"".join(bodies))
+        for n, body in enumerate(bodies):
+            expected = decode_websocket_events(body)
+            events = batch.to_events(n)
+            self.assertEqual(
+                [(e.type, e.content) for e in events],
+                [(e.type, e.content) for e in expected],
+            )
+        self.assertEqual(batch.get_type(3), "CUSTOM")
+        self.assertEqual(batch.get_content(3), None)
+        with self.assertRaises(ValueError):
+            decode_websocket_events_many([b"OPEN\r\n", b"TEXT 5"])
+        with self.assertRaises(ValueError):
+            decode_websocket_events_many(["OPEN\r\n"])
+
+    def test_decode_websocket_events_many_workers(self):
+        bodies = [b"OPEN\r\nTEXT 3\r\n%03d\r\n" % n for n in range(50)]
+        bodies[7] += b"FOO 1\r\nx\r\n"
+        bodies[31] += b"BAR\r\nFOO\r\n"
+        single = decode_websocket_events_many(bodies)
+        batch = decode_websocket_events_many(bodies, workers=2, chunk_size=7)
+        self.assertEqual(batch.body_count, 50)
+        self.assertEqual(batch.payload, single.payload)
+        self.assertEqual(list(batch.bounds), list(single.bounds))
+        self.assertEqual(list(batch.spans), list(single.spans))
+        self.assertEqual(
+            [batch.get_type(n) for n in range(len(batch))],
+            [single.get_type(n) for n in range(len(single))],
+        )
+        self.assertEqual(batch.get_content(3), b"001")
+
+    def test_encode_websocket_events_batch(self):
+        body = b"OPEN\r\nTEXT 5\r\nHello\r\nCLOSE\r\n"
+        batch = decode_websocket_events_many([body])
+        self.assertEqual(encode_websocket_events(batch), body)
+
     def test_encode_websocket_events(self):
         events = encode_websocket_events(
             [
@@ -309,6 +562,13 @@ class TestGripControl(unittest.TestCase):
         )
         self.assertEqual(hold_channels[0], {"name": "channel1", "prev-id": "prev-id1"})
         self.assertEqual(hold_channels[1], {"name": "channel2", "prev-id": "prev-id2"})
+        hold_channels = _get_hold_channels(
+            [Channel("channel", filters=["skip-self", "require-sub"])]
+        )
+        self.assertEqual(
+            hold_channels[0],
+            {"name": "channel", "filters": ["skip-self", "require-sub"]},
+        )
 
     def test_get_hold_response(self):
         response = _get_hold_response(None)
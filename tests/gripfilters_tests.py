@@ -0,0 +1,26 @@
+import sys
+import unittest
+
+sys.path.append("../")
+from src.gripfilters import filter_meta, SKIP_SELF, SKIP_USERS, REQUIRE_SUB
+
+
+class TestGripFilters(unittest.TestCase):
+    def test_filter_names(self):
+        self.assertEqual(SKIP_SELF, "skip-self")
+        self.assertEqual(SKIP_USERS, "skip-users")
+        self.assertEqual(REQUIRE_SUB, "require-sub")
+
+    def test_filter_meta(self):
+        self.assertEqual(filter_meta(), {})
+        self.assertEqual(filter_meta(sender="alice"), {"sender": "alice"})
+        self.assertEqual(filter_meta(skip_users="bob"), {"skip_users": "bob"})
+        self.assertEqual(
+            filter_meta("alice", ["bob", "carol"], "admins"),
+            {"sender": "alice", "skip_users": "bob,carol", "require_sub": "admins"},
+        )
+        self.assertEqual(filter_meta(skip_users=[]), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,272 @@
+import sys
+import time
+import unittest
+from io import BytesIO
+from struct import pack
+import jwt
+
+sys.path.append("../")
+from src.gripmiddleware import GripContext, GripMiddleware, GRIP_CONTEXT_KEY
+from src.gripcontrol import decode_websocket_events
+from src.channel import Channel
+
+
+def _sig(key):
+    return jwt.encode({"iss": "realm", "exp": int(time.time()) + 3600}, key)
+
+
+def _environ(headers, body=b""):
+    environ = {"wsgi.input": BytesIO(body), "CONTENT_LENGTH": str(len(body))}
+    for name, value in headers.items():
+        if name.lower() == "content-type":
+            environ["CONTENT_TYPE"] = value
+        else:
+            environ["HTTP_" + name.upper().replace("-", "_")] = value
+    return environ
+
+
+def _call(app, environ):
+    out = {}
+
+    def start_response(status, headers, exc_info=None):
+        out["status"] = status
+        out["headers"] = headers
+        return lambda data: None
+
+    body = b"".join(app(environ, start_response))
+    return out["status"], dict(out["headers"]), body
+
+
+class TestGripContext(unittest.TestCase):
+    def test_proxied(self):
+        grip = GripContext({})
+        self.assertFalse(grip.proxied)
+        self.assertFalse(grip.signed)
+        grip = GripContext({"grip-sig": "sig"})
+        self.assertTrue(grip.proxied)
+        self.assertFalse(grip.signed)
+        grip = GripContext({"grip-sig": "sig"}, key="key")
+        self.assertFalse(grip.proxied)
+        grip = GripContext({"grip-sig": _sig("key")}, key="key", iss="realm")
+        self.assertTrue(grip.proxied)
+        self.assertTrue(grip.signed)
+
+    def test_signed_cached(self):
+        grip = GripContext({"grip-sig": _sig("key")}, key="key")
+        self.assertTrue(grip.signed)
+        grip.headers["grip-sig"] = "invalid"
+        self.assertTrue(grip.signed)
+
+    def test_websocket_lazy(self):
+        calls = []
+
+        def body():
+            calls.append(True)
+            return b"OPEN\r\n"
+
+        grip = GripContext(
+            {
+                "content-type": "application/websocket-events",
+                "connection-id": "conn-1",
+                "meta-user": "alice",
+            },
+            body,
+        )
+        self.assertTrue(grip.is_websocket)
+        self.assertFalse(grip.websocket_used)
+        self.assertEqual(calls, [])
+        ws = grip.websocket
+        self.assertTrue(grip.websocket is ws)
+        self.assertEqual(calls, [True])
+        self.assertEqual(ws.id, "conn-1")
+        self.assertEqual(ws.meta, {"user": "alice"})
+        self.assertTrue(ws.is_opening())
+        with self.assertRaises(ValueError):
+            GripContext({}).websocket
+
+    def test_response_headers(self):
+        grip = GripContext({})
+        self.assertEqual(grip.get_response_headers(), [])
+        grip.set_hold_longpoll([Channel("a"), Channel("b", "1")], 30)
+        self.assertEqual(
+            grip.get_response_headers(),
+            [
+                ("Grip-Hold", "response"),
+                ("Grip-Channel", "a, b; prev-id=1"),
+                ("Grip-Timeout", "30"),
+            ],
+        )
+        grip.set_hold_stream("a")
+        self.assertEqual(
+            grip.get_response_headers(),
+            [("Grip-Hold", "stream"), ("Grip-Channel", "a")],
+        )
+        grip.set_hold_stream("a", keep_alive="\n", keep_alive_interval=20)
+        self.assertEqual(
+            grip.get_response_headers()[-1],
+            ("Grip-Keep-Alive", "\\n; format=cstring; timeout=20"),
+        )
+        grip.set_hold_longpoll("a", 100, timeout_jitter=0.2, keep_alive=":")
+        headers = dict(grip.get_response_headers())
+        self.assertTrue(80 <= int(headers["Grip-Timeout"]) <= 120)
+        self.assertEqual(headers["Grip-Keep-Alive"], ":")
+
+    def test_websocket_response(self):
+        grip = GripContext(
+            {
+                "content-type": "application/websocket-events",
+                "meta-a": "1",
+                "meta-b": "2",
+            },
+            b"OPEN\r\n",
+        )
+        ws = grip.websocket
+        ws.accept()
+        ws.send("hello")
+        ws.meta["a"] = "3"
+        del ws.meta["b"]
+        ws.close(1000)
+        headers, body = grip.get_websocket_response()
+        headers = dict(headers)
+        self.assertEqual(headers["Content-Type"], "application/websocket-events")
+        self.assertEqual(headers["Sec-WebSocket-Extensions"], "grip")
+        self.assertEqual(headers["Set-Meta-a"], "3")
+        self.assertEqual(headers["Set-Meta-b"], "")
+        events = decode_websocket_events(body)
+        self.assertEqual([e.type for e in events], ["OPEN", "TEXT", "CLOSE"])
+        self.assertEqual(events[1].content, b"m:hello")
+        self.assertEqual(events[2].content, pack(">H", 1000))
+
+
+class TestGripMiddleware(unittest.TestCase):
+    def test_hold(self):
+        def app(environ, start_response):
+            grip = environ[GRIP_CONTEXT_KEY]
+            self.assertTrue(grip.proxied)
+            grip.set_hold_longpoll("channel", 20)
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"timeout"]
+
+        status, headers, body = _call(
+            GripMiddleware(app, key="key"), _environ({"Grip-Sig": _sig("key")})
+        )
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["Grip-Hold"], "response")
+        self.assertEqual(headers["Grip-Channel"], "channel")
+        self.assertEqual(headers["Grip-Timeout"], "20")
+        self.assertEqual(body, b"timeout")
+
+    def test_passthrough(self):
+        def app(environ, start_response):
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"not found"]
+
+        status, headers, body = _call(GripMiddleware(app), _environ({}))
+        self.assertEqual(status, "404 Not Found")
+        self.assertEqual(headers, {"Content-Type": "text/plain"})
+        self.assertEqual(body, b"not found")
+
+    def test_websocket(self):
+        def app(environ, start_response):
+            ws = environ[GRIP_CONTEXT_KEY].websocket
+            if ws.is_opening():
+                ws.accept()
+                ws.subscribe("channel")
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return []
+
+        status, headers, body = _call(
+            GripMiddleware(app),
+            _environ(
+                {"Content-Type": "application/websocket-events", "Connection-Id": "c"},
+                b"OPEN\r\n",
+            ),
+        )
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["Content-Type"], "application/websocket-events")
+        self.assertEqual(headers["Sec-WebSocket-Extensions"], "grip")
+        self.assertEqual(headers["Content-Length"], str(len(body)))
+        events = decode_websocket_events(body)
+        self.assertEqual([e.type for e in events], ["OPEN", "TEXT"])
+        self.assertTrue(events[1].content.startswith(b"c:"))
+
+    def test_websocket_buffered(self):
+        def app(environ, start_response):
+            ws = environ[GRIP_CONTEXT_KEY].websocket
+            self.assertTrue(ws.out_buffer is not None)
+            ws.accept()
+            ws.send("hello")
+            ws.close(1000)
+            start_response("200 OK", [])
+            return []
+
+        status, headers, body = _call(
+            GripMiddleware(app, buffered=True),
+            _environ({"Content-Type": "application/websocket-events"}, b"OPEN\r\n"),
+        )
+        self.assertEqual(
+            body,
+            b"OPEN\r\nTEXT 7\r\nm:hello\r\nCLOSE 2\r\n" + pack(">H", 1000) + b"\r\n",
+        )
+
+    def test_websocket_error_response_kept(self):
+        def app(environ, start_response):
+            environ[GRIP_CONTEXT_KEY].websocket
+            start_response("500 Internal Server Error", [])
+            return [b"error"]
+
+        status, headers, body = _call(
+            GripMiddleware(app),
+            _environ({"Content-Type": "application/websocket-events"}, b"OPEN\r\n"),
+        )
+        self.assertEqual(status, "500 Internal Server Error")
+        self.assertEqual(body, b"error")
+
+    def test_websocket_generator_app(self):
+        closed = []
+
+        def app(environ, start_response):
+            try:
+                ws = environ[GRIP_CONTEXT_KEY].websocket
+                ws.accept()
+                ws.send("hello")
+                start_response("200 OK", [("Content-Type", "text/plain")])
+                if False:
+                    yield b""
+            finally:
+                closed.append(True)
+
+        status, headers, body = _call(
+            GripMiddleware(app),
+            _environ({"Content-Type": "application/websocket-events"}, b"OPEN\r\n"),
+        )
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["Content-Type"], "application/websocket-events")
+        events = decode_websocket_events(body)
+        self.assertEqual([e.type for e in events], ["OPEN", "TEXT"])
+        self.assertEqual(events[1].content, b"m:hello")
+        self.assertEqual(closed, [True])
+
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            yield b"a"
+            yield b"b"
+
+        status, headers, body = _call(
+            GripMiddleware(app),
+            _environ({"Content-Type": "application/websocket-events"}, b"OPEN\r\n"),
+        )
+        self.assertEqual((status, body), ("200 OK", b"ab"))
+
+        def app(environ, start_response):
+            environ[GRIP_CONTEXT_KEY].set_hold_stream("channel")
+            start_response("200 OK", [])
+            yield b"stream"
+
+        status, headers, body = _call(GripMiddleware(app), _environ({}))
+        self.assertEqual(headers["Grip-Hold"], "stream")
+        self.assertEqual(body, b"stream")
+
+
+if __name__ == "__main__":
+    unittest.main()
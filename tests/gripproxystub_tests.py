@@ -0,0 +1,286 @@
+import sys
+import json
+import threading
+import time
+import unittest
+import requests
+
+sys.path.append("../")
+from src.gripproxystub import (
+    GripProxyStub,
+    create_websocket_request_body,
+    _parse_keep_alive,
+    _validate_item,
+)
+from src.grippubcontrol import GripPubControl
+from src.gripmiddleware import GripMiddleware, GRIP_CONTEXT_KEY
+from src.httpresponseformat import HttpResponseFormat
+from src.httpstreamformat import HttpStreamFormat
+from src.gripcontrol import (
+    create_hold_response,
+    create_hold_stream,
+    create_hold_http_response,
+    decode_websocket_events,
+    validate_sig,
+)
+
+
+def hold_app(environ, start_response):
+    path = environ["PATH_INFO"]
+    if path == "/poll":
+        start_response("200 OK", [("Content-Type", "application/grip-instruct")])
+        return [create_hold_response("c", "timed out", timeout=1, as_bytes=True)]
+    if path == "/stream":
+        start_response("200 OK", [("Content-Type", "application/grip-instruct")])
+        return [
+            create_hold_stream(
+                "c", "start\n", keep_alive="ka\n", keep_alive_interval=1, as_bytes=True
+            )
+        ]
+    if path == "/binary":
+        code, reason, headers, body = create_hold_http_response(
+            "response", "c", b"\xff", timeout=1
+        )
+        start_response("%d OK" % code, headers)
+        return [body]
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [environ.get("HTTP_GRIP_SIG", "plain").encode("utf-8")]
+
+
+def websocket_app(environ, start_response):
+    ws = environ[GRIP_CONTEXT_KEY].websocket
+    if ws.is_opening():
+        ws.accept()
+        ws.subscribe("room")
+    while ws.can_recv():
+        message = ws.recv()
+        if message is None:
+            ws.close()
+            break
+        ws.send("echo: " + message)
+    start_response("200 OK", [])
+    return [b""]
+
+
+class TestGripProxyStub(unittest.TestCase):
+    def setUp(self):
+        self.stub = GripProxyStub({"example": hold_app}).start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def get_async(self, path):
+        result = {}
+
+        def run():
+            result["response"] = requests.get(self.stub.uri + path)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.assertTrue(self.stub.wait_held(1))
+        return thread, result
+
+    def test_publish(self):
+        pub = GripPubControl({"control_uri": self.stub.uri})
+        pub.publish_http_response("a", "hello", "1", blocking=True)
+        pub.publish_http_stream("b", "world")
+        self.assertTrue(self.stub.wait_items(2))
+        pub.close()
+        self.assertEqual(
+            self.stub.items,
+            [
+                {"channel": "a", "id": "1", "http-response": {"body": "hello"}},
+                {"channel": "b", "http-stream": {"content": "world"}},
+            ],
+        )
+        self.assertEqual(self.stub.publish_requests, 2)
+        self.stub.reset()
+        self.assertEqual(self.stub.items, [])
+        self.assertEqual(self.stub.publish_requests, 0)
+
+    def test_publish_invalid(self):
+        for body in ["{}", "[]", '{"items": [{"channel": "a"}]}', "not json"]:
+            response = requests.post(self.stub.uri + "/publish/", data=body)
+            self.assertEqual(response.status_code, 400)
+        items = [
+            {"channel": "a", "http-stream": {"content": "x"}},
+            {"channel": "b", "http-stream": {"content-bin": "!"}},
+        ]
+        response = requests.post(
+            self.stub.uri + "/publish/", data=json.dumps({"items": items})
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stub.items, [])
+        self.assertEqual(requests.get(self.stub.uri + "/publish/").status_code, 405)
+        self.assertEqual(requests.get(self.stub.uri + "/other").status_code, 404)
+
+    def test_validate_item(self):
+        _validate_item({"channel": "a", "http-response": {"code": 200}})
+        _validate_item({"channel": "a", "http-stream": {"action": "close"}})
+        _validate_item({"channel": "a", "ws-message": {"content-bin": "eA=="}})
+        for item in [
+            {"http-stream": {"content": "x"}},
+            {"channel": "a", "id": 1, "http-stream": {"content": "x"}},
+            {"channel": "a", "http-response": {"code": "200"}},
+            {"channel": "a", "http-stream": {}},
+            {"channel": "a", "http-stream": {"action": "open"}},
+            {"channel": "a", "ws-message": {"content": "x", "content-bin": "eA=="}},
+        ]:
+            with self.assertRaises(ValueError):
+                _validate_item(item)
+
+    def test_control_key(self):
+        self.stub.control_key = "key"
+        pub = GripPubControl({"control_uri": self.stub.uri})
+        with self.assertRaises(Exception):
+            pub.publish_http_stream("a", "x", blocking=True)
+        pub = GripPubControl(
+            {"control_uri": self.stub.uri, "control_iss": "iss", "key": "key"}
+        )
+        pub.publish_http_stream("a", "x", blocking=True)
+        self.assertEqual(len(self.stub.items), 1)
+
+    def test_set_origin(self):
+        self.stub.control_key = "key"
+        pub = GripPubControl(
+            {"control_uri": self.stub.uri, "control_iss": "iss", "key": "key"}
+        )
+        pub.set_origin(host="example.com", port=80)
+        pub.set_origin("other", ssl_host="example.com", ssl_port=443)
+        self.assertEqual(
+            self.stub.origins,
+            {
+                "default": {
+                    "host": "example.com",
+                    "port": "80",
+                    "rewrite_host": "true",
+                    "over_http": "true",
+                },
+                "other": {
+                    "ssl_host": "example.com",
+                    "ssl_port": "443",
+                    "rewrite_host": "true",
+                    "over_http": "true",
+                },
+            },
+        )
+        self.assertEqual(self.stub.items, [])
+        with self.assertRaises(ValueError):
+            GripPubControl({"control_uri": self.stub.uri}).set_origin(
+                host="example.com", port=80
+            )
+        response = requests.get(self.stub.uri + "/http/default/")
+        self.assertEqual(response.status_code, 405)
+        response = requests.post(self.stub.uri + "/http/default/path")
+        self.assertEqual(response.status_code, 404)
+        self.stub.reset()
+        self.assertEqual(self.stub.origins, {})
+
+    def test_failure_injection(self):
+        stub = GripProxyStub(failure_rate=0.5, seed=1).start()
+        try:
+            results = []
+            for n in range(20):
+                response = requests.post(
+                    stub.uri + "/publish/",
+                    data=json.dumps(
+                        {"items": [{"channel": "a", "http-stream": {"content": "x"}}]}
+                    ),
+                )
+                results.append(response.status_code)
+            self.assertEqual(results.count(500), stub.failures_injected)
+            self.assertTrue(0 < stub.failures_injected < 20)
+            self.assertEqual(len(stub.items), 20 - stub.failures_injected)
+        finally:
+            stub.stop()
+
+    def test_latency(self):
+        self.stub.latency = (0.1, 0.2)
+        start = time.time()
+        pub = GripPubControl({"control_uri": self.stub.uri})
+        pub.publish_http_stream("a", "x", blocking=True)
+        self.assertTrue(time.time() - start >= 0.1)
+
+    def test_hold_response(self):
+        pub = GripPubControl({"control_uri": self.stub.uri})
+        thread, result = self.get_async("/route/example/poll")
+        pub.publish_http_response("c", "pushed", blocking=True)
+        thread.join()
+        self.assertEqual(result["response"].text, "pushed")
+        self.assertEqual(self.stub.held, 0)
+        response = requests.get(self.stub.uri + "/route/example/poll")
+        self.assertEqual(response.text, "timed out")
+
+    def test_hold_headers(self):
+        pub = GripPubControl({"control_uri": self.stub.uri})
+        thread, result = self.get_async("/route/example/binary")
+        pub.publish_http_response("c", HttpResponseFormat(body=b"\xfe"), blocking=True)
+        thread.join()
+        self.assertEqual(result["response"].content, b"\xfe")
+        response = requests.get(self.stub.uri + "/route/example/binary")
+        self.assertEqual(response.content, b"\xff")
+        self.assertTrue("Grip-Hold" not in response.headers)
+
+    def test_hold_stream(self):
+        pub = GripPubControl({"control_uri": self.stub.uri})
+        thread, result = self.get_async("/route/example/stream")
+        time.sleep(1.2)
+        pub.publish_http_stream("c", "data\n", blocking=True)
+        pub.publish_http_stream("c", HttpStreamFormat(close=True), blocking=True)
+        thread.join()
+        self.assertEqual(result["response"].text, "start\nka\ndata\n")
+
+    def test_routes(self):
+        response = requests.get(self.stub.uri + "/route/example/")
+        self.assertEqual(response.text, "plain")
+        self.assertEqual(
+            requests.get(self.stub.uri + "/route/unknown/").status_code, 502
+        )
+        self.stub.sig_key = "secret"
+        response = requests.get(self.stub.uri + "/route/example/")
+        self.assertTrue(validate_sig(response.text, "secret"))
+
+    def test_websocket(self):
+        self.stub.add_route("ws", GripMiddleware(websocket_app))
+        response = requests.post(
+            self.stub.uri + "/route/ws/",
+            data=create_websocket_request_body(["hi"], open=True),
+            headers={
+                "Content-Type": "application/websocket-events",
+                "Connection-Id": "conn1",
+            },
+        )
+        events = decode_websocket_events(response.content)
+        self.assertEqual(events[0].type, "OPEN")
+        self.assertEqual(events[-1].type, "TEXT")
+        self.assertEqual(events[-1].content, b"m:echo: hi")
+        self.assertTrue(
+            any(
+                e.content and json.loads(e.content[2:])["channel"] == "room"
+                for e in events
+                if e.content and e.content.startswith(b"c:")
+            )
+        )
+
+    def test_create_websocket_request_body(self):
+        body = create_websocket_request_body(
+            ["hi", b"\x00"], open=True, close=True, close_code=1001
+        )
+        self.assertEqual(
+            body, b"OPEN\r\nTEXT 2\r\nhi\r\nBINARY 1\r\n\x00\r\nCLOSE 2\r\n\x03\xe9\r\n"
+        )
+        self.assertEqual(create_websocket_request_body(), b"")
+
+    def test_parse_keep_alive(self):
+        self.assertEqual(_parse_keep_alive("ka"), {"content": "ka"})
+        self.assertEqual(
+            _parse_keep_alive("\\n; format=cstring; timeout=20"),
+            {"content": "\n", "timeout": 20},
+        )
+        self.assertEqual(
+            _parse_keep_alive("eA==; format=base64"), {"content-bin": "eA=="}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
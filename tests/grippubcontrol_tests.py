@@ -1,10 +1,25 @@
+import os
 import sys
+import threading
+import time
 import unittest
-from pubcontrol import Item
+import requests
+from pubcontrol import Item, PubControlClient
+import pubcontrol.pubcontrol
 import zmq
 
 sys.path.append("../")
+import src.grippubcontrol
+import src.grippubcontrolclient
 from src.grippubcontrol import GripPubControl
+from src.grippubcontrolclient import GripPubControlClient
+from src.gripzmqpubcontrolclient import GripZmqPubControlClient
+from src.jwtcache import JwtCache
+from src.retrypolicy import RetryPolicy
+from src.circuitbreaker import CircuitBreaker
+from src.publishmetrics import PublishMetrics
+from src.channelsequencer import ChannelSequencer
+from src.streamcoalescer import StreamCoalescer
 from src.httpresponseformat import HttpResponseFormat
 from src.httpstreamformat import HttpStreamFormat
 
@@ -27,6 +42,50 @@ class GripPubControlTestClass(GripPubControl):
         self.publish_callback = callback
 
 
+class ClientTestClass(object):
+    def close(self):
+        pass
+
+    def wait_all_sent(self):
+        pass
+
+
+class GripPubControlChunksTestClass(GripPubControl):
+    def __init__(self, fail_at=None):
+        super(GripPubControlChunksTestClass, self).__init__()
+        self.clients = [ClientTestClass()]
+        self.items = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_at = fail_at
+        self.lock = threading.Lock()
+
+    def publish(self, channel, item, blocking=False, callback=None):
+        self.lock.acquire()
+        self.items.append((channel, item))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        failed = len(self.items) == self.fail_at
+        self.lock.release()
+
+        def complete():
+            time.sleep(0.001)
+            self.lock.acquire()
+            self.in_flight -= 1
+            self.lock.release()
+            if failed:
+                callback(False, "error")
+            else:
+                callback(True, "")
+
+        threading.Thread(target=complete).start()
+
+
+def _chunks(count):
+    for n in range(count):
+        yield "chunk%d" % n
+
+
 class TestGripPubControl(unittest.TestCase):
     def test_initialize(self):
         pc = GripPubControl()
@@ -44,6 +103,14 @@ class TestGripPubControl(unittest.TestCase):
         pc = GripPubControl(None, "callback", "zmqctx")
         self.assertEqual(pc._sub_callback, "callback")
         self.assertEqual(pc._zmq_ctx, "zmqctx")
+        self.assertEqual(pc.metrics, None)
+        metrics = PublishMetrics()
+        pc = GripPubControl({"control_uri": "uri"}, metrics=metrics)
+        self.assertEqual(pc.metrics, metrics)
+        self.assertEqual(pc.clients[0].metrics, metrics)
+        self.assertEqual(pc.sequencer, None)
+        pc = GripPubControl(sequencer=True)
+        self.assertTrue(isinstance(pc.sequencer, ChannelSequencer))
 
     def test_apply_grip_config(self):
         pc = GripPubControl()
@@ -68,6 +135,7 @@ class TestGripPubControl(unittest.TestCase):
         self.assertEqual(pc.clients[2].uri, "uri2")
         self.assertEqual(pc.clients[2].auth_jwt_claim, {"iss": "iss2"})
         self.assertEqual(pc.clients[2].auth_jwt_key, "key2")
+        self.assertTrue(isinstance(pc.clients[3], GripZmqPubControlClient))
         self.assertEqual(pc.clients[3].uri, "zmq_uri")
         self.assertEqual(pc.clients[3]._require_subscribers, False)
         self.assertEqual(pc.clients[4].uri, "zmq_uri2")
@@ -76,6 +144,73 @@ class TestGripPubControl(unittest.TestCase):
         self.assertEqual(pc.clients[4]._disable_pub, True)
         self.assertEqual(pc.clients[4]._context, pc._zmq_ctx)
 
+    def test_apply_grip_config_retry(self):
+        pc = GripPubControl()
+        breaker = CircuitBreaker()
+        config = [
+            {"control_uri": "uri"},
+            {
+                "control_uri": "uri1",
+                "retry": {"max_retries": 5},
+                "circuit_breaker": True,
+            },
+            {"control_uri": "uri2", "retry": True, "circuit_breaker": breaker},
+        ]
+        pc.apply_grip_config(config)
+        self.assertTrue(isinstance(pc.clients[0], GripPubControlClient))
+        self.assertEqual(pc.clients[0].retry_policy, None)
+        self.assertEqual(pc.clients[0].circuit_breaker, None)
+        self.assertTrue(isinstance(pc.clients[1].retry_policy, RetryPolicy))
+        self.assertEqual(pc.clients[1].retry_policy.max_retries, 5)
+        self.assertTrue(isinstance(pc.clients[1].circuit_breaker, CircuitBreaker))
+        self.assertEqual(pc.clients[2].retry_policy.max_retries, 3)
+        self.assertEqual(pc.clients[2].circuit_breaker, breaker)
+        self.assertEqual(pc.get_circuit_states(), {"uri1": "closed", "uri2": "closed"})
+        for n in range(5):
+            breaker.record_failure()
+        self.assertEqual(pc.get_circuit_states()["uri2"], "open")
+
+    def test_apply_grip_config_jwt_cache(self):
+        pc = GripPubControl()
+        cache = JwtCache(ttl=60, refresh_margin=5)
+        config = [
+            {"control_uri": "uri"},
+            {"control_uri": "uri1", "control_iss": "iss1", "key": "key1"},
+            {
+                "control_uri": "uri2",
+                "control_iss": "iss2",
+                "key": "key2",
+                "jwt_cache": False,
+            },
+            {
+                "control_uri": "uri3",
+                "control_iss": "iss3",
+                "key": "key3",
+                "jwt_cache": {"ttl": 600},
+            },
+            {
+                "control_uri": "uri4",
+                "control_iss": "iss4",
+                "key": "key4",
+                "jwt_cache": cache,
+            },
+        ]
+        pc.apply_grip_config(config)
+        self.assertEqual(pc.clients[0].jwt_cache, None)
+        self.assertTrue(isinstance(pc.clients[1].jwt_cache, JwtCache))
+        self.assertEqual(pc.clients[2].jwt_cache, None)
+        self.assertEqual(pc.clients[3].jwt_cache.ttl, 600)
+        self.assertTrue(pc.clients[4].jwt_cache is cache)
+
+    def test_apply_grip_config_conflate(self):
+        pc = GripPubControl(conflate=True)
+        pc.apply_grip_config(
+            [{"control_uri": "uri"}, {"control_uri": "uri2", "conflate": False}]
+        )
+        self.assertTrue(pc.clients[0].conflate)
+        self.assertFalse(pc.clients[1].conflate)
+        self.assertFalse(GripPubControl({"control_uri": "uri"}).clients[0].conflate)
+
     def test_publish_http_response_string(self):
         pc = GripPubControlTestClass()
         pc.publish_http_response("channel", "item", "id", None, True)
@@ -171,6 +306,23 @@ class TestGripPubControl(unittest.TestCase):
             pc.publish_item.export(), Item(HttpStreamFormat(None, True)).export()
         )
 
+    def test_publish_meta(self):
+        pc = GripPubControlTestClass()
+        pc.publish_http_response("channel", "item", meta={"sender": "alice"})
+        self.assertEqual(
+            pc.publish_item.export(),
+            Item(
+                HttpResponseFormat(None, None, None, "item"), meta={"sender": "alice"}
+            ).export(),
+        )
+        pc.publish_http_stream("channel", "item", meta={"require_sub": "admins"})
+        self.assertEqual(
+            pc.publish_item.export(),
+            Item(HttpStreamFormat("item"), meta={"require_sub": "admins"}).export(),
+        )
+        pc.publish_http_stream("channel", "item")
+        self.assertTrue("meta" not in pc.publish_item.export())
+
     def test_publish_http_stream_with_callback_string(self):
         self.has_callback_been_called = False
         pc = GripPubControlTestClass()
@@ -204,6 +356,244 @@ class TestGripPubControl(unittest.TestCase):
         pc.publish_callback(False, "error")
         self.assertTrue(self.has_callback_been_called)
 
+    def test_publish_http_stream_coalesce(self):
+        pc = GripPubControlChunksTestClass()
+        pc.coalescer = StreamCoalescer(window=10)
+        pc.publish_http_stream("channel", "a")
+        pc.publish_http_stream("channel", "b")
+        self.assertEqual(pc.items, [])
+        pc.wait_all_sent()
+        self.assertEqual(len(pc.items), 1)
+        self.assertEqual(pc.items[0][1].formats[0].content, "ab")
+        pc = GripPubControl(coalesce={"window": 1, "rate": 5})
+        self.assertEqual(pc.coalescer.window, 1)
+        self.assertEqual(pc.coalescer.rate, 5)
+        self.assertEqual(GripPubControl().coalescer, None)
+
+    def test_lanes(self):
+        pc = GripPubControl(
+            {"control_uri": "uri"},
+            lanes={"realtime": {"batch_size": 1}, "bulk": True},
+        )
+        self.assertEqual(pc.lanes["realtime"].batch_size, 1)
+        self.assertEqual(pc.lanes["bulk"].batch_size, 10)
+        self.assertEqual(sorted(pc.clients[0]._lanes), ["bulk", "realtime"])
+        self.assertEqual(GripPubControl().lanes, None)
+        published = []
+
+        class LaneClientTestClass(GripPubControlClient):
+            def publish(self, channel, item, blocking=False, callback=None, lane=None):
+                published.append((channel, lane))
+                if callback:
+                    callback(True, "")
+
+        pc.clients = [LaneClientTestClass("uri")]
+        results = []
+        pc.publish_http_response(
+            "channel",
+            "body",
+            callback=lambda result, message: results.append(result),
+            lane="realtime",
+        )
+        pc.publish_http_stream("channel", "content", lane="bulk")
+        pc.publish_http_stream("channel", "content")
+        self.assertEqual(
+            published,
+            [("channel", "realtime"), ("channel", "bulk"), ("channel", None)],
+        )
+        self.assertEqual(results, [True])
+        with self.assertRaises(ValueError):
+            pc.publish_http_stream("channel", "content", lane="other")
+
+    def test_send_to_zmq_raw_binary(self):
+        published = []
+
+        class TNetStringTestClass(object):
+            def dumps(self, content):
+                return content
+
+        class PubControllerTestClass(object):
+            def publish(self, channel, content):
+                published.append((channel, content))
+
+        pc = GripPubControl()
+        pc._zmq_pub_controller = PubControllerTestClass()
+        tnetstring = pubcontrol.pubcontrol.tnetstring
+        pubcontrol.pubcontrol.tnetstring = TNetStringTestClass()
+        try:
+            pc.publish_http_response("channel", HttpResponseFormat(body=b"\xff"))
+        finally:
+            pubcontrol.pubcontrol.tnetstring = tnetstring
+            pc._zmq_pub_controller = None
+        self.assertEqual(
+            published,
+            [(b"channel", {b"formats": {b"http-response": {b"body": b"\xff"}}})],
+        )
+
+        # without a PUB socket the item is not wrapped
+        wrap = src.grippubcontrol._RawBinaryItem
+        src.grippubcontrol._RawBinaryItem = None
+        try:
+            pc.publish_http_response("channel", HttpResponseFormat(body=b"\xff"))
+        finally:
+            src.grippubcontrol._RawBinaryItem = wrap
+        self.assertEqual(len(published), 1)
+
+    def test_after_fork(self):
+        metrics = PublishMetrics()
+        pc = GripPubControl(
+            {"control_uri": "uri", "circuit_breaker": True},
+            metrics=metrics,
+            sequencer=True,
+            coalesce=True,
+            lanes={"bulk": True},
+        )
+        client = pc.clients[0]
+        lock = client.lock
+        client.thread = "parent thread"
+        client.req_queue.append(("pub", "uri", None, {}, None))
+        client._lanes["bulk"].queue.append(("uri", None, {}, None))
+        pc.coalescer._channels["channel"] = "parent content"
+        pc._check_fork()
+        self.assertEqual(client.thread, "parent thread")
+        pc._pid = -1
+        pc._check_fork()
+        self.assertEqual(pc._pid, os.getpid())
+        self.assertEqual(client.thread, None)
+        self.assertFalse(client.lock is lock)
+        self.assertEqual(len(client.req_queue), 0)
+        self.assertEqual(len(client._lanes["bulk"].queue), 0)
+        self.assertEqual(pc.coalescer._channels, {})
+        id, prev_id = pc.sequencer.sequence("channel")
+        self.assertTrue(id.startswith("%d-" % os.getpid()) and id.endswith("-1"))
+        self.assertEqual(prev_id, None)
+
+    def test_after_fork_sub_monitor(self):
+        class PubSubMonitorTestClass(object):
+            def __init__(self, *args):
+                self.args = args
+                self._callback = None
+                self._closed = False
+                self._requests_session = requests.session()
+
+            def is_closed(self):
+                return self._closed
+
+            def close(self):
+                self._closed = True
+
+            def is_channel_subscribed_to(self, channel):
+                return False
+
+        pc = GripPubControl()
+        client = PubControlClient("uri")
+        parent = PubSubMonitorTestClass()
+        client.sub_monitor = parent
+        pc.add_client(client)
+        pc._pid = -1
+        pc._check_fork()
+        self.assertEqual(pc._stale_monitors, [client])
+        self.assertTrue(client.sub_monitor is parent)
+        monitor_class = src.grippubcontrolclient.PubSubMonitor
+        src.grippubcontrolclient.PubSubMonitor = PubSubMonitorTestClass
+        try:
+            pc.publish("channel", Item(HttpStreamFormat("x")))
+        finally:
+            src.grippubcontrolclient.PubSubMonitor = monitor_class
+        self.assertTrue(parent.is_closed())
+        self.assertFalse(client.sub_monitor is parent)
+        self.assertEqual(pc._stale_monitors, ())
+        pc.close()
+
+    @unittest.skipUnless(hasattr(os, "register_at_fork"), "requires at-fork hooks")
+    def test_fork(self):
+        pc = GripPubControl({"control_uri": "uri"})
+        client = pc.clients[0]
+        client.thread = "parent thread"
+        pid = os.fork()
+        if pid == 0:
+            ok = pc._pid == os.getpid() and client.thread is None
+            os._exit(0 if ok else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(client.thread, "parent thread")
+        client.thread = None
+
+    def test_publish_http_stream_chunks(self):
+        pc = GripPubControlChunksTestClass()
+        last_id = pc.publish_http_stream_chunks(
+            "channel", _chunks(20), "start", True, max_in_flight=3, id_prefix="s"
+        )
+        self.assertEqual(last_id, "s-21")
+        self.assertEqual(len(pc.items), 21)
+        self.assertTrue(pc.max_in_flight <= 3)
+        self.assertEqual(pc.in_flight, 0)
+        self.assertEqual(
+            pc.items[0][1].export(),
+            Item(HttpStreamFormat("chunk0"), "s-1", "start").export(),
+        )
+        self.assertEqual(
+            pc.items[19][1].export(),
+            Item(HttpStreamFormat("chunk19"), "s-20", "s-19").export(),
+        )
+        self.assertEqual(
+            pc.items[20][1].export(),
+            Item(HttpStreamFormat(close=True), "s-21", "s-20").export(),
+        )
+        for channel, item in pc.items:
+            self.assertEqual(channel, "channel")
+
+    def test_publish_sequencer(self):
+        pc = GripPubControlTestClass()
+        pc.sequencer = ChannelSequencer()
+        ns = pc.sequencer._namespace
+        pc.publish_http_response("channel", "item")
+        self.assertEqual(pc.publish_item.id, ns + "1")
+        self.assertEqual(pc.publish_item.prev_id, None)
+        pc.publish_http_stream("channel", "item")
+        self.assertEqual(pc.publish_item.id, ns + "2")
+        self.assertEqual(pc.publish_item.prev_id, ns + "1")
+        pc.publish_http_stream("other", "item")
+        self.assertEqual(pc.publish_item.id, ns + "3")
+        self.assertEqual(pc.publish_item.prev_id, None)
+        # explicit IDs are left alone
+        pc.publish_http_response("channel", "item", "id")
+        self.assertEqual(pc.publish_item.id, "id")
+        self.assertEqual(pc.publish_item.prev_id, None)
+        self.assertEqual(pc.sequencer.last_id("channel"), ns + "2")
+
+    def test_publish_http_stream_chunks_sequencer(self):
+        pc = GripPubControlChunksTestClass()
+        pc.sequencer = ChannelSequencer()
+        ns = pc.sequencer._namespace
+        pc.sequencer.sequence("channel")
+        last_id = pc.publish_http_stream_chunks("channel", ["a", "b"], close=True)
+        self.assertEqual(last_id, ns + "4")
+        self.assertEqual(
+            [(item.id, item.prev_id) for channel, item in pc.items],
+            [(ns + "2", ns + "1"), (ns + "3", ns + "2"), (ns + "4", ns + "3")],
+        )
+
+    def test_publish_http_stream_chunks_no_close(self):
+        pc = GripPubControlChunksTestClass()
+        last_id = pc.publish_http_stream_chunks("channel", ["a", "b"], max_in_flight=1)
+        self.assertEqual(len(pc.items), 2)
+        self.assertEqual(pc.max_in_flight, 1)
+        self.assertEqual(last_id, pc.items[1][1].id)
+        self.assertEqual(pc.items[0][1].prev_id, None)
+        self.assertEqual(pc.items[1][1].prev_id, pc.items[0][1].id)
+        with self.assertRaises(ValueError):
+            pc.publish_http_stream_chunks("channel", ["a"], max_in_flight=0)
+
+    def test_publish_http_stream_chunks_failure(self):
+        pc = GripPubControlChunksTestClass(fail_at=2)
+        with self.assertRaises(ValueError):
+            pc.publish_http_stream_chunks(
+                "channel", _chunks(1000), close=True, max_in_flight=2
+            )
+        # reading stops shortly after the failure
+        self.assertTrue(len(pc.items) <= 4)
+        self.assertFalse(pc.items[-1][1].formats[0].close)
+
 
 if __name__ == "__main__":
     unittest.main()
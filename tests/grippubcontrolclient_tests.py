@@ -0,0 +1,463 @@
+import sys
+import json
+import threading
+import unittest
+from pubcontrol import Item
+
+sys.path.append("../")
+import src.grippubcontrolclient
+from src.grippubcontrolclient import GripPubControlClient, _parse_retry_after
+from src.retrypolicy import RetryPolicy
+from src.circuitbreaker import CircuitBreaker, OPEN
+from src.publishmetrics import PublishMetrics
+from src.jwtcache import JwtCache
+from src.httpstreamformat import HttpStreamFormat
+from src.httpresponseformat import HttpResponseFormat
+from src.publishlane import PublishLane
+
+
+class ResponseTestClass(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = "text"
+
+
+class SessionTestClass(object):
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = 0
+
+    def post(self, uri, headers=None, data=None):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return ResponseTestClass(result)
+
+
+class GatedSessionTestClass(object):
+    def __init__(self):
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.bodies = []
+
+    def post(self, uri, headers=None, data=None):
+        self.bodies.append(json.loads(data.decode("utf-8")))
+        self.entered.set()
+        self.gate.wait()
+        return ResponseTestClass(200)
+
+
+def _make_client(results, retry_policy=None, circuit_breaker=None, metrics=None):
+    client = GripPubControlClient(
+        "uri",
+        retry_policy=retry_policy,
+        circuit_breaker=circuit_breaker,
+        metrics=metrics,
+    )
+    client.requests_session = SessionTestClass(results)
+    return client
+
+
+class TestGripPubControlClient(unittest.TestCase):
+    def test_initialize(self):
+        client = GripPubControlClient("uri", {"iss": "iss"}, "key")
+        self.assertEqual(client.uri, "uri")
+        self.assertEqual(client.auth_jwt_claim, {"iss": "iss"})
+        self.assertEqual(client.auth_jwt_key, "key")
+        self.assertEqual(client.retry_policy, None)
+        self.assertEqual(client.circuit_breaker, None)
+
+    def test_no_retry(self):
+        client = _make_client([503])
+        with self.assertRaises(ValueError):
+            client._make_http_request("uri", "data", {})
+        self.assertEqual(client.requests_session.calls, 1)
+
+    def test_retry(self):
+        client = _make_client(
+            [503, IOError("connection reset"), 200],
+            retry_policy=RetryPolicy(max_retries=2, base_delay=0),
+        )
+        ret = client._make_http_request("uri", "data", {})
+        self.assertEqual(ret[0], 200)
+        self.assertEqual(client.requests_session.calls, 3)
+
+    def test_retry_policy_disables_session_retries(self):
+        client = GripPubControlClient("http://localhost/")
+        adapter = client.requests_session.get_adapter("http://localhost/")
+        self.assertEqual(adapter.max_retries.total, 1)
+        client = GripPubControlClient(
+            "http://localhost/", retry_policy=RetryPolicy(max_retries=2)
+        )
+        for uri in ("http://localhost/", "https://localhost/"):
+            adapter = client.requests_session.get_adapter(uri)
+            self.assertEqual(adapter.max_retries.total, 0)
+
+    def test_retry_exhausted(self):
+        client = _make_client(
+            [500, 500, 500], retry_policy=RetryPolicy(max_retries=2, base_delay=0)
+        )
+        with self.assertRaises(ValueError):
+            client._make_http_request("uri", "data", {})
+        self.assertEqual(client.requests_session.calls, 3)
+
+    def test_no_retry_on_client_error(self):
+        client = _make_client(
+            [400, 200], retry_policy=RetryPolicy(max_retries=2, base_delay=0)
+        )
+        with self.assertRaises(ValueError):
+            client._make_http_request("uri", "data", {})
+        self.assertEqual(client.requests_session.calls, 1)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        client = _make_client([503, 503, 200], circuit_breaker=breaker)
+        for n in range(2):
+            with self.assertRaises(ValueError):
+                client._make_http_request("uri", "data", {})
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(ValueError):
+            client._make_http_request("uri", "data", {})
+        self.assertEqual(client.requests_session.calls, 2)
+
+    def test_circuit_breaker_stops_retries(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        client = _make_client(
+            [503, 200],
+            retry_policy=RetryPolicy(max_retries=3, base_delay=0),
+            circuit_breaker=breaker,
+        )
+        with self.assertRaises(ValueError):
+            client._make_http_request("uri", "data", {})
+        self.assertEqual(client.requests_session.calls, 1)
+
+    def test_publish_circuit_open(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record_failure()
+        client = _make_client([], circuit_breaker=breaker)
+        results = []
+        client.publish(
+            "channel",
+            Item(HttpStreamFormat("content")),
+            callback=lambda result, message: results.append((result, message)),
+        )
+        self.assertEqual(results, [(False, "circuit breaker open for uri")])
+        with self.assertRaises(ValueError):
+            client.publish("channel", Item(HttpStreamFormat("content")))
+        self.assertEqual(client.requests_session.calls, 0)
+
+    def test_metrics_blocking(self):
+        metrics = PublishMetrics()
+        client = _make_client(
+            [503, 200, 400],
+            retry_policy=RetryPolicy(max_retries=1, base_delay=0),
+            metrics=metrics,
+        )
+        client.publish("channel", Item(HttpStreamFormat("content")), blocking=True)
+        with self.assertRaises(ValueError):
+            client.publish("channel", Item(HttpStreamFormat("content")), blocking=True)
+        out = metrics.export()
+        self.assertEqual(
+            out["counters"]["uri"],
+            {"requests": 2, "retries": 1, "items_published": 1, "items_failed": 1},
+        )
+        latencies = out["latencies"]["uri"]
+        self.assertEqual(latencies["export"]["count"], 2)
+        self.assertEqual(latencies["serialize"]["count"], 2)
+        self.assertEqual(latencies["network"]["count"], 2)
+        self.assertFalse("queue" in latencies)
+
+    def test_metrics_async(self):
+        metrics = PublishMetrics()
+        client = _make_client([200], metrics=metrics)
+        results = []
+        client.publish(
+            "channel",
+            Item(HttpStreamFormat("content")),
+            callback=lambda result, message: results.append(result),
+        )
+        client.wait_all_sent()
+        self.assertEqual(results, [True])
+        out = metrics.export()
+        self.assertEqual(out["counters"]["uri"]["items_published"], 1)
+        self.assertEqual(out["latencies"]["uri"]["queue"]["count"], 1)
+
+    def test_metrics_circuit_rejected(self):
+        metrics = PublishMetrics()
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record_failure()
+        client = _make_client([], circuit_breaker=breaker, metrics=metrics)
+        client.publish(
+            "channel",
+            Item(HttpStreamFormat("content")),
+            callback=lambda result, message: None,
+        )
+        self.assertEqual(metrics.export()["counters"]["uri"], {"circuit_rejected": 1})
+
+    def test_jwt_cache(self):
+        client = GripPubControlClient("uri", {"iss": "realm"}, "key")
+        self.assertEqual(client.jwt_cache, None)
+        self.assertNotEqual(client._gen_auth_header(), None)
+        cache = JwtCache()
+        client = GripPubControlClient("uri", {"iss": "realm"}, "key", jwt_cache=cache)
+        header = client._gen_auth_header()
+        self.assertTrue(header.startswith("Bearer "))
+        self.assertTrue(client._gen_auth_header() is header)
+        client.set_auth_bearer("token")
+        self.assertEqual(client._gen_auth_header(), "Bearer token")
+        client = GripPubControlClient("uri", jwt_cache=cache)
+        self.assertEqual(client._gen_auth_header(), None)
+
+    def test_jwt_cache_prefetch_warms(self):
+        cache = JwtCache(prefetch=True)
+        claim = {"iss": "realm"}
+        GripPubControlClient("uri", claim, "key", jwt_cache=cache)
+        self.assertTrue(cache._state[0] is claim)
+
+    def test_conflate(self):
+        metrics = PublishMetrics()
+        client = GripPubControlClient("uri", metrics=metrics, conflate=True)
+        session = GatedSessionTestClass()
+        client.requests_session = session
+        results = []
+
+        def callback(result, message):
+            results.append(result)
+
+        # hold the worker in a request so that further publishes queue up
+        client.publish("other", Item(HttpStreamFormat("first")))
+        session.entered.wait()
+        client.publish("channel", Item(HttpResponseFormat(body="1"), "1", "0"))
+        client.publish("channel", Item(HttpStreamFormat("stream")))
+        client.publish(
+            "channel", Item(HttpResponseFormat(body="2"), "2", "1"), callback=callback
+        )
+        client.publish(
+            "channel", Item(HttpResponseFormat(body="3"), "3", "2"), callback=callback
+        )
+        client.publish("other", Item(HttpResponseFormat(body="4"), "4"))
+        session.gate.set()
+        client.wait_all_sent()
+        self.assertEqual(results, [True, True])
+        self.assertEqual(len(session.bodies), 2)
+        self.assertEqual(
+            session.bodies[1]["items"],
+            [
+                {
+                    "channel": "channel",
+                    "id": "3",
+                    "prev-id": "0",
+                    "http-response": {"body": "3"},
+                },
+                {"channel": "channel", "http-stream": {"content": "stream"}},
+                {"channel": "other", "id": "4", "http-response": {"body": "4"}},
+            ],
+        )
+        self.assertEqual(metrics.export()["counters"]["uri"]["items_conflated"], 2)
+        self.assertEqual(client._conflate_pending, {})
+
+        # once sent, a new publish is queued again
+        session.entered.clear()
+        client.publish("channel", Item(HttpResponseFormat(body="5"), "5", "3"))
+        client.wait_all_sent()
+        self.assertEqual(
+            session.bodies[2]["items"],
+            [
+                {
+                    "channel": "channel",
+                    "id": "5",
+                    "prev-id": "3",
+                    "http-response": {"body": "5"},
+                }
+            ],
+        )
+
+    def test_conflate_blocking(self):
+        client = GripPubControlClient("uri", conflate=True)
+        session = GatedSessionTestClass()
+        client.requests_session = session
+        results = []
+
+        def callback(result, message):
+            results.append(result)
+
+        # hold the worker in a request so that further publishes queue up
+        client.publish("other", Item(HttpStreamFormat("first")))
+        session.entered.wait()
+        client.publish(
+            "channel", Item(HttpResponseFormat(body="1"), "1", "0"), callback=callback
+        )
+        client.publish("other", Item(HttpResponseFormat(body="2"), "2"))
+        # let further requests through while the worker is still held
+        held = session
+        session = GatedSessionTestClass()
+        session.gate.set()
+        session.bodies = held.bodies
+        client.requests_session = session
+        client.publish(
+            "channel", Item(HttpResponseFormat(body="3"), "3", "1"), blocking=True
+        )
+        self.assertEqual(results, [True])
+        self.assertFalse("channel" in client._conflate_pending)
+        held.gate.set()
+        client.wait_all_sent()
+        self.assertEqual(results, [True])
+        items = [item for body in session.bodies for item in body["items"]]
+        self.assertEqual(
+            items,
+            [
+                {"channel": "other", "http-stream": {"content": "first"}},
+                {
+                    "channel": "channel",
+                    "id": "3",
+                    "prev-id": "0",
+                    "http-response": {"body": "3"},
+                },
+                {"channel": "other", "id": "2", "http-response": {"body": "2"}},
+            ],
+        )
+
+    def test_conflate_disabled(self):
+        client = GripPubControlClient("uri")
+        session = GatedSessionTestClass()
+        client.requests_session = session
+        client.publish("other", Item(HttpStreamFormat("first")))
+        session.entered.wait()
+        client.publish("channel", Item(HttpResponseFormat(body="1"), "1"))
+        client.publish("channel", Item(HttpResponseFormat(body="2"), "2", "1"))
+        session.gate.set()
+        client.wait_all_sent()
+        self.assertEqual(len(session.bodies[1]["items"]), 2)
+
+    def test_lanes(self):
+        client = GripPubControlClient(
+            "uri", lanes={"realtime": PublishLane(batch_size=1), "bulk": PublishLane()}
+        )
+        session = GatedSessionTestClass()
+        client.requests_session = session
+        with self.assertRaises(ValueError):
+            client.publish("channel", Item(HttpStreamFormat("x")), lane="other")
+
+        # a stuck bulk request does not hold up the realtime lane
+        client.publish("bulk", Item(HttpStreamFormat("bulk1")), lane="bulk")
+        session.entered.wait()
+        session.entered.clear()
+        client.publish("bulk", Item(HttpStreamFormat("bulk2")), lane="bulk")
+        results = []
+        done = threading.Event()
+
+        def callback(result, message):
+            results.append(result)
+            done.set()
+
+        client.publish(
+            "realtime",
+            Item(HttpStreamFormat("now")),
+            callback=callback,
+            lane="realtime",
+        )
+        session.entered.wait()
+        self.assertEqual(
+            [body["items"][0]["channel"] for body in session.bodies],
+            ["bulk", "realtime"],
+        )
+        session.gate.set()
+        client.wait_all_sent()
+        self.assertEqual(results, [True])
+        self.assertEqual(len(session.bodies), 3)
+        self.assertEqual(
+            session.bodies[2]["items"][0]["http-stream"], {"content": "bulk2"}
+        )
+
+    def test_after_fork(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        client = GripPubControlClient(
+            "uri",
+            {"iss": "realm"},
+            "key",
+            circuit_breaker=breaker,
+            jwt_cache=JwtCache(),
+            conflate=True,
+            lanes={"bulk": PublishLane()},
+        )
+        client._conflate_pending["channel"] = ({}, None, None)
+        breaker._probe_in_flight = True
+        breaker_lock = breaker._lock
+        client._after_fork()
+        self.assertEqual(client._conflate_pending, {})
+        self.assertEqual(client.thread, None)
+        self.assertFalse(breaker._probe_in_flight)
+        self.assertFalse(breaker._lock is breaker_lock)
+        self.assertTrue(client._gen_auth_header().startswith("Bearer "))
+
+    def test_after_fork_sub_monitor(self):
+        class SessionClosed(object):
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        class PubSubMonitorTestClass(object):
+            def __init__(self, uri, claim, key, callback, bearer):
+                self.args = (uri, claim, key, callback, bearer)
+                self._lock = threading.Lock()
+                self._callback = callback
+                self._closed = False
+                self._requests_session = SessionClosed()
+
+            def is_closed(self):
+                return self._closed
+
+            def close(self):
+                with self._lock:
+                    self._closed = True
+
+            def is_channel_subscribed_to(self, channel):
+                return False
+
+        def callback(event, channel):
+            pass
+
+        client = GripPubControlClient("uri", {"iss": "realm"}, "key")
+        parent = PubSubMonitorTestClass("uri", None, None, callback, None)
+        parent._lock.acquire()  # held by a parent thread at fork time
+        client.sub_monitor = parent
+        monitor_class = src.grippubcontrolclient.PubSubMonitor
+        src.grippubcontrolclient.PubSubMonitor = PubSubMonitorTestClass
+        results = []
+        try:
+            client._after_fork()
+            # the monitor is only recreated on the first publish
+            self.assertTrue(client.sub_monitor is parent)
+            self.assertFalse(parent.is_closed())
+            client.publish(
+                "channel",
+                Item(HttpStreamFormat("x")),
+                callback=lambda result, message: results.append(result),
+            )
+        finally:
+            src.grippubcontrolclient.PubSubMonitor = monitor_class
+        self.assertEqual(results, [True])
+        self.assertTrue(parent.is_closed())
+        self.assertTrue(parent._requests_session.closed)
+        self.assertFalse(client.sub_monitor is parent)
+        self.assertEqual(
+            client.sub_monitor.args, ("uri", {"iss": "realm"}, "key", callback, None)
+        )
+        self.assertFalse(client._stale_monitor)
+        closed = client.sub_monitor
+        closed._closed = True
+        client._after_fork()
+        self.assertFalse(client._stale_monitor)
+        self.assertTrue(client.sub_monitor is closed)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(_parse_retry_after(None), None)
+        self.assertEqual(_parse_retry_after("2"), 2.0)
+        self.assertEqual(_parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
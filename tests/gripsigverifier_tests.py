@@ -0,0 +1,117 @@
+import sys
+import time
+import threading
+import unittest
+import jwt
+
+sys.path.append("../")
+import src.gripsigverifier
+from src.gripsigverifier import GripSigVerifier
+from src.gripcontrol import validate_sig
+
+
+def _token(key, kid=None, iss="realm", exp=3600):
+    claim = {"exp": int(time.time()) + exp}
+    if iss is not None:
+        claim["iss"] = iss
+    headers = {"kid": kid} if kid is not None else None
+    return jwt.encode(claim, key, headers=headers)
+
+
+class CountingVerify(object):
+    def __init__(self, verify):
+        self.verify = verify
+        self.calls = []
+
+    def __call__(self, token, key, alg, iss):
+        self.calls.append(key.key)
+        return self.verify(token, key, alg, iss)
+
+
+class TestGripSigVerifier(unittest.TestCase):
+    def setUp(self):
+        self.verify = CountingVerify(src.gripsigverifier._verify)
+        src.gripsigverifier._verify = self.verify
+
+    def tearDown(self):
+        src.gripsigverifier._verify = self.verify.verify
+
+    def test_kid(self):
+        verifier = GripSigVerifier({"k1": "key1", "k2": "key2", "k3": "key3"})
+        self.assertEqual(verifier.kids, ["k1", "k2", "k3"])
+        self.assertTrue(verifier.validate(_token("key2", "k2")))
+        self.assertEqual(self.verify.calls, ["key2"])
+        self.assertFalse(verifier.validate(_token("key2", "k1")))
+        # unknown key IDs are rejected without trying any key
+        self.verify.calls = []
+        self.assertFalse(verifier.validate(_token("key2", "k9")))
+        self.assertEqual(self.verify.calls, [])
+
+    def test_no_kid(self):
+        verifier = GripSigVerifier(
+            [
+                {"key": "key1", "iss": "a"},
+                {"key": "key2", "iss": "b"},
+                {"key": "key3"},
+            ]
+        )
+        self.assertTrue(verifier.validate(_token("key2", iss="b")))
+        self.assertEqual(self.verify.calls, ["key2"])
+        self.verify.calls = []
+        self.assertTrue(verifier.validate(_token("key3", iss="c")))
+        self.assertEqual(self.verify.calls, ["key1", "key2", "key3"])
+        # a key bound to an issuer does not accept other issuers
+        self.assertFalse(verifier.validate(_token("key1", iss="b")))
+
+    def test_validate_checks(self):
+        verifier = GripSigVerifier({"k1": "key1"})
+        self.assertFalse(verifier.validate(_token("key1", "k1", exp=-10)))
+        self.assertFalse(
+            verifier.validate(
+                jwt.encode({"iss": "realm"}, "key1", headers={"kid": "k1"})
+            )
+        )
+        self.assertTrue(verifier.validate(_token("key1", "k1"), "realm"))
+        self.assertFalse(verifier.validate(_token("key1", "k1"), "other"))
+        self.assertFalse(verifier.validate("invalid"))
+        self.assertFalse(GripSigVerifier().validate(_token("key1")))
+
+    def test_validate_sig(self):
+        verifier = GripSigVerifier({"k1": "key1"})
+        self.assertTrue(validate_sig(_token("key1", "k1"), verifier))
+        self.assertTrue(
+            validate_sig(_token("key1", "k1").encode("utf-8"), verifier, "realm")
+        )
+        self.assertFalse(validate_sig(_token("key2", "k1"), verifier))
+
+    def test_prepared_key_cached(self):
+        verifier = GripSigVerifier({"k1": "key1"})
+        verifier.validate(_token("key1", "k1"))
+        key = verifier._keyset.by_kid["k1"]
+        prepared = key.prepared["HS256"]
+        verifier.validate(_token("key1", "k1"))
+        self.assertTrue(key.prepared["HS256"] is prepared)
+
+    def test_hot_swap(self):
+        verifier = GripSigVerifier({"k1": "key1"})
+        token = _token("key2", "k2")
+        self.assertFalse(verifier.validate(token))
+        results = []
+
+        def validate():
+            for n in range(200):
+                results.append(verifier.validate(_token("key1", "k1")))
+
+        thread = threading.Thread(target=validate)
+        thread.start()
+        for n in range(50):
+            verifier.set_keys({"k1": "key1", "k2": "key2"})
+        thread.join()
+        self.assertTrue(all(results))
+        self.assertTrue(verifier.validate(token))
+        verifier.set_keys({"k2": "key2"})
+        self.assertFalse(verifier.validate(_token("key1", "k1")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import sys
+import unittest
+from struct import pack
+from base64 import b64encode
+
+sys.path.append("../")
+from pubcontrol import Item
+from src.gripzmqpubcontrolclient import GripZmqPubControlClient, _RawBinaryItem
+from src.httpresponseformat import HttpResponseFormat
+from src.httpstreamformat import HttpStreamFormat
+from src.websocketmessageformat import WebSocketMessageFormat
+
+DATA = pack("hhh", 253, 254, 255)
+
+
+class ZmqClientTestClass(GripZmqPubControlClient):
+    def __init__(self):
+        self.sent = []
+        self._push_sock = "sock"
+        self._pub_controller = None
+
+    def _discover_uris(self):
+        pass
+
+    def _verify_uri_config(self):
+        pass
+
+    def _send_to_zmq(self, content, channel):
+        self.sent.append((content, channel))
+
+
+class TestRawBinaryItem(unittest.TestCase):
+    def test_export(self):
+        item = Item(
+            [
+                HttpResponseFormat(body=DATA),
+                HttpStreamFormat(DATA),
+                WebSocketMessageFormat(DATA, True),
+            ],
+            "id",
+            "prev-id",
+        )
+        self.assertEqual(
+            _RawBinaryItem(item).export(True, True),
+            {
+                b"id": b"id",
+                b"prev-id": b"prev-id",
+                b"formats": {
+                    b"http-response": {b"body": DATA},
+                    b"http-stream": {b"content": DATA},
+                    b"ws-message": {b"content-bin": b64encode(DATA)},
+                },
+            },
+        )
+        self.assertEqual(
+            _RawBinaryItem(Item(HttpStreamFormat("text"))).export(),
+            {"http-stream": {"content": "text"}},
+        )
+
+    def test_duplicate_formats(self):
+        item = Item([HttpStreamFormat("a"), HttpStreamFormat("b")])
+        with self.assertRaises(ValueError):
+            _RawBinaryItem(item).export(True, True)
+
+
+class TestGripZmqPubControlClient(unittest.TestCase):
+    def test_publish(self):
+        client = ZmqClientTestClass()
+        results = []
+        client._publish(
+            "chan",
+            Item(HttpResponseFormat(body=DATA)),
+            callback=lambda result, message: results.append(result),
+        )
+        self.assertEqual(results, [True])
+        self.assertEqual(
+            client.sent,
+            [({b"formats": {b"http-response": {b"body": DATA}}}, b"chan")],
+        )
+
+    def test_after_fork(self):
+        client = ZmqClientTestClass()
+        client._context = None
+        connected = []
+        client.connect_zmq = lambda: connected.append(True)
+        client._after_fork()
+        self.assertEqual(client._push_sock, None)
+        self.assertEqual(client._publish_threads, [])
+        self.assertTrue(client._reconnect)
+        client._publish("chan", Item(HttpStreamFormat("text")))
+        self.assertEqual(connected, [True])
+        self.assertFalse(client._reconnect)
+        client._publish("chan", Item(HttpStreamFormat("text")))
+        self.assertEqual(connected, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import sys
+import copy
+import pickle
+import unittest
+
+sys.path.append("../")
+from src.headerset import HeaderSet
+
+
+class TestHeaderSet(unittest.TestCase):
+    def test_initialize(self):
+        headers = HeaderSet({"Content-Type": "text/plain"})
+        self.assertEqual(headers, {"Content-Type": "text/plain"})
+        self.assertTrue(isinstance(headers, dict))
+        self.assertEqual(hash(headers), hash(HeaderSet(headers)))
+
+    def test_immutable(self):
+        headers = HeaderSet({"Content-Type": "text/plain"})
+        with self.assertRaises(TypeError):
+            headers["Cache-Control"] = "no-cache"
+        with self.assertRaises(TypeError):
+            del headers["Content-Type"]
+        with self.assertRaises(TypeError):
+            headers.update({"A": "b"})
+        with self.assertRaises(TypeError):
+            headers.pop("Content-Type")
+        with self.assertRaises(TypeError):
+            headers.setdefault("A", "b")
+        with self.assertRaises(TypeError):
+            headers.clear()
+        self.assertEqual(headers, {"Content-Type": "text/plain"})
+
+    def test_intern(self):
+        a = HeaderSet.intern(
+            {"Content-Type": "text/plain", "Cache-Control": "no-cache"}
+        )
+        b = HeaderSet.intern(
+            {"Cache-Control": "no-cache", "Content-Type": "text/plain"}
+        )
+        c = HeaderSet.intern({"Content-Type": "text/html"})
+        self.assertTrue(a is b)
+        self.assertFalse(a is c)
+        self.assertTrue(HeaderSet.intern(a) is a)
+
+    def test_copy(self):
+        headers = HeaderSet({"Content-Type": "text/plain"})
+        for other in (
+            pickle.loads(pickle.dumps(headers)),
+            copy.copy(headers),
+            copy.deepcopy(headers),
+        ):
+            self.assertEqual(other, headers)
+            self.assertTrue(isinstance(other, HeaderSet))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -46,6 +46,32 @@ class TestHttpResponseFormat(unittest.TestCase):
             },
         )
 
+    def test_add_content_filters(self):
+        format = HttpResponseFormat(body="body")
+        self.assertTrue(format.add_content_filters("var-subst") is format)
+        format.add_content_filters("var-subst")
+        self.assertEqual(
+            format.export(), {"body": "body", "content-filters": ["var-subst"]}
+        )
+
+    def test_export_raw_binary(self):
+        format = HttpResponseFormat()
+        self.assertEqual(format.export(raw_binary=True), {"body": b""})
+        format = HttpResponseFormat(200, None, None, "body")
+        self.assertEqual(format.export(raw_binary=True), {"code": 200, "body": b"body"})
+        format = HttpResponseFormat(
+            "code", "reason", "headers", pack("hhh", 253, 254, 255)
+        )
+        self.assertEqual(
+            format.export(raw_binary=True),
+            {
+                "code": "code",
+                "reason": "reason",
+                "headers": "headers",
+                "body": pack("hhh", 253, 254, 255),
+            },
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
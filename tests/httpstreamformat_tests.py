@@ -37,6 +37,33 @@ class TestHttpStreamFormat(unittest.TestCase):
             format.export(), {"content-bin": b64encode(pack("hhh", 253, 254, 255))}
         )
 
+    def test_add_content_filters(self):
+        format = HttpStreamFormat("body")
+        self.assertTrue(format.add_content_filters("var-subst") is format)
+        format.add_content_filters("build-id", "var-subst")
+        self.assertEqual(
+            format.export(),
+            {"content": "body", "content-filters": ["var-subst", "build-id"]},
+        )
+        filters = ["f"]
+        format = HttpStreamFormat("body", content_filters=filters)
+        format.add_content_filters("g")
+        self.assertEqual(format.content_filters, ["f", "g"])
+        self.assertEqual(filters, ["f"])
+
+    def test_export_raw_binary(self):
+        format = HttpStreamFormat(None, True)
+        self.assertEqual(format.export(raw_binary=True), {"action": "close"})
+        format = HttpStreamFormat("body", content_filters=["f"])
+        self.assertEqual(
+            format.export(raw_binary=True),
+            {"content-filters": ["f"], "content": b"body"},
+        )
+        format = HttpStreamFormat(pack("hhh", 253, 254, 255))
+        self.assertEqual(
+            format.export(raw_binary=True), {"content": pack("hhh", 253, 254, 255)}
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.append("../")
+import src
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be loaded by importing the package on its own.
+_heavy_modules = ("jwt", "pubcontrol", "six", "requests", "copy")
+
+
+# Run the specified code in a fresh interpreter with -X importtime and
+# return a dict of each imported module to its cumulative import time in
+# microseconds.
+def _import_times(code):
+    proc = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=_root,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    times = {}
+    for line in err.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "requires module __getattr__")
+class TestInit(unittest.TestCase):
+    def test_exports(self):
+        for name in src.__all__:
+            self.assertTrue(getattr(src, name) is not None)
+        self.assertTrue("GripPubControl" in dir(src))
+        with self.assertRaises(AttributeError):
+            src.does_not_exist
+
+    def test_import_is_lazy(self):
+        times = _import_times("import src")
+        for module in _heavy_modules:
+            self.assertFalse(module in times, module)
+
+    def test_light_functions_stay_lazy(self):
+        times = _import_times(
+            "import src; src.create_hold_stream('channel'); "
+            "src.decode_websocket_events(b'OPEN\\r\\n')"
+        )
+        for module in _heavy_modules:
+            self.assertFalse(module in times, module)
+
+    def test_heavy_imports_on_use(self):
+        times = _import_times("import src; src.validate_sig('token', 'key')")
+        self.assertTrue("jwt" in times)
+        self.assertFalse("pubcontrol" in times)
+        times = _import_times("import src; src.GripPubControl")
+        self.assertTrue("pubcontrol" in times)
+
+    def test_import_time(self):
+        # importing the package must stay much cheaper than importing the
+        # publishing machinery
+        lazy = _import_times("import src")["src"]
+        eager = _import_times("import src.grippubcontrol")["src.grippubcontrol"]
+        self.assertTrue(lazy < eager, (lazy, eager))
+
+
+if __name__ == "__main__":
+    unittest.main()
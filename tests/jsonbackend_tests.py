@@ -0,0 +1,82 @@
+import sys
+import json
+import unittest
+
+sys.path.append("../")
+from src.jsonbackend import (
+    set_json_backend,
+    get_json_backend,
+    json_dumps,
+    json_dumps_bytes,
+    _import_backend,
+)
+from src.gripcontrol import create_hold_response, websocket_control_message
+from src.channel import Channel
+from src.response import Response
+
+_SAMPLES = [
+    {"type": "subscribe", "channel": "foo"},
+    {
+        "hold": {"mode": "response", "channels": [{"name": "a", "prev-id": "1"}]},
+        "response": {"code": 200, "headers": {"A": "b/c"}, "body": "✓\n"},
+    },
+    {"items": [{"channel": "c", "http-stream": {"content": "x"}}]},
+]
+
+
+class TestJsonBackend(unittest.TestCase):
+    def tearDown(self):
+        set_json_backend("json")
+
+    def test_default(self):
+        self.assertEqual(get_json_backend(), "json")
+        # the default backend is byte-compatible with the standard library
+        for sample in _SAMPLES:
+            self.assertEqual(json_dumps(sample), json.dumps(sample))
+            self.assertEqual(
+                json_dumps_bytes(sample), json.dumps(sample).encode("utf-8")
+            )
+
+    def test_auto(self):
+        set_json_backend("auto")
+        self.assertTrue(get_json_backend() in ("json", "orjson", "ujson"))
+        for sample in _SAMPLES:
+            self.assertEqual(json.loads(json_dumps(sample)), sample)
+            self.assertEqual(
+                json.loads(json_dumps_bytes(sample).decode("utf-8")), sample
+            )
+
+    def test_fast_backends(self):
+        for name in ("orjson", "ujson"):
+            if _import_backend(name) is None:
+                with self.assertRaises(ValueError):
+                    set_json_backend(name)
+                continue
+            set_json_backend(name)
+            for sample in _SAMPLES:
+                self.assertEqual(json.loads(json_dumps(sample)), sample)
+                self.assertTrue(isinstance(json_dumps_bytes(sample), bytes))
+
+    def test_custom(self):
+        set_json_backend(lambda obj: json.dumps(obj, separators=(",", ":")))
+        self.assertEqual(json_dumps({"a": 1}), '{"a":1}')
+        self.assertEqual(json_dumps_bytes({"a": 1}), b'{"a":1}')
+        self.assertEqual(websocket_control_message("detach"), '{"type":"detach"}')
+        with self.assertRaises(ValueError):
+            set_json_backend("unknown")
+
+    def test_builders_as_bytes(self):
+        hold = create_hold_response(
+            Channel("a", "1"), Response(200, None, {"A": "b"}, "body")
+        )
+        hold_bytes = create_hold_response(
+            Channel("a", "1"), Response(200, None, {"A": "b"}, "body"), as_bytes=True
+        )
+        self.assertEqual(hold_bytes, hold.encode("utf-8"))
+        self.assertEqual(
+            websocket_control_message("detach", as_bytes=True), b'{"type": "detach"}'
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
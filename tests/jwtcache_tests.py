@@ -0,0 +1,129 @@
+import sys
+import threading
+import time
+import unittest
+import jwt
+
+sys.path.append("../")
+import src.jwtcache
+from src.jwtcache import JwtCache
+
+
+class FakeTime(object):
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestJwtCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeTime(1000000.0)
+        src.jwtcache.time = self.clock
+
+    def tearDown(self):
+        src.jwtcache.time = time
+
+    def _claim(self, header):
+        self.assertTrue(header.startswith("Bearer "))
+        return jwt.decode(
+            header[7:], "key", algorithms=["HS256"], options={"verify_exp": False}
+        )
+
+    def test_initialize(self):
+        cache = JwtCache()
+        self.assertEqual(cache.ttl, 3600)
+        self.assertEqual(cache.refresh_margin, 300)
+        self.assertFalse(cache.prefetch)
+        with self.assertRaises(ValueError):
+            JwtCache(ttl=60, refresh_margin=60)
+
+    def test_get_header(self):
+        cache = JwtCache(ttl=100, refresh_margin=10)
+        claim = {"iss": "realm"}
+        header = cache.get_header(claim, "key")
+        self.assertEqual(self._claim(header), {"iss": "realm", "exp": 1000100})
+        self.assertEqual(claim, {"iss": "realm"})
+        self.clock.now += 89
+        self.assertTrue(cache.get_header(claim, "key") is header)
+        self.clock.now += 1
+        header2 = cache.get_header(claim, "key")
+        self.assertEqual(self._claim(header2)["exp"], 1000190)
+        # a different claim object mints a new token
+        header3 = cache.get_header({"iss": "other"}, "key")
+        self.assertEqual(self._claim(header3)["iss"], "other")
+        cache.clear()
+        self.assertFalse(cache.get_header(claim, "key") is header2)
+
+    def test_claim_exp(self):
+        cache = JwtCache(ttl=100, refresh_margin=10)
+        claim = {"iss": "realm", "exp": 1000050}
+        header = cache.get_header(claim, "key")
+        self.assertEqual(self._claim(header)["exp"], 1000050)
+        self.assertTrue(cache.get_header(claim, "key") is header)
+
+    def test_refresh_in_progress(self):
+        cache = JwtCache(ttl=100, refresh_margin=10)
+        claim = {"iss": "realm"}
+        header = cache.get_header(claim, "key")
+        self.clock.now += 95
+        cache._lock.acquire()
+        try:
+            self.assertTrue(cache.get_header(claim, "key") is header)
+        finally:
+            cache._lock.release()
+
+    def test_prefetch(self):
+        cache = JwtCache(ttl=100, refresh_margin=10, prefetch=True)
+        claim = {"iss": "realm"}
+        cache.warm(claim, "key")
+        header = cache.get_header(claim, "key")
+        self.clock.now += 95
+        self.assertTrue(cache.get_header(claim, "key") is header)
+        for n in range(100):
+            if cache._state[2] is not header:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self._claim(cache.get_header(claim, "key"))["exp"], 1000195)
+
+    def test_prefetch_does_not_block(self):
+        cache = JwtCache(ttl=100, refresh_margin=10, prefetch=True)
+        claim = {"iss": "realm"}
+        header = cache.get_header(claim, "key")
+        signing = threading.Event()
+        release = threading.Event()
+        sign = cache._sign
+
+        def slow_sign(claim, key):
+            signing.set()
+            release.wait(5)
+            return sign(claim, key)
+
+        cache._sign = slow_sign
+        self.clock.now += 95
+        self.assertTrue(cache.get_header(claim, "key") is header)
+        self.assertTrue(signing.wait(5))
+        results = []
+
+        def get():
+            results.append(cache.get_header(claim, "key"))
+
+        try:
+            thread = threading.Thread(target=get)
+            thread.start()
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+            self.assertTrue(results[0] is header)
+        finally:
+            release.set()
+        for n in range(100):
+            if cache._state[2] is not header:
+                break
+            time.sleep(0.01)
+        self.assertFalse(cache._refreshing)
+        self.assertEqual(self._claim(cache.get_header(claim, "key"))["exp"], 1000195)
+
+
+if __name__ == "__main__":
+    unittest.main()
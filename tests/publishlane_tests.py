@@ -0,0 +1,98 @@
+import sys
+import threading
+import unittest
+
+sys.path.append("../")
+from src.publishlane import PublishLane, _LaneQueue
+
+
+class TestPublishLane(unittest.TestCase):
+    def test_initialize(self):
+        lane = PublishLane()
+        self.assertEqual(lane.batch_size, 10)
+        self.assertEqual(lane.concurrency, 1)
+        lane = PublishLane(batch_size=100, concurrency=4)
+        self.assertEqual(lane.batch_size, 100)
+        self.assertEqual(lane.concurrency, 4)
+        with self.assertRaises(ValueError):
+            PublishLane(batch_size=0)
+        with self.assertRaises(ValueError):
+            PublishLane(concurrency=0)
+
+    def test_batches(self):
+        gate = threading.Event()
+        batches = []
+
+        def pubbatch(reqs):
+            gate.wait()
+            batches.append(reqs)
+
+        queue = _LaneQueue(PublishLane(batch_size=3), pubbatch)
+        for n in range(7):
+            queue.put(n)
+        gate.set()
+        queue.wait_all_sent()
+        self.assertEqual(sum(batches, []), list(range(7)))
+        self.assertTrue(all(len(reqs) <= 3 for reqs in batches))
+        self.assertEqual(queue.threads, [])
+
+    def test_concurrency(self):
+        lock = threading.Lock()
+        gate = threading.Event()
+        state = {"in_flight": 0, "max_in_flight": 0}
+
+        def pubbatch(reqs):
+            with lock:
+                state["in_flight"] += 1
+                state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            gate.wait()
+            with lock:
+                state["in_flight"] -= 1
+
+        queue = _LaneQueue(PublishLane(batch_size=1, concurrency=3), pubbatch)
+        for n in range(10):
+            queue.put(n)
+        self.assertTrue(len(queue.threads) <= 3)
+        gate.set()
+        queue.wait_all_sent()
+        self.assertTrue(1 <= state["max_in_flight"] <= 3)
+        self.assertEqual(state["in_flight"], 0)
+
+        # the queue can be used again after waiting
+        queue.put(10)
+        queue.wait_all_sent()
+
+    def test_failure(self):
+        results = []
+
+        def pubbatch(reqs):
+            if reqs[0][2] == "fail":
+                raise ValueError("error")
+            for req in reqs:
+                req[3](True, "")
+
+        def callback(result, message):
+            results.append((result, message))
+
+        queue = _LaneQueue(PublishLane(batch_size=1), pubbatch)
+        queue.put(("uri", None, "fail", callback))
+        queue.wait_all_sent()
+        queue.put(("uri", None, "item", callback))
+        queue.wait_all_sent()
+        self.assertEqual(results, [(False, "error"), (True, "")])
+
+    def test_dead_thread(self):
+        done = threading.Event()
+        queue = _LaneQueue(PublishLane(), lambda reqs: done.set())
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+        queue.threads.append(dead)
+        queue.put(0)
+        self.assertTrue(done.wait(5))
+        self.assertFalse(dead in queue.threads)
+        queue.wait_all_sent()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import sys
+import threading
+import unittest
+
+sys.path.append("../")
+from src.publishmetrics import PublishMetrics, LatencyHistogram, PHASE_NETWORK
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_record(self):
+        hist = LatencyHistogram()
+        self.assertEqual(hist.percentile(0.5), None)
+        for ms in range(1, 101):
+            hist.record(ms / 1000.0)
+        self.assertEqual(hist.count, 100)
+        self.assertEqual(hist.min, 1000)
+        self.assertEqual(hist.max, 100000)
+        # bucket error is bounded by 2 ** -3
+        self.assertTrue(abs(hist.percentile(0.5) - 0.050) <= 0.050 / 8)
+        self.assertTrue(abs(hist.percentile(0.99) - 0.099) <= 0.099 / 8)
+        self.assertEqual(hist.percentile(1.0), 0.1)
+
+    def test_export(self):
+        hist = LatencyHistogram()
+        self.assertEqual(hist.export(), {"count": 0, "sum": 0.0, "buckets": []})
+        hist.record(0.000005)
+        hist.record(0.000005)
+        out = hist.export()
+        self.assertEqual(out["count"], 2)
+        self.assertEqual(out["sum"], 0.00001)
+        self.assertEqual(out["min"], 0.000005)
+        self.assertEqual(out["p50"], 0.000005)
+        self.assertEqual(out["buckets"], [[0.000005, 2]])
+
+    def test_sparse_buckets(self):
+        hist = LatencyHistogram(significant_bits=2)
+        hist.record(1.0)
+        hist.record(1000.0)
+        self.assertEqual(len(hist.export()["buckets"]), 2)
+
+
+class TestPublishMetrics(unittest.TestCase):
+    def test_record(self):
+        metrics = PublishMetrics()
+        metrics.record_latency(PHASE_NETWORK, "uri", 0.01)
+        metrics.record_latency(PHASE_NETWORK, "uri2", 0.02)
+        metrics.increment("requests", "uri")
+        metrics.increment("items_published", "uri", 5)
+        out = metrics.export()
+        self.assertEqual(
+            out["counters"], {"uri": {"requests": 1, "items_published": 5}}
+        )
+        self.assertEqual(out["latencies"]["uri"]["network"]["count"], 1)
+        self.assertEqual(out["latencies"]["uri2"]["network"]["count"], 1)
+        metrics.reset()
+        self.assertEqual(metrics.export(), {"counters": {}, "latencies": {}})
+
+    def test_threads(self):
+        metrics = PublishMetrics()
+
+        def run():
+            for n in range(1000):
+                metrics.increment("requests", "uri")
+                metrics.record_latency(PHASE_NETWORK, "uri", 0.001)
+
+        threads = [threading.Thread(target=run) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        out = metrics.export()
+        self.assertEqual(out["counters"]["uri"]["requests"], 4000)
+        self.assertEqual(out["latencies"]["uri"]["network"]["count"], 4000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unittest
+from pubcontrol import Item
+
+sys.path.append("../")
+from src.publishsidecar import PublishSidecar, SidecarPubControl, _item_from_export
+from src.httpresponseformat import HttpResponseFormat
+from src.httpstreamformat import HttpStreamFormat
+from src.websocketmessageformat import WebSocketMessageFormat
+
+
+class PubTestClass(object):
+    def __init__(self):
+        self.published = []
+        self.results = []
+
+    def publish(self, channel, item, blocking=False, callback=None, lane=None):
+        result = self.results.pop(0) if self.results else True
+        if result is None:
+            raise ValueError("failed")
+        self.published.append((channel, item.export(), lane))
+        if callback:
+            callback(result, "" if result else "error")
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class TestPublishSidecar(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "publish.sock")
+        self.pub = PubTestClass()
+        self.sidecar = PublishSidecar(self.pub, self.path)
+        self.sidecar.start()
+
+    def tearDown(self):
+        self.sidecar.stop()
+        shutil.rmtree(self.dir)
+
+    def test_forward(self):
+        client = SidecarPubControl(self.path)
+        results = []
+        client.publish_http_response(
+            "channel",
+            "body",
+            "1",
+            "0",
+            callback=lambda result, message: results.append(result),
+        )
+        client.publish_http_stream("stream", HttpStreamFormat(b"\xff"), lane="bulk")
+        _wait_for(lambda: self.sidecar.forwarded == 2)
+        self.assertEqual(results, [True])
+        self.assertEqual(
+            self.pub.published,
+            [
+                (
+                    "channel",
+                    {"id": "1", "prev-id": "0", "http-response": {"body": "body"}},
+                    None,
+                ),
+                (
+                    "stream",
+                    Item(HttpStreamFormat(b"\xff")).export(),
+                    "bulk",
+                ),
+            ],
+        )
+        client.close()
+
+    def test_mode(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        path = os.path.join(self.dir, "shared.sock")
+        sidecar = PublishSidecar(self.pub, path, mode=0o660)
+        sidecar.start()
+        try:
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o660)
+        finally:
+            sidecar.stop()
+
+    def test_dedupe(self):
+        clients = [SidecarPubControl(self.path) for n in range(3)]
+        for client in clients:
+            client.publish_http_response("channel", "body", "1")
+        clients[0].publish_http_response("other", "body", "1")
+        clients[0].publish_http_response("channel", "body")
+        clients[1].publish_http_response("channel", "body")
+        _wait_for(lambda: self.sidecar.forwarded + self.sidecar.deduped == 6)
+        self.assertEqual(self.sidecar.forwarded, 4)
+        self.assertEqual(self.sidecar.deduped, 2)
+
+    def test_dedupe_failed(self):
+        client = SidecarPubControl(self.path)
+        self.pub.results = [None, False]
+        for n in range(4):
+            client.publish_http_response("channel", "body", "1")
+        _wait_for(lambda: self.sidecar.forwarded + self.sidecar.deduped == 3)
+        self.assertEqual(self.sidecar.failed, 1)
+        self.assertEqual(self.sidecar.forwarded, 2)
+        self.assertEqual(self.sidecar.deduped, 1)
+        self.assertEqual(len(self.pub.published), 2)
+
+    def test_invalid_frame(self):
+        client = SidecarPubControl(self.path)
+        client._send(b"\x00\x00\x00\x02{}")
+        data = b'{"channel": "channel", "item": {"json-object": {}}}'
+        client._send(struct.pack(">I", len(data)) + data)
+        client.publish_http_stream("channel", "content")
+        _wait_for(lambda: self.sidecar.forwarded == 1)
+        self.assertEqual(self.sidecar.failed, 2)
+        self.assertEqual(len(self.pub.published), 1)
+
+    def test_reconnect(self):
+        client = SidecarPubControl(self.path)
+        client.publish_http_stream("channel", "one")
+        _wait_for(lambda: self.sidecar.forwarded == 1)
+        self.sidecar.stop()
+        self.sidecar = PublishSidecar(self.pub, self.path)
+        self.sidecar.start()
+        client.publish_http_stream("channel", "two")
+        _wait_for(lambda: self.sidecar.forwarded == 1)
+        self.assertEqual(
+            [item["http-stream"]["content"] for _, item, _ in self.pub.published],
+            ["one", "two"],
+        )
+
+    def test_no_sidecar(self):
+        client = SidecarPubControl(os.path.join(self.dir, "missing.sock"))
+        results = []
+        client.publish_http_stream(
+            "channel",
+            "content",
+            callback=lambda result, message: results.append(result),
+        )
+        self.assertEqual(results, [False])
+        with self.assertRaises(ValueError):
+            client.publish_http_stream("channel", "content")
+
+    def test_item_from_export(self):
+        item = Item(
+            [HttpResponseFormat(body="body"), WebSocketMessageFormat("message")],
+            "id",
+            "prev-id",
+            {"key": "value"},
+        )
+        export = item.export()
+        self.assertEqual(_item_from_export(export).export(), export)
+        self.assertEqual(_item_from_export(export).export(True), item.export(True))
+        with self.assertRaises(ValueError):
+            _item_from_export({"other": {}})
+
+
+if __name__ == "__main__":
+    unittest.main()
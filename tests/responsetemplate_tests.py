@@ -0,0 +1,71 @@
+import sys
+import json
+import unittest
+from base64 import b64encode
+
+sys.path.append("../")
+from src.responsetemplate import ResponseTemplate
+from src.headerset import HeaderSet
+from src.response import Response
+from src.httpresponseformat import HttpResponseFormat
+from src.gripcontrol import create_hold_response, create_hold_stream
+
+HEADERS = {"Content-Type": "text/plain", "Cache-Control": "no-cache"}
+
+
+class TestResponseTemplate(unittest.TestCase):
+    def test_initialize(self):
+        template = ResponseTemplate(200, "OK", dict(HEADERS))
+        self.assertEqual(template.code, 200)
+        self.assertEqual(template.reason, "OK")
+        self.assertTrue(isinstance(template.headers, HeaderSet))
+        self.assertTrue(template.headers is ResponseTemplate(headers=HEADERS).headers)
+        self.assertEqual(ResponseTemplate().headers, None)
+
+    def test_format(self):
+        template = ResponseTemplate(200, "OK", HEADERS)
+        for body in (None, "hello", b"\xff\xfe"):
+            format = template.format(body)
+            self.assertTrue(isinstance(format, HttpResponseFormat))
+            self.assertEqual(format.name(), "http-response")
+            self.assertEqual(
+                format.export(), HttpResponseFormat(200, "OK", HEADERS, body).export()
+            )
+        a = template.format("a").export()
+        b = template.format("b").export()
+        self.assertTrue(a["headers"] is b["headers"])
+        self.assertEqual(
+            template.format("a", ["skip-self"]).export(),
+            HttpResponseFormat(200, "OK", HEADERS, "a", ["skip-self"]).export(),
+        )
+        self.assertEqual(ResponseTemplate().format("a").export(), {"body": "a"})
+
+    def test_response(self):
+        templates = (
+            ResponseTemplate(200, "OK", HEADERS),
+            ResponseTemplate(reason="OK"),
+            ResponseTemplate(),
+        )
+        for template in templates:
+            for body in (None, "", "hello", b"\xff\xfe"):
+                response = template.response(body)
+                self.assertTrue(isinstance(response, Response))
+                plain = Response(template.code, template.reason, template.headers, body)
+                self.assertEqual(
+                    create_hold_response("chan", response, 30),
+                    create_hold_response("chan", plain, 30),
+                )
+                self.assertEqual(
+                    create_hold_stream("chan", response, as_bytes=True),
+                    create_hold_stream("chan", plain, as_bytes=True),
+                )
+        instruct = json.loads(
+            create_hold_response("chan", templates[0].response(b"\xff\xfe"))
+        )
+        self.assertEqual(
+            instruct["response"]["body-bin"], b64encode(b"\xff\xfe").decode("utf-8")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
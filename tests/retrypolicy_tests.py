@@ -0,0 +1,34 @@
+import sys
+import unittest
+
+sys.path.append("../")
+from src.retrypolicy import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_initialize(self):
+        policy = RetryPolicy()
+        self.assertEqual(policy.max_retries, 3)
+        self.assertEqual(policy.base_delay, 0.1)
+        self.assertEqual(policy.max_delay, 10.0)
+        self.assertTrue(policy.jitter)
+        with self.assertRaises(ValueError):
+            RetryPolicy(max_retries=-1)
+
+    def test_get_delay(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=False)
+        self.assertEqual(policy.get_delay(0), 1.0)
+        self.assertEqual(policy.get_delay(1), 2.0)
+        self.assertEqual(policy.get_delay(2), 4.0)
+        self.assertEqual(policy.get_delay(3), 5.0)
+        self.assertEqual(policy.get_delay(10), 5.0)
+
+    def test_get_delay_jitter(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+        for attempt in range(6):
+            delay = policy.get_delay(attempt)
+            self.assertTrue(0 <= delay <= min(5.0, 2.0**attempt))
+
+
+if __name__ == "__main__":
+    unittest.main()
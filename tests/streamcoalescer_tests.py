@@ -0,0 +1,185 @@
+import sys
+import threading
+import unittest
+
+sys.path.append("../")
+from src.streamcoalescer import StreamCoalescer, _TokenBucket
+from src.httpstreamformat import HttpStreamFormat
+
+
+class TargetTestClass(object):
+    def __init__(self, result=True):
+        self.clients = [object()]
+        self.result = result
+        self.items = []
+        self.published = threading.Event()
+
+    def publish(self, channel, item, blocking=False, callback=None):
+        self.items.append((channel, item.export()))
+        self.published.set()
+        callback(self.result, "" if self.result else "error")
+
+
+class TestStreamCoalescer(unittest.TestCase):
+    def test_coalesce(self):
+        target = TargetTestClass()
+        coalescer = StreamCoalescer(window=10)
+        results = []
+
+        def callback(result, message):
+            results.append(result)
+
+        for n in range(1, 4):
+            coalescer.add(
+                target,
+                "channel",
+                HttpStreamFormat("c%d" % n),
+                str(n),
+                str(n - 1),
+                callback=callback,
+            )
+        coalescer.add(target, "other", HttpStreamFormat("o"))
+        self.assertEqual(target.items, [])
+        coalescer.flush()
+        self.assertEqual(
+            sorted(target.items),
+            [
+                (
+                    "channel",
+                    {"id": "3", "prev-id": "0", "http-stream": {"content": "c1c2c3"}},
+                ),
+                ("other", {"http-stream": {"content": "o"}}),
+            ],
+        )
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(coalescer._channels, {})
+
+    def test_close_and_filters(self):
+        target = TargetTestClass()
+        coalescer = StreamCoalescer(window=10)
+        coalescer.add(target, "channel", HttpStreamFormat("a"))
+        coalescer.add(target, "channel", HttpStreamFormat("b", content_filters=["f"]))
+        coalescer.add(target, "channel", HttpStreamFormat("c", content_filters=["f"]))
+        coalescer.add(target, "channel", HttpStreamFormat(close=True), "4", "3")
+        coalescer.add(target, "channel", HttpStreamFormat("d"))
+        coalescer.flush()
+        self.assertEqual(
+            [item for channel, item in target.items],
+            [
+                {"http-stream": {"content": "a"}},
+                {"http-stream": {"content": "bc", "content-filters": ["f"]}},
+                {"id": "4", "prev-id": "3", "http-stream": {"action": "close"}},
+                {"http-stream": {"content": "d"}},
+            ],
+        )
+
+    def test_meta(self):
+        target = TargetTestClass()
+        coalescer = StreamCoalescer(window=10)
+        coalescer.add(target, "channel", HttpStreamFormat("a"), meta={"sender": "x"})
+        coalescer.add(target, "channel", HttpStreamFormat("b"), meta={"sender": "x"})
+        coalescer.add(target, "channel", HttpStreamFormat("c"), meta={"sender": "y"})
+        coalescer.add(target, "channel", HttpStreamFormat("d"))
+        coalescer.flush()
+        self.assertEqual(
+            [item for channel, item in target.items],
+            [
+                {"meta": {"sender": "x"}, "http-stream": {"content": "ab"}},
+                {"meta": {"sender": "y"}, "http-stream": {"content": "c"}},
+                {"http-stream": {"content": "d"}},
+            ],
+        )
+
+    def test_max_size(self):
+        target = TargetTestClass()
+        coalescer = StreamCoalescer(window=10, max_size=4)
+        coalescer.add(target, "channel", HttpStreamFormat("ab"))
+        coalescer.add(target, "channel", HttpStreamFormat(b"cd"))
+        self.assertTrue(target.published.wait(5))
+        coalescer.add(target, "channel", HttpStreamFormat("ef"))
+        coalescer.flush()
+        self.assertEqual(
+            [item["http-stream"]["content"] for channel, item in target.items],
+            ["abcd", "ef"],
+        )
+
+    def test_blocking(self):
+        target = TargetTestClass()
+        coalescer = StreamCoalescer(window=10)
+        coalescer.add(target, "channel", HttpStreamFormat("a"))
+        coalescer.add(target, "channel", HttpStreamFormat("b"), blocking=True)
+        self.assertEqual(
+            target.items, [("channel", {"http-stream": {"content": "ab"}})]
+        )
+        target.result = False
+        with self.assertRaises(ValueError):
+            coalescer.add(target, "channel", HttpStreamFormat("c"), blocking=True)
+
+    def test_rate(self):
+        target = TargetTestClass()
+        coalescer = StreamCoalescer(window=0, rate=0.01)
+        self.assertEqual(coalescer.burst, 1)
+        coalescer.add(target, "channel", HttpStreamFormat("a"), blocking=True)
+        for content in ("b", "c", "d"):
+            coalescer.add(target, "channel", HttpStreamFormat(content))
+        # the channel is out of tokens, so nothing more is published
+        self.assertEqual(len(target.items), 1)
+        self.assertTrue("channel" in coalescer._channels)
+        coalescer.flush()
+        self.assertEqual(
+            "".join(item["http-stream"]["content"] for channel, item in target.items),
+            "abcd",
+        )
+        self.assertTrue(len(target.items) <= 3)
+
+    def test_max_backlog(self):
+        target = TargetTestClass()
+        coalescer = StreamCoalescer(window=10, max_size=1, rate=0.01, max_backlog=2)
+        results = []
+
+        def callback(result, message):
+            results.append(result)
+
+        coalescer.add(target, "channel", HttpStreamFormat("a"), blocking=True)
+        for content in ("b", "c", "d"):
+            coalescer.add(
+                target, "channel", HttpStreamFormat(content), callback=callback
+            )
+        self.assertEqual(results, [False])
+        self.assertEqual(len(coalescer._channels["channel"].ready), 2)
+        with self.assertRaises(ValueError):
+            coalescer.add(target, "channel", HttpStreamFormat("e"), blocking=True)
+        coalescer.flush()
+        self.assertEqual(results, [False, True, True])
+        self.assertEqual(
+            [item["http-stream"]["content"] for channel, item in target.items],
+            ["a", "b", "c"],
+        )
+        with self.assertRaises(ValueError):
+            StreamCoalescer(max_backlog=0)
+
+    def test_no_clients(self):
+        target = TargetTestClass()
+        target.clients = []
+        coalescer = StreamCoalescer()
+        coalescer.add(target, "channel", HttpStreamFormat("a"), blocking=True)
+        self.assertEqual(len(target.items), 1)
+
+    def test_token_bucket(self):
+        bucket = _TokenBucket(2, 2, now=0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0.5)
+        self.assertFalse(bucket.is_full(0.5))
+        self.assertEqual(bucket.take(0.5), 0)
+        self.assertEqual(bucket.take(0.75), 0.25)
+        self.assertTrue(bucket.is_full(10))
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            StreamCoalescer(rate=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
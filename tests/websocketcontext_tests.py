@@ -7,6 +7,7 @@ sys.path.append("../")
 from src.gripcontrol import is_python3
 from src.websocketevent import WebSocketEvent
 from src.websocketcontext import WebSocketContext
+from src.gripcontrol import decode_websocket_events_many, encode_websocket_events
 
 
 def _b(s):
@@ -130,6 +131,89 @@ class TestWebSocketContext(unittest.TestCase):
         self.assertEqual(ws.out_events[1].type, "PONG")
         self.assertEqual(ws.out_events[1].content, _b("ping2"))
 
+    def test_batch(self):
+        batch = decode_websocket_events_many(
+            [b"OPEN\r\n", b"PING 1\r\nx\r\nTEXT 2\r\nhi\r\nCLOSE 2\r\n\x03\xe8\r\n"]
+        )
+        ws = WebSocketContext("conn-1", {}, batch.body(0))
+        self.assertTrue(ws.is_opening())
+        self.assertFalse(ws.can_recv())
+        ws = WebSocketContext("conn-1", {}, batch.body(1))
+        self.assertFalse(ws.is_opening())
+        self.assertTrue(ws.can_recv())
+        self.assertEqual(ws.recv(), "hi")
+        self.assertEqual(ws.out_events[0].type, "PONG")
+        self.assertEqual(ws.out_events[0].content, b"x")
+        self.assertEqual(ws.recv(), None)
+        self.assertEqual(ws.close_code, 1000)
+        self.assertFalse(ws.can_recv())
+
+    def test_reset(self):
+        ws = WebSocketContext(
+            "conn-1",
+            {"a": "1", "b": {"x": 1}},
+            [WebSocketEvent("TEXT", _b("hi"))],
+            "p-",
+        )
+        out_events = ws.out_events
+        ws.accept()
+        ws.recv()
+        ws.send("hello")
+        ws.meta["a"] = "2"
+        ws.meta["b"]["x"] = 2
+        ws.close(1000)
+        meta = {"c": "3"}
+        ws.reset("conn-2", meta, [WebSocketEvent("OPEN")])
+        self.assertEqual(ws.id, "conn-2")
+        self.assertTrue(ws.is_opening())
+        self.assertFalse(ws.accepted)
+        self.assertFalse(ws.closed)
+        self.assertEqual(ws.close_code, None)
+        self.assertEqual(ws.out_close_code, None)
+        self.assertEqual(ws.read_index, 0)
+        self.assertEqual(ws.out_events, [])
+        self.assertTrue(ws.out_events is out_events)
+        self.assertEqual(ws.meta, {"c": "3"})
+        self.assertFalse(ws.meta is meta)
+        self.assertTrue(ws.orig_meta is meta)
+        self.assertEqual(ws.grip_prefix, "")
+
+    def test_meta_copy(self):
+        meta = {"a": "1", "b": {"x": 1}}
+        ws = WebSocketContext("conn-1", meta, [])
+        ws.meta["b"]["x"] = 2
+        self.assertEqual(meta["b"]["x"], 1)
+
+    def test_buffered(self):
+        in_events = [
+            WebSocketEvent("PING", _b("p")),
+            WebSocketEvent("PING"),
+            WebSocketEvent("TEXT", _b("hi")),
+        ]
+        contexts = [
+            WebSocketContext("conn-1", {}, list(in_events)),
+            WebSocketContext("conn-1", {}, list(in_events), buffered=True),
+        ]
+        for ws in contexts:
+            self.assertEqual(ws.recv(), _s("hi"))
+            ws.send(_s("apple"))
+            ws.send(_b("banana"))
+            ws.send_binary(_b("\xff\x00"))
+            ws.send_binary(_s("date"))
+            ws.subscribe("chan")
+            ws.detach()
+        plain, buffered = contexts
+        self.assertEqual(buffered.out_events, [])
+        self.assertTrue(isinstance(buffered.out_buffer, bytearray))
+        self.assertEqual(plain.out_buffer, None)
+        self.assertEqual(
+            bytes(buffered.out_buffer), encode_websocket_events(plain.out_events)
+        )
+        self.assertEqual(buffered.encode_out_events(), plain.encode_out_events())
+        buffered.reset("conn-2", {}, [])
+        self.assertEqual(buffered.out_buffer, bytearray())
+        self.assertEqual(buffered.encode_out_events(), b"")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import sys
+import threading
+import unittest
+
+sys.path.append("../")
+from src.websocketevent import WebSocketEvent
+from src.websocketcontext import WebSocketContext
+from src.websocketcontextpool import WebSocketContextPool
+
+
+class TestWebSocketContextPool(unittest.TestCase):
+    def test_acquire_release(self):
+        pool = WebSocketContextPool()
+        ws = pool.acquire("conn-1", {"a": "1"}, [WebSocketEvent("OPEN")])
+        self.assertTrue(isinstance(ws, WebSocketContext))
+        self.assertEqual(len(pool), 0)
+        ws.accept()
+        ws.send("hello")
+        ws.meta["a"] = "2"
+        pool.release(ws)
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(ws.in_events, [])
+        self.assertEqual(ws.out_events, [])
+        self.assertEqual(ws.meta, {})
+        with self.assertRaises(ValueError):
+            pool.release(ws)
+        ws2 = pool.acquire("conn-2", {"b": "2"}, [], "p-")
+        self.assertTrue(ws2 is ws)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(ws2.id, "conn-2")
+        self.assertFalse(ws2.accepted)
+        self.assertEqual(ws2.meta, {"b": "2"})
+        self.assertEqual(ws2.grip_prefix, "p-")
+        pool.release(ws2)
+
+    def test_max_size(self):
+        pool = WebSocketContextPool(max_size=1)
+        a = pool.acquire("a", {}, [])
+        b = pool.acquire("b", {}, [])
+        pool.release(a)
+        pool.release(b)
+        self.assertEqual(len(pool), 1)
+
+    def test_context(self):
+        pool = WebSocketContextPool()
+        with pool.context("conn-1", {}, [WebSocketEvent("OPEN")]) as ws:
+            self.assertTrue(ws.is_opening())
+        self.assertEqual(len(pool), 1)
+        with self.assertRaises(RuntimeError):
+            with pool.context("conn-2", {}, []) as ws:
+                raise RuntimeError("error")
+        self.assertEqual(len(pool), 1)
+
+    def test_per_thread(self):
+        pool = WebSocketContextPool()
+        pool.release(pool.acquire("a", {}, []))
+        sizes = []
+        thread = threading.Thread(target=lambda: sizes.append(len(pool)))
+        thread.start()
+        thread.join()
+        self.assertEqual(sizes, [0])
+        self.assertEqual(len(pool), 1)
+
+    def test_buffered(self):
+        pool = WebSocketContextPool(buffered=True)
+        ws = pool.acquire("a", {}, [])
+        ws.send("hi")
+        pool.release(ws)
+        ws = pool.acquire("b", {}, [])
+        self.assertEqual(ws.out_buffer, bytearray())
+
+
+if __name__ == "__main__":
+    unittest.main()
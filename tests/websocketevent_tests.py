@@ -2,7 +2,12 @@ import sys
 import unittest
 
 sys.path.append("../")
-from src.websocketevent import WebSocketEvent
+from src.websocketevent import (
+    WebSocketEvent,
+    EVENT_TYPES,
+    TEXT,
+    decode_event_type,
+)
 
 
 class TestWebSocketEvent(unittest.TestCase):
@@ -14,6 +19,12 @@ class TestWebSocketEvent(unittest.TestCase):
         self.assertEqual(event.type, "type")
         self.assertEqual(event.content, "content")
 
+    def test_decode_event_type(self):
+        for etype in EVENT_TYPES:
+            self.assertTrue(decode_event_type(etype.encode("utf-8")) is etype)
+        self.assertTrue(decode_event_type(b"TEXT") is TEXT)
+        self.assertEqual(decode_event_type(b"CUSTOM"), "CUSTOM")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,118 @@
+import sys
+import pickle
+import unittest
+from array import array
+
+sys.path.append("../")
+from src.websocketeventbatch import (
+    WebSocketEventBatch,
+    WebSocketEventView,
+    NO_CONTENT,
+    _scan_body,
+    _initial_type_codes,
+)
+
+
+class TestWebSocketEventBatch(unittest.TestCase):
+    def test_initialize(self):
+        batch = WebSocketEventBatch()
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(batch.body_count, 0)
+        self.assertEqual(batch.payload, b"")
+        self.assertEqual(batch.type_names[:2], ["OPEN", "TEXT"])
+        self.assertEqual(batch.to_events(), [])
+
+    def test_scan_body(self):
+        batch = WebSocketEventBatch()
+        type_codes = _initial_type_codes()
+        _scan_body(batch, b"OPEN\r\nTEXT 2\r\nhi\r\n", 0, type_codes)
+        _scan_body(batch, b"NEW\r\nBINARY 1\r\nx\r\n", 18, type_codes)
+        batch.payload = b"OPEN\r\nTEXT 2\r\nhi\r\nNEW\r\nBINARY 1\r\nx\r\n"
+        self.assertEqual(list(batch.types), [0, 1, 7, 2])
+        self.assertEqual(
+            list(batch.spans), [0, NO_CONTENT, 14, 2, 0, NO_CONTENT, 33, 1]
+        )
+        self.assertEqual(list(batch.bounds), [0, 2, 4])
+        self.assertEqual(batch.type_names[7], "NEW")
+        self.assertEqual(type_codes[b"NEW"], 7)
+        events = batch.to_events(1)
+        self.assertEqual(
+            [(e.type, e.content) for e in events], [("NEW", None), ("BINARY", b"x")]
+        )
+        with self.assertRaises(ValueError):
+            _scan_body(batch, b"OPEN", 0, type_codes)
+
+    def test_truncated_content(self):
+        batch = WebSocketEventBatch()
+        _scan_body(batch, b"TEXT 9\r\nhi", 0, _initial_type_codes())
+        batch.payload = b"TEXT 9\r\nhi"
+        self.assertEqual(batch.get_content(0), b"hi")
+
+    def test_extend(self):
+        batch = WebSocketEventBatch()
+        _scan_body(batch, b"A\r\n", 0, _initial_type_codes())
+        other = WebSocketEventBatch()
+        _scan_body(other, b"B\r\nA\r\nTEXT 1\r\nx\r\n", 0, _initial_type_codes())
+        batch._extend(other, 3)
+        batch.payload = b"A\r\nB\r\nA\r\nTEXT 1\r\nx\r\n"
+        self.assertEqual([batch.get_type(n) for n in range(4)], ["A", "B", "A", "TEXT"])
+        self.assertEqual(batch.get_content(3), b"x")
+        self.assertEqual(list(batch.bounds), [0, 1, 4])
+        self.assertTrue(isinstance(batch.types, array))
+
+    def _batch(self):
+        body = b"OPEN\r\nTEXT 5\r\nhello\r\nPING\r\n"
+        batch = WebSocketEventBatch()
+        _scan_body(batch, body, 0, _initial_type_codes())
+        _scan_body(batch, b"BINARY 1\r\nx\r\n", len(body), _initial_type_codes())
+        batch.payload = body + b"BINARY 1\r\nx\r\n"
+        return batch
+
+    def test_views(self):
+        batch = self._batch()
+        view = batch[1]
+        self.assertTrue(isinstance(view, WebSocketEventView))
+        self.assertEqual(view.type, "TEXT")
+        self.assertEqual(view.content, b"hello")
+        self.assertEqual(batch[-1].type, "BINARY")
+        self.assertEqual(batch[-1].content, b"x")
+        self.assertEqual([e.type for e in batch[1:3]], ["TEXT", "PING"])
+        self.assertEqual(
+            [(e.type, e.content) for e in batch],
+            [("OPEN", None), ("TEXT", b"hello"), ("PING", None), ("BINARY", b"x")],
+        )
+        with self.assertRaises(IndexError):
+            batch[4]
+        with self.assertRaises(IndexError):
+            batch[-5]
+
+    def test_body(self):
+        batch = self._batch()
+        body = batch.body(1)
+        self.assertEqual(len(body), 1)
+        self.assertEqual(body.body_count, 1)
+        self.assertTrue(body.payload is batch.payload)
+        self.assertEqual(body[0].content, b"x")
+
+    def test_from_events_and_encode(self):
+        batch = self._batch()
+        copy = WebSocketEventBatch.from_events(list(batch))
+        self.assertEqual(copy.payload, b"hellox")
+        self.assertEqual(
+            [(e.type, e.content) for e in copy], [(e.type, e.content) for e in batch]
+        )
+        self.assertEqual(copy.encode(), batch.encode())
+        self.assertEqual(
+            batch.encode(), b"OPEN\r\nTEXT 5\r\nhello\r\nPING\r\nBINARY 1\r\nx\r\n"
+        )
+
+    def test_pickle(self):
+        batch = self._batch()
+        copy = pickle.loads(pickle.dumps(batch))
+        self.assertEqual(list(copy.types), list(batch.types))
+        self.assertEqual(copy.payload, batch.payload)
+        self.assertEqual(copy[1].content, b"hello")
+
+
+if __name__ == "__main__":
+    unittest.main()